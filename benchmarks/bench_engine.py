@@ -0,0 +1,140 @@
+"""
+Đo overhead của engine dịch với backend giả lập "local-echo" (không cần API key hay mạng).
+Sách thử được sinh ngẫu nhiên theo seed nên cùng tham số cho cùng một file, kết quả so sánh được giữa các commit.
+
+Ví dụ (chạy từ thư mục gốc của repo):
+    python benchmarks/bench_engine.py --size-mb 10 --workers 8
+    python benchmarks/bench_engine.py --size-mb 10 --trace-memory
+    python benchmarks/bench_engine.py --size-mb 50 --latency 0.05 --json
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "core"))
+
+# Chữ Hán thường gặp dùng để sinh nội dung thử
+_HANZI = "的一是不了人我在有他这中大来上个国到说们为子和你地出道也时年得就那要下以生会自着去之过家学对可她里后小么心多天而能好都然没日于起还发成事只作当想看文无开手十用主行方又如前所本见经头面公同三已老从动两长知民样现分将外但身些与高意进把法此实回二理美点月明其种声全工己话儿者向情部正名定女问力机给等几很业最间新什打便位因重被走电四第门相次东政海口使教西再平真听世气信北少关并内加化由却代军产入先山五太水万市眼体别处总才场师书比住员九笑性通目华报立马命张活难神数件安表原车白应路期叫死常提感金何更反合放做系计或司利受光王果亲界及今京务制解各任至清物台象记边共风战干接它许八特觉望直服毛林题建南度统色字请交爱让认算论百吃义科怎元社术结六功指思非流每青管夫连远资队跟带花快条院变联言权往展该领传近留红治决周保达办运武半候七必城父强步完革深区即求品士转量空甚众技轻程告江语英基派满式李息写呢识极令黄德收脸钱党倒未持取设始版双历越史商千片容研像找友孩站广改议形委早房音火际则首单据导影失拿网香似斯专石若兵弟谁校读志飞观争究包组造落视济喜离虽坏兴"
+
+
+def generate_book(path, size_mb, seed=2024, chapter_lines=120):
+    """Sinh file truyện thử (tiêu đề chương + các dòng 10-60 chữ Hán) có kích thước xấp xỉ size_mb"""
+    rng = random.Random(seed)
+    target_bytes = int(size_mb * 1024 * 1024)
+    written = 0
+    chapter = 0
+    with open(path, "w", encoding="utf-8") as f:
+        while written < target_bytes:
+            chapter += 1
+            lines = [f"第{chapter}章 {''.join(rng.choices(_HANZI, k=6))}\n"]
+            lines.extend("".join(rng.choices(_HANZI, k=rng.randint(10, 60))) + "。\n" for _ in range(chapter_lines - 1))
+            text = "".join(lines)
+            f.write(text)
+            written += len(text.encode("utf-8"))
+    return written
+
+
+@contextlib.contextmanager
+def _engine_log(verbose):
+    """Ẩn log của engine (trừ khi verbose) để chỉ in kết quả đo"""
+    if verbose:
+        yield
+        return
+    with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def run_benchmark(size_mb, workers, chunk_size_lines, latency, seed, stream, trace_memory=False, verbose=False):
+    """
+    Dịch sách thử một lần và trả về các số đo. trace_memory: đo bộ nhớ đỉnh bằng tracemalloc
+    (chậm hơn nhiều lần, thời gian đo được khi bật không dùng để so tốc độ).
+    """
+    try:
+        with _engine_log(verbose):
+            import local_backend
+            import translate
+    except ImportError as e:
+        raise SystemExit(f"❌ Không import được engine ({e}) - cài requirements.txt trước khi chạy benchmark")
+
+    local_backend.LOCAL_BACKEND_LATENCY = latency
+    with tempfile.TemporaryDirectory(prefix="bench_engine_") as work_dir:
+        input_file = os.path.join(work_dir, "book.txt")
+        book_bytes = generate_book(input_file, size_mb, seed)
+        output_file = os.path.join(work_dir, "book_out.txt")
+        requests_before = local_backend.local_stats['requests']
+        clients_before = local_backend.local_stats['clients_created']
+        previous_dir = os.getcwd()
+        # File trạng thái của engine (concurrency, key pool...) nằm trong thư mục tạm
+        os.chdir(work_dir)
+        try:
+            if trace_memory:
+                tracemalloc.start()
+            started = time.perf_counter()
+            with _engine_log(verbose):
+                ok = translate.translate_file_optimized(
+                    input_file, output_file, api_key="bench-key", model_name="local-echo", num_workers=workers,
+                    chunk_size_lines=chunk_size_lines, adaptive_concurrency=False, rate_limit_tier="off",
+                    use_translation_cache=False, stream_responses=stream,
+                )
+            elapsed = time.perf_counter() - started
+            peak_bytes = None
+            if trace_memory:
+                _, peak_bytes = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+        finally:
+            os.chdir(previous_dir)
+        with open(input_file, encoding="utf-8") as f:
+            total_lines = sum(1 for _ in f)
+
+    return {
+        'ok': bool(ok),
+        'size_mb': round(book_bytes / 1024 / 1024, 1),
+        'lines': total_lines,
+        'workers': workers,
+        'chunk_size_lines': chunk_size_lines,
+        'latency_seconds': latency,
+        'stream': stream,
+        'seed': seed,
+        'elapsed_seconds': round(elapsed, 2),
+        'lines_per_second': round(total_lines / elapsed, 1) if elapsed else None,
+        'peak_memory_mb': round(peak_bytes / 1024 / 1024, 1) if peak_bytes is not None else None,
+        'requests': local_backend.local_stats['requests'] - requests_before,
+        # Số lần tạo model/client: engine dùng lại model đã tạo cho mọi chunk cùng API key
+        'clients_created': local_backend.local_stats['clients_created'] - clients_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark engine dịch với backend giả lập local-echo")
+    parser.add_argument("--size-mb", type=float, default=10, help="kích thước sách thử (MB)")
+    parser.add_argument("--workers", type=int, default=8, help="số request đồng thời (cố định)")
+    parser.add_argument("--chunk-size", type=int, default=100, help="số dòng mỗi chunk")
+    parser.add_argument("--latency", type=float, default=0.0, help="độ trễ giả lập mỗi request (giây)")
+    parser.add_argument("--seed", type=int, default=2024, help="seed sinh nội dung sách thử")
+    parser.add_argument("--no-stream", action="store_true", help="nhận response một lần thay vì stream")
+    parser.add_argument("--trace-memory", action="store_true", help="đo bộ nhớ đỉnh bằng tracemalloc (chạy chậm hơn)")
+    parser.add_argument("--json", action="store_true", help="in kết quả dạng JSON")
+    parser.add_argument("--verbose", action="store_true", help="in log của engine")
+    args = parser.parse_args()
+
+    result = run_benchmark(args.size_mb, args.workers, args.chunk_size, args.latency, args.seed, not args.no_stream, args.trace_memory, args.verbose)
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False))
+        return
+    print(f"📚 Sách thử: {result['size_mb']} MB, {result['lines']} dòng (seed {result['seed']})")
+    print(f"⚙️ {result['workers']} request đồng thời, chunk {result['chunk_size_lines']} dòng, độ trễ {result['latency_seconds']}s, stream {'bật' if result['stream'] else 'tắt'}")
+    print(f"⏱️ {result['elapsed_seconds']}s ({result['lines_per_second']} dòng/giây), {result['requests']} request, tạo {result['clients_created']} model/client")
+    if result['peak_memory_mb'] is not None:
+        print(f"🧠 Bộ nhớ đỉnh (tracemalloc): {result['peak_memory_mb']} MB")
+    if not result['ok']:
+        print("⚠️ Engine báo dịch chưa xong")
+
+
+if __name__ == "__main__":
+    main()
@@ -76,6 +76,28 @@ a = Analysis(
         'docx.oxml.parser',
         'docx.oxml.shared',
         'src.core.translate',
+        'src.core.chunking',
+        'src.core.local_backend',
+        'src.core.concurrency',
+        'src.core.rate_limiter',
+        'src.core.retry_policy',
+        'src.core.key_pool',
+        'src.core.translation_cache',
+        'src.core.journal',
+        'src.core.incremental',
+        'src.core.context_cache',
+        'src.core.glossary',
+        'src.core.packing',
+        'src.core.passthrough',
+        'src.core.dedup',
+        'src.core.junk_filter',
+        'src.core.structured_output',
+        'src.core.bisection',
+        'src.core.retry_budget',
+        'src.core.hedging',
+        'src.core.scheduler',
+        'src.core.streaming',
+        'src.core.watchdog',
         'src.core.reformat', 
         'src.core.ConvertEpub',
         'src.gui.gui_modern',
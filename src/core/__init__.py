@@ -7,12 +7,13 @@ Contains the main translation engine and utility functions:
 - ConvertEpub.py: EPUB conversion functionality
 """
 
-from .translate import translate_file_optimized, generate_output_filename
+from .translate import translate_file_optimized, translate_file_async, generate_output_filename
 from .reformat import fix_text_format
 from .ConvertEpub import txt_to_docx, docx_to_epub
 
 __all__ = [
     'translate_file_optimized',
+    'translate_file_async',
     'generate_output_filename', 
     'fix_text_format',
     'txt_to_docx',
@@ -0,0 +1,86 @@
+"""
+Chia đôi chunk bị chặn (safety) hoặc bị cắt (MAX_TOKENS): thay vì gửi lại nguyên chunk đến hết lượt retry rồi
+thay cả 100 dòng bằng thông báo lỗi, chunk được chia đôi đệ quy đến khi cô lập được các dòng gây lỗi.
+Phần còn lại được dịch bình thường, dòng vẫn bị chặn được giữ nguyên văn bản gốc.
+"""
+try:
+    from .chunking import estimate_tokens
+except ImportError:
+    from chunking import estimate_tokens
+
+# Một dòng đã cô lập vẫn bị chặn/cắt: chỉ thử lại tối đa chừng này lần (lỗi kiểu này thường lặp lại y hệt)
+BISECT_LINE_MAX_ATTEMPTS = 2
+
+
+def split_in_halves(chunk_lines):
+    """
+    Chia chunk thành hai nửa có số dòng có nội dung gần bằng nhau (dòng trống đi theo nửa trước).
+    None nếu chunk chỉ có một dòng có nội dung (không chia được nữa).
+    """
+    content_indexes = [index for index, line in enumerate(chunk_lines) if line.strip()]
+    if len(content_indexes) < 2:
+        return None
+    split_at = content_indexes[len(content_indexes) // 2]
+    return chunk_lines[:split_at], chunk_lines[split_at:]
+
+
+def join_translated_parts(parts_lines, parts_text):
+    """Ghép bản dịch các nửa theo thứ tự; nửa chỉ có dòng trống giữ nguyên dòng trống"""
+    pieces = []
+    for part_lines, part_text in zip(parts_lines, parts_text):
+        if not part_text:
+            pieces.append("".join(part_lines))
+            continue
+        pieces.append(part_text if part_text.endswith("\n") else part_text + "\n")
+    return "".join(pieces)
+
+
+def count_content_lines(lines):
+    return sum(1 for line in lines if line.strip())
+
+
+class BisectionStats:
+    """
+    Thống kê chia đôi: số request/token đã dùng khi chia đôi so với số lần retry nguyên chunk
+    mà chính sách retry còn cho phép (và vẫn kết thúc bằng thông báo lỗi cho cả chunk).
+    calls_saved có thể âm: chia đôi tốn thêm request nhưng dịch được phần không bị chặn.
+    """
+    def __init__(self):
+        self.bisected_chunks = 0
+        self.bisect_requests = 0
+        self.bisect_tokens = 0
+        self.blind_retry_requests = 0
+        self.blind_retry_tokens = 0
+        self.content_lines = 0
+        self.fallback_lines = 0
+        self.fallback_tokens = 0
+
+    def record_root(self, chunk_lines, remaining_attempts):
+        """Một chunk gốc bắt đầu được chia đôi; remaining_attempts là số lần retry nguyên chunk còn lại"""
+        self.bisected_chunks += 1
+        self.blind_retry_requests += max(0, remaining_attempts)
+        self.blind_retry_tokens += max(0, remaining_attempts) * estimate_tokens("".join(chunk_lines))
+        self.content_lines += count_content_lines(chunk_lines)
+
+    def record_request(self, request_lines):
+        self.bisect_requests += 1
+        self.bisect_tokens += estimate_tokens("".join(request_lines))
+
+    def record_fallback(self, chunk_lines):
+        """Dòng vẫn bị chặn/cắt sau khi cô lập: giữ nguyên văn bản gốc"""
+        self.fallback_lines += count_content_lines(chunk_lines)
+        self.fallback_tokens += estimate_tokens("".join(chunk_lines))
+
+    def summary(self):
+        return {
+            'bisected_chunks': self.bisected_chunks,
+            'bisect_requests': self.bisect_requests,
+            'blind_retry_requests': self.blind_retry_requests,
+            'calls_saved': self.blind_retry_requests - self.bisect_requests,
+            'bisect_tokens': self.bisect_tokens,
+            'blind_retry_tokens': self.blind_retry_tokens,
+            'tokens_saved': self.blind_retry_tokens - self.bisect_tokens,
+            'recovered_lines': self.content_lines - self.fallback_lines,
+            'fallback_lines': self.fallback_lines,
+            'fallback_tokens': self.fallback_tokens,
+        }
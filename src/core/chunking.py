@@ -0,0 +1,186 @@
+import itertools
+
+
+def iter_source_lines(input_file):
+    """
+    Đọc file nguồn theo kiểu lazy, trả về từng dòng một.
+    Không bao giờ giữ toàn bộ file trong bộ nhớ.
+    """
+    with open(input_file, 'r', encoding='utf-8', errors='replace') as infile:
+        for line in infile:
+            yield line
+
+
+def count_source_lines(input_file):
+    """Đếm số dòng của file nguồn mà không nạp toàn bộ file vào bộ nhớ."""
+    total_lines = 0
+    for _ in iter_source_lines(input_file):
+        total_lines += 1
+    return total_lines
+
+
+def _split_line_chunks(lines_iter, chunk_size_lines):
+    """Chia một dãy dòng thành các chunk cố định theo số dòng, trả về từng danh sách dòng."""
+    lines_iter = iter(lines_iter)
+    while True:
+        chunk_lines = list(itertools.islice(lines_iter, chunk_size_lines))
+        if not chunk_lines:
+            break
+        yield chunk_lines
+
+
+def _number_chunks(chunks_iter):
+    """Đánh số chunk: trả về từng tuple (chunk_index, chunk_lines, start_line_index)."""
+    start_line = 0
+    for chunk_index, chunk_lines in enumerate(chunks_iter):
+        yield (chunk_index, chunk_lines, start_line)
+        start_line += len(chunk_lines)
+
+
+def iter_line_chunks(input_file, chunk_size_lines):
+    """
+    Generator chia file thành các chunk cố định theo số dòng.
+    Trả về từng tuple (chunk_index, chunk_lines, start_line_index).
+    """
+    return _number_chunks(_split_line_chunks(iter_source_lines(input_file), chunk_size_lines))
+
+
+# Các ký tự mở đầu một câu thoại (dùng để giữ nguyên khối hội thoại trong một chunk)
+DIALOGUE_MARKERS = ('"', '“', '「', '『', '‘', "'", '—', '――')
+
+# Khối hội thoại được phép vượt ngân sách token tối đa bao nhiêu lần trước khi buộc phải cắt
+MAX_DIALOGUE_BLOCK_BUDGET_RATIO = 2
+
+
+def _is_wide_char(char):
+    """Ký tự CJK/Kana/Hangul - mỗi ký tự thường tốn khoảng 1 token."""
+    code = ord(char)
+    return (
+        0x3040 <= code <= 0x30FF or    # Hiragana, Katakana
+        0x3400 <= code <= 0x4DBF or    # CJK Extension A
+        0x4E00 <= code <= 0x9FFF or    # CJK Unified Ideographs
+        0xAC00 <= code <= 0xD7AF or    # Hangul
+        0xF900 <= code <= 0xFAFF or    # CJK Compatibility Ideographs
+        0xFF00 <= code <= 0xFFEF       # Fullwidth forms
+    )
+
+
+def estimate_tokens(text):
+    """
+    Ước lượng số token của văn bản mà không cần gọi API.
+    Ký tự CJK tính ~1 token/ký tự, các ký tự khác tính ~4 ký tự/token.
+    """
+    wide_chars = 0
+    other_chars = 0
+    for char in text:
+        if char.isspace():
+            continue
+        if _is_wide_char(char):
+            wide_chars += 1
+        else:
+            other_chars += 1
+    return wide_chars + (other_chars + 3) // 4
+
+
+def _is_dialogue_line(line):
+    return line.lstrip().startswith(DIALOGUE_MARKERS)
+
+
+def _iter_paragraph_units(lines_iter):
+    """
+    Gom các dòng thành các đơn vị không được cắt ngang.
+    Mỗi đoạn văn là một dòng có nội dung kèm các dòng trống theo sau.
+    Các đoạn thoại liên tiếp được gom thành một khối hội thoại.
+    Trả về từng tuple (unit_lines, unit_tokens, is_dialogue).
+    """
+    unit_lines = []
+    unit_tokens = 0
+    for line in lines_iter:
+        if not line.strip():
+            # Dòng trống đi theo đoạn văn phía trước
+            unit_lines.append(line)
+            continue
+        if unit_lines:
+            yield (unit_lines, unit_tokens, _is_dialogue_line(unit_lines[0]))
+        unit_lines = [line]
+        unit_tokens = estimate_tokens(line)
+    if unit_lines:
+        yield (unit_lines, unit_tokens, _is_dialogue_line(unit_lines[0]))
+
+
+def _iter_blocks(lines_iter, token_budget):
+    """Gom các đoạn thoại liên tiếp thành một khối (tối đa MAX_DIALOGUE_BLOCK_BUDGET_RATIO lần ngân sách)."""
+    max_dialogue_tokens = token_budget * MAX_DIALOGUE_BLOCK_BUDGET_RATIO
+    block_lines = []
+    block_tokens = 0
+    block_is_dialogue = False
+    for unit_lines, unit_tokens, is_dialogue in _iter_paragraph_units(lines_iter):
+        can_merge = (
+            block_lines and block_is_dialogue and is_dialogue
+            and block_tokens + unit_tokens <= max_dialogue_tokens
+        )
+        if can_merge:
+            block_lines.extend(unit_lines)
+            block_tokens += unit_tokens
+            continue
+        if block_lines:
+            yield (block_lines, block_tokens)
+        block_lines = list(unit_lines)
+        block_tokens = unit_tokens
+        block_is_dialogue = is_dialogue
+    if block_lines:
+        yield (block_lines, block_tokens)
+
+
+def _split_token_chunks(lines_iter, token_budget):
+    """Chia một dãy dòng thành các chunk theo ngân sách token, trả về từng danh sách dòng."""
+    chunk_lines = []
+    chunk_tokens = 0
+    for block_lines, block_tokens in _iter_blocks(lines_iter, token_budget):
+        if chunk_lines and chunk_tokens + block_tokens > token_budget:
+            yield chunk_lines
+            chunk_lines = []
+            chunk_tokens = 0
+        chunk_lines.extend(block_lines)
+        chunk_tokens += block_tokens
+    if chunk_lines:
+        yield chunk_lines
+
+
+def iter_token_chunks(input_file, token_budget):
+    """
+    Generator chia file thành các chunk theo ngân sách token ước lượng.
+    Không bao giờ cắt giữa một đoạn văn hoặc một khối hội thoại; khối lớn hơn
+    ngân sách sẽ đứng riêng thành một chunk.
+    Trả về từng tuple (chunk_index, chunk_lines, start_line_index).
+    """
+    return _number_chunks(_split_token_chunks(iter_source_lines(input_file), token_budget))
+
+
+def split_lines_into_chunks(lines_iter, chunk_mode, chunk_size):
+    """Chia một dãy dòng bất kỳ (không phải file) thành các chunk, trả về từng danh sách dòng."""
+    if chunk_mode == "tokens":
+        return _split_token_chunks(lines_iter, chunk_size)
+    return _split_line_chunks(lines_iter, chunk_size)
+
+
+def iter_chunks(input_file, chunk_mode, chunk_size):
+    """
+    Chọn cách chia chunk theo chunk_mode:
+    - "lines": chunk_size là số dòng mỗi chunk
+    - "tokens": chunk_size là ngân sách token ước lượng mỗi chunk
+    """
+    if chunk_mode == "tokens":
+        return iter_token_chunks(input_file, chunk_size)
+    return iter_line_chunks(input_file, chunk_size)
+
+
+def count_chunks(input_file, chunk_mode, chunk_size):
+    """Đếm số chunk (đọc file theo kiểu streaming)."""
+    if chunk_mode == "lines":
+        total_lines = count_source_lines(input_file)
+        return (total_lines + chunk_size - 1) // chunk_size
+    total_chunks = 0
+    for _ in iter_chunks(input_file, chunk_mode, chunk_size):
+        total_chunks += 1
+    return total_chunks
@@ -0,0 +1,145 @@
+"""
+Điều khiển số request đồng thời theo kiểu AIMD (Additive Increase / Multiplicative Decrease).
+Tăng dần khi độ trễ ổn định, giảm mạnh khi gặp lỗi 429/rate limit.
+"""
+import hashlib
+import json
+import os
+import time
+
+try:
+    from .scheduler import PrioritySemaphore, DEFAULT_PRIORITY
+except ImportError:
+    from scheduler import PrioritySemaphore, DEFAULT_PRIORITY
+
+# File lưu mức đồng thời ổn định gần nhất cho từng (API key, model)
+CONCURRENCY_STATE_FILE = "concurrency_state.json"
+
+# Độ trễ vượt baseline bao nhiêu lần thì coi là "đang chậm lại" (ngừng tăng)
+LATENCY_TOLERANCE_RATIO = 1.5
+# Độ trễ vượt baseline bao nhiêu lần thì giảm nhẹ số request đồng thời
+LATENCY_BACKOFF_RATIO = 2.5
+# Hệ số giảm khi gặp rate limit / khi độ trễ tăng mạnh
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+LATENCY_DECREASE_FACTOR = 0.9
+# Sau một lần giảm, bỏ qua các lỗi 429 tiếp theo trong khoảng thời gian này (cùng một đợt burst)
+DECREASE_COOLDOWN_SECONDS = 2.0
+# Hệ số làm mượt EWMA cho độ trễ
+LATENCY_EWMA_ALPHA = 0.2
+
+
+class ConcurrencyController:
+    """
+    Giới hạn số request đồng thời, dùng như asyncio.Semaphore:
+        async with controller.slot(priority):
+            ...
+    Slot trống được cấp cho request có priority nhỏ nhất trước (xem scheduler.PrioritySemaphore).
+    Khi adaptive=True, giới hạn tự điều chỉnh theo độ trễ và lỗi rate limit.
+    """
+    def __init__(self, initial_limit, min_limit=1, max_limit=500, adaptive=True):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.adaptive = adaptive
+        self._slots = PrioritySemaphore(self.current_limit)
+        self.baseline_latency = None
+        self.smoothed_latency = None
+        self.rate_limited_count = 0
+        self._last_decrease_time = 0.0
+
+    @property
+    def current_limit(self):
+        """Số request đồng thời hiện được phép"""
+        return max(self.min_limit, int(self.limit))
+
+    @property
+    def in_flight(self):
+        return self._slots.in_use
+
+    @property
+    def waiting(self):
+        """Số request đang chờ slot"""
+        return self._slots.waiting()
+
+    def slot(self, priority=DEFAULT_PRIORITY):
+        return self._slots.slot(priority)
+
+    async def __aenter__(self):
+        await self._slots.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._slots.release()
+        return False
+
+    def on_success(self, latency_seconds):
+        """Ghi nhận một request thành công và độ trễ của nó"""
+        if not self.adaptive:
+            return
+        if self.smoothed_latency is None:
+            self.smoothed_latency = latency_seconds
+        else:
+            self.smoothed_latency += LATENCY_EWMA_ALPHA * (latency_seconds - self.smoothed_latency)
+
+        # Baseline là độ trễ thấp nhất quan sát được, cho phép trôi lên chậm để thích nghi
+        if self.baseline_latency is None or self.smoothed_latency < self.baseline_latency:
+            self.baseline_latency = self.smoothed_latency
+        else:
+            self.baseline_latency *= 1.001
+
+        if self.smoothed_latency <= self.baseline_latency * LATENCY_TOLERANCE_RATIO:
+            # Additive increase: khoảng +1 sau mỗi "vòng" request thành công
+            self._set_limit(self.limit + 1.0 / self.limit)
+        elif self.smoothed_latency > self.baseline_latency * LATENCY_BACKOFF_RATIO:
+            self._decrease(LATENCY_DECREASE_FACTOR)
+
+    def on_rate_limited(self):
+        """Ghi nhận lỗi 429/rate limit: giảm mạnh số request đồng thời"""
+        self.rate_limited_count += 1
+        if self.adaptive:
+            self._decrease(RATE_LIMIT_DECREASE_FACTOR)
+
+    def _decrease(self, factor):
+        now = time.monotonic()
+        if now - self._last_decrease_time < DECREASE_COOLDOWN_SECONDS:
+            return
+        self._last_decrease_time = now
+        self._set_limit(self.limit * factor)
+
+    def _set_limit(self, new_limit):
+        self.limit = min(max(new_limit, float(self.min_limit)), float(self.max_limit))
+        self._slots.limit = self.current_limit
+        self._slots.wake()
+
+
+def _state_key(api_key, model_name):
+    """Không lưu API key dạng rõ, chỉ lưu hash"""
+    key_hash = hashlib.sha256((api_key or "").encode('utf-8')).hexdigest()[:16]
+    return f"{key_hash}:{model_name}"
+
+
+def _read_state_file():
+    if not os.path.exists(CONCURRENCY_STATE_FILE):
+        return {}
+    try:
+        with open(CONCURRENCY_STATE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def load_concurrency_level(api_key, model_name):
+    """Đọc mức đồng thời ổn định của lần chạy trước (None nếu chưa có)"""
+    level = _read_state_file().get(_state_key(api_key, model_name))
+    return int(level) if level else None
+
+
+def save_concurrency_level(api_key, model_name, level):
+    """Lưu mức đồng thời ổn định để lần chạy sau bắt đầu gần mức này"""
+    state = _read_state_file()
+    state[_state_key(api_key, model_name)] = int(level)
+    try:
+        with open(CONCURRENCY_STATE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2)
+    except OSError as e:
+        print(f"⚠️ Lỗi khi lưu trạng thái concurrency: {e}")
@@ -0,0 +1,158 @@
+"""
+Context caching của Gemini: phần prompt dùng chung cho mọi chunk (system instruction + hướng dẫn dịch + glossary)
+được upload một lần thành cached content, các request chỉ gửi nội dung chunk và tham chiếu tới cache.
+Mỗi API key có cache riêng; cache được gia hạn trước khi hết TTL và xóa khi dịch xong.
+"""
+import asyncio
+import datetime
+import time
+
+from google.ai import generativelanguage as glm
+
+try:
+    from .local_backend import is_local_model, local_cache_service
+    from .chunking import estimate_tokens
+except ImportError:
+    from local_backend import is_local_model, local_cache_service
+    from chunking import estimate_tokens
+
+# Thời gian sống của cached content (giây)
+CONTEXT_CACHE_TTL_SECONDS = 3600
+
+# Gia hạn cache khi thời gian sống còn lại ít hơn mức này (giây)
+CONTEXT_CACHE_REFRESH_MARGIN_SECONDS = 300
+
+# Gemini từ chối cache phần prompt ngắn hơn mức tối thiểu (token) - theo tiền tố tên model
+MIN_CACHED_CONTEXT_TOKENS = {
+    "gemini-1.5": 32_768,
+    "gemini-2": 4_096,
+}
+DEFAULT_MIN_CACHED_CONTEXT_TOKENS = 4_096
+
+
+def get_min_cached_tokens(model_name):
+    """Số token tối thiểu để được dùng context caching với model này"""
+    if is_local_model(model_name):
+        return 0
+    model_name = (model_name or "").replace("models/", "")
+    best_match = None
+    for prefix in MIN_CACHED_CONTEXT_TOKENS:
+        if model_name.startswith(prefix) and (best_match is None or len(prefix) > len(best_match)):
+            best_match = prefix
+    return MIN_CACHED_CONTEXT_TOKENS[best_match] if best_match else DEFAULT_MIN_CACHED_CONTEXT_TOKENS
+
+
+def is_cache_missing_error(error):
+    """Lỗi do cached content đã hết hạn / bị xóa (cần tạo lại cache)"""
+    error_str = str(error).lower()
+    return "cachedcontent" in error_str or "cached content" in error_str or "cached_content" in error_str
+
+
+class ContextCacheManager:
+    """
+    Quản lý cached content cho mỗi API key.
+    get() trả về tên cache (tạo mới hoặc gia hạn nếu sắp hết hạn), None nếu không dùng được context caching
+    - khi đó request gửi prompt đầy đủ như bình thường.
+    """
+    def __init__(self, model_name, cached_instruction, ttl_seconds=CONTEXT_CACHE_TTL_SECONDS):
+        self.model_name = model_name
+        self.cached_instruction = cached_instruction
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = min(CONTEXT_CACHE_REFRESH_MARGIN_SECONDS, ttl_seconds / 4)
+        self.cached_tokens_estimate = estimate_tokens(cached_instruction)
+        self.enabled = self.cached_tokens_estimate >= get_min_cached_tokens(model_name)
+        # {api_key: (cache_name, expire_monotonic)}
+        self._caches = {}
+        self._locks = {}
+        self._clients = {}
+        self.created = 0
+        self.refreshed = 0
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def _client(self, api_key):
+        if is_local_model(self.model_name):
+            return local_cache_service
+        client = self._clients.get(api_key)
+        if client is None:
+            client = self._clients[api_key] = glm.CacheServiceAsyncClient(client_options={"api_key": api_key})
+        return client
+
+    def _model_path(self):
+        return self.model_name if self.model_name.startswith("models/") else f"models/{self.model_name}"
+
+    async def get(self, api_key):
+        """Tên cached content dùng cho api_key, None nếu context caching không khả dụng"""
+        if not self.enabled:
+            return None
+        lock = self._locks.setdefault(api_key, asyncio.Lock())
+        async with lock:
+            cache = self._caches.get(api_key)
+            now = time.monotonic()
+            if cache is not None and cache[1] - now > self.refresh_margin:
+                return cache[0]
+            try:
+                if cache is None:
+                    cache_name = await self._create(api_key)
+                    self.created += 1
+                else:
+                    cache_name = cache[0]
+                    await self._refresh(api_key, cache_name)
+                    self.refreshed += 1
+            except Exception as e:
+                if cache is not None and not is_cache_missing_error(e):
+                    # Gia hạn lỗi tạm thời: dùng tiếp cache cũ nếu còn hạn
+                    if cache[1] > now:
+                        return cache[0]
+                self._caches.pop(api_key, None)
+                if cache is None:
+                    # Không tạo được cache (model không hỗ trợ, prompt quá ngắn...): tắt context caching
+                    print(f"⚠️ Không tạo được context cache, gửi prompt đầy đủ: {e}")
+                    self.enabled = False
+                return None
+            self._caches[api_key] = (cache_name, time.monotonic() + self.ttl_seconds)
+            return cache_name
+
+    async def _create(self, api_key):
+        cached_content = glm.CachedContent(
+            model=self._model_path(),
+            system_instruction=glm.Content(parts=[glm.Part(text=self.cached_instruction)]),
+            ttl=datetime.timedelta(seconds=self.ttl_seconds),
+        )
+        result = await self._client(api_key).create_cached_content(cached_content=cached_content)
+        return result.name
+
+    async def _refresh(self, api_key, cache_name):
+        cached_content = glm.CachedContent(name=cache_name, ttl=datetime.timedelta(seconds=self.ttl_seconds))
+        await self._client(api_key).update_cached_content(cached_content=cached_content, update_mask={"paths": ["ttl"]})
+
+    def invalidate(self, api_key):
+        """Cache của api_key không còn dùng được (hết hạn / bị xóa): lần sau tạo lại"""
+        self._caches.pop(api_key, None)
+
+    def record_usage(self, prompt_tokens, cached_tokens):
+        """Ghi nhận số token đầu vào của một request dùng cache"""
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens or 0
+        self.cached_tokens += cached_tokens if cached_tokens is not None else self.cached_tokens_estimate
+
+    async def close(self):
+        """Xóa các cached content đã tạo (tránh tốn phí lưu trữ sau khi dịch xong)"""
+        for api_key, (cache_name, _) in list(self._caches.items()):
+            try:
+                await self._client(api_key).delete_cached_content(name=cache_name)
+            except Exception as e:
+                print(f"⚠️ Không xóa được context cache {cache_name}: {e}")
+        self._caches.clear()
+
+    def summary(self):
+        """Thống kê context caching của lần chạy"""
+        return {
+            'requests': self.requests,
+            'prompt_tokens': self.prompt_tokens,
+            'cached_tokens': self.cached_tokens,
+            'cached_ratio': round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0,
+            'caches_created': self.created,
+            'caches_refreshed': self.refreshed,
+        }
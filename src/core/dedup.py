@@ -0,0 +1,204 @@
+"""
+Khử trùng lặp trong cùng một cuốn sách: dòng và chunk lặp lại nhiều lần (chân chương, watermark của web,
+"còn tiếp", câu thoại lặp...) chỉ được dịch một lần, bản dịch được dùng lại ở mọi vị trí xuất hiện.
+Chỉ mục chỉ giữ hash 64-bit của mỗi dòng trong mảng (8 byte/dòng) nên dùng được với sách hàng triệu dòng.
+"""
+import asyncio
+import hashlib
+from array import array
+
+try:
+    from .chunking import estimate_tokens
+    from .passthrough import SPAN_TRANSLATE, SPAN_SHARED
+    from .retry_budget import is_failed_translation
+except ImportError:
+    from chunking import estimate_tokens
+    from passthrough import SPAN_TRANSLATE, SPAN_SHARED
+    from retry_budget import is_failed_translation
+
+# Dòng xuất hiện từ chừng này lần trở lên được dịch riêng một lần rồi dùng lại
+DEDUP_MIN_LINE_REPEATS = 3
+
+# Chunk giống hệt nhau xuất hiện từ chừng này lần trở lên được dịch một lần
+DEDUP_MIN_CHUNK_REPEATS = 2
+
+
+def normalize_line(line):
+    """Chuẩn hóa dòng để so trùng: bỏ khoảng trắng đầu/cuối và gộp khoảng trắng liên tiếp"""
+    return " ".join(line.split())
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def line_key(line):
+    return _hash64(normalize_line(line))
+
+
+def chunk_key(chunk_lines):
+    return _hash64("\n".join(normalize_line(line) for line in chunk_lines))
+
+
+# Chia hash vào các nhóm theo byte thấp, mỗi lần chỉ sắp xếp một nhóm (giới hạn bộ nhớ tạm khi sắp xếp)
+HASH_BUCKETS = 256
+
+
+class _HashCounter:
+    """Mảng hash 64-bit chia nhóm: 8 byte mỗi phần tử, đếm lặp bằng cách sắp xếp từng nhóm"""
+    def __init__(self):
+        self._buckets = [array('Q') for _ in range(HASH_BUCKETS)]
+
+    def add(self, value):
+        self._buckets[value % HASH_BUCKETS].append(value)
+
+    def repeated(self, min_repeats):
+        """Các hash xuất hiện ít nhất min_repeats lần"""
+        repeated = set()
+        for bucket in self._buckets:
+            run_value = None
+            run_length = 0
+            for value in sorted(bucket):
+                if value == run_value:
+                    run_length += 1
+                else:
+                    run_value = value
+                    run_length = 1
+                if run_length == min_repeats:
+                    repeated.add(value)
+        return repeated
+
+
+class BookDeduplicator:
+    """
+    Chỉ mục dòng/chunk lặp lại của cả cuốn sách và nơi giữ bản dịch dùng chung.
+    shared_line()/shared_chunk() đảm bảo mỗi mục lặp lại chỉ được dịch một lần kể cả khi
+    nhiều chunk chứa nó đang được dịch đồng thời.
+    """
+    def __init__(self, repeated_lines, repeated_chunks):
+        self.repeated_lines = repeated_lines
+        self.repeated_chunks = repeated_chunks
+        # Chỉ giữ bản dịch của các mục lặp lại: {key: bản dịch}
+        self._results = {}
+        self._inflight = {}
+        self.reused_lines = 0
+        self.reused_chunks = 0
+        self.reused_tokens = 0
+
+    def is_repeated_line(self, line):
+        return bool(self.repeated_lines) and bool(line.strip()) and line_key(line) in self.repeated_lines
+
+    def is_repeated_chunk(self, chunk_lines):
+        return bool(self.repeated_chunks) and chunk_key(chunk_lines) in self.repeated_chunks
+
+    def isolate_repeated_lines(self, spans, edges_only=False):
+        """
+        Tách các dòng lặp lại trong đoạn cần dịch thành đoạn SPAN_SHARED riêng (mỗi đoạn một dòng).
+        edges_only: chỉ tách dòng lặp lại ở đầu/cuối đoạn cần dịch, không cắt một đoạn thành nhiều request
+        (dùng khi không gộp được nhiều đoạn vào một request).
+        """
+        if not self.repeated_lines:
+            return spans
+        isolated = []
+        for kind, lines in spans:
+            if kind != SPAN_TRANSLATE:
+                isolated.append((kind, lines))
+                continue
+            parts = []
+            current = []
+            for line in lines:
+                if self.is_repeated_line(line):
+                    if current:
+                        parts.append((SPAN_TRANSLATE, current))
+                        current = []
+                    parts.append((SPAN_SHARED, [line]))
+                elif not line.strip() and not current and parts and parts[-1][0] == SPAN_SHARED:
+                    # Dòng trống sau dòng lặp lại: giữ đúng vị trí, đi theo dòng lặp lại
+                    parts[-1][1].append(line)
+                else:
+                    current.append(line)
+            if current:
+                parts.append((SPAN_TRANSLATE, current))
+            translate_indexes = [index for index, (part_kind, _) in enumerate(parts) if part_kind == SPAN_TRANSLATE]
+            if edges_only and len(translate_indexes) > 1:
+                first, last = translate_indexes[0], translate_indexes[-1]
+                merged_lines = [line for _, part_lines in parts[first:last + 1] for line in part_lines]
+                parts = parts[:first] + [(SPAN_TRANSLATE, merged_lines)] + parts[last + 1:]
+            isolated.extend(parts)
+        return isolated
+
+    async def shared_line(self, line, translate_once):
+        """Bản dịch dùng chung của một dòng lặp lại"""
+        return await self._run_shared(("line", line_key(line)), translate_once, estimate_tokens(line))
+
+    async def shared_chunk(self, chunk_lines, translate_once):
+        """Bản dịch dùng chung của một chunk lặp lại"""
+        return await self._run_shared(("chunk", chunk_key(chunk_lines)), translate_once, estimate_tokens("".join(chunk_lines)))
+
+    async def _run_shared(self, key, translate_once, source_tokens):
+        """
+        Dịch mục key bằng translate_once() ở lần đầu, các lần sau (hoặc đang chờ đồng thời) dùng lại kết quả.
+        Chỉ bản dịch đạt được dùng lại: None (bị dừng giữa chừng) và bản dịch mang dấu lỗi/chưa dịch không được lưu,
+        mỗi chỗ xuất hiện tự dịch lại bằng translate_once() của mình (retry, ngân sách retry và danh sách sửa riêng).
+        """
+        translated_text = self._results.get(key)
+        if translated_text is None and key in self._inflight:
+            translated_text = await asyncio.shield(self._inflight[key])
+            if translated_text is None or is_failed_translation(translated_text):
+                return await translate_once()
+        if translated_text is not None:
+            if key[0] == "chunk":
+                self.reused_chunks += 1
+            else:
+                self.reused_lines += 1
+            self.reused_tokens += source_tokens
+            return translated_text
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            translated_text = await translate_once()
+        finally:
+            del self._inflight[key]
+            if not future.done():
+                # Lỗi/bị hủy: các chunk đang chờ nhận None và tự dịch lại
+                future.set_result(translated_text)
+        if translated_text is not None and not is_failed_translation(translated_text):
+            self._results[key] = translated_text
+        return translated_text
+
+    def summary(self):
+        """
+        Thống kê dùng lại bản dịch: mỗi chunk dùng lại là một request API tránh được;
+        dòng dùng lại nằm trong request của chunk chứa nó nên chỉ tiết kiệm token.
+        """
+        return {
+            'repeated_lines': len(self.repeated_lines),
+            'repeated_chunks': len(self.repeated_chunks),
+            'reused_lines': self.reused_lines,
+            'reused_chunks': self.reused_chunks,
+            'calls_avoided': self.reused_chunks,
+            'tokens_avoided': self.reused_tokens,
+        }
+
+
+def build_book_deduplicator(chunks_iter, min_line_repeats=DEDUP_MIN_LINE_REPEATS, min_chunk_repeats=DEDUP_MIN_CHUNK_REPEATS):
+    """
+    Đọc một lượt toàn bộ chunk (iterable các danh sách dòng) để tìm dòng/chunk lặp lại.
+    Trả về BookDeduplicator, hoặc None nếu sách không có gì lặp lại.
+    """
+    line_hashes = _HashCounter()
+    chunk_hashes = _HashCounter()
+    for chunk_lines in chunks_iter:
+        if not "".join(chunk_lines).strip():
+            continue
+        chunk_hashes.add(chunk_key(chunk_lines))
+        for line in chunk_lines:
+            if line.strip():
+                line_hashes.add(line_key(line))
+    repeated_lines = line_hashes.repeated(min_line_repeats)
+    del line_hashes
+    repeated_chunks = chunk_hashes.repeated(min_chunk_repeats)
+    if not repeated_lines and not repeated_chunks:
+        return None
+    return BookDeduplicator(repeated_lines, repeated_chunks)
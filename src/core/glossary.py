@@ -0,0 +1,218 @@
+"""
+Bảng thuật ngữ (glossary): nạp cặp "nguyên văn = bản dịch" từ file và chỉ gửi kèm mỗi request
+những thuật ngữ thực sự xuất hiện trong chunk. Dò thuật ngữ bằng Aho-Corasick nên thời gian dò
+tỉ lệ với độ dài chunk, không phụ thuộc số thuật ngữ (hàng chục nghìn vẫn nhanh).
+Thuật ngữ chữ Latin chỉ khớp nguyên từ ("Li" không khớp trong "Lin" hay "Light").
+"""
+import json
+import os
+from collections import deque
+
+try:
+    from .chunking import estimate_tokens
+except ImportError:
+    from chunking import estimate_tokens
+
+# Dòng mở đầu khối thuật ngữ trong prompt
+GLOSSARY_HEADER = "Bảng thuật ngữ (dịch đúng theo bảng):"
+
+# Các dấu phân cách nguyên văn và bản dịch trong file glossary dạng text (thử theo thứ tự)
+GLOSSARY_SEPARATORS = ("\t", "=>", "->", "=", ":", "：")
+
+
+def _is_latin_word_char(char):
+    """Ký tự thuộc một từ chữ Latin (chữ/số ASCII, "_", chữ Latin có dấu); chữ Hán không tính"""
+    if char.isascii():
+        return char.isalnum() or char == "_"
+    return "\u00c0" <= char <= "\u024f" or "\u1e00" <= char <= "\u1eff"
+
+
+def _parse_glossary_line(line):
+    """Tách một dòng "nguyên văn = bản dịch", trả về None nếu không hợp lệ"""
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    for separator in GLOSSARY_SEPARATORS:
+        if separator in line:
+            source, _, target = line.partition(separator)
+            source, target = source.strip(), target.strip()
+            if source and target:
+                return (source, target)
+            return None
+    return None
+
+
+def load_glossary_entries(glossary_file):
+    """
+    Đọc file glossary, trả về danh sách (nguyên văn, bản dịch) theo thứ tự trong file.
+    Hỗ trợ file .json ({"nguyên văn": "bản dịch"}) hoặc file text mỗi dòng một cặp,
+    phân cách bằng tab, "=", "=>", "->", ":" hoặc "："; dòng bắt đầu bằng "#" là chú thích.
+    """
+    if glossary_file.lower().endswith(".json"):
+        with open(glossary_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return [(str(source), str(target)) for source, target in data.items() if source and target]
+
+    entries = []
+    with open(glossary_file, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            entry = _parse_glossary_line(line)
+            if entry:
+                entries.append(entry)
+    return entries
+
+
+class AhoCorasickMatcher:
+    """Automaton Aho-Corasick: tìm mọi pattern xuất hiện trong văn bản trong một lần duyệt."""
+    def __init__(self, patterns):
+        # Mỗi node: dict ký tự -> node con; fail link và danh sách pattern kết thúc tại node
+        self._goto = [{}]
+        self._fail = [0]
+        self._outputs = [[]]
+        self._lengths = [len(pattern) for pattern in patterns]
+        for pattern_id, pattern in enumerate(patterns):
+            self._add(pattern, pattern_id)
+        self._build_fail_links()
+
+    def _add(self, pattern, pattern_id):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+            node = next_node
+        self._outputs[node].append(pattern_id)
+
+    def _build_fail_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                # Kế thừa output của fail link để không phải đi ngược lúc tìm
+                self._outputs[child] = self._outputs[child] + self._outputs[self._fail[child]]
+
+    def find_all(self, text, accept=None):
+        """
+        Tập id các pattern xuất hiện trong text.
+        accept(pattern_id, start, end): tùy chọn, chỉ tính lần xuất hiện text[start:end] mà accept trả về True.
+        """
+        found = set()
+        goto, fail, outputs, lengths = self._goto, self._fail, self._outputs, self._lengths
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if outputs[node]:
+                if accept is None:
+                    found.update(outputs[node])
+                    continue
+                end = index + 1
+                for pattern_id in outputs[node]:
+                    if pattern_id not in found and accept(pattern_id, end - lengths[pattern_id], end):
+                        found.add(pattern_id)
+        return found
+
+
+class Glossary:
+    """
+    Glossary với bộ dò thuật ngữ. prompt_block(text) trả về khối thuật ngữ chỉ gồm các mục có trong text
+    (chuỗi rỗng nếu không có mục nào); record_request() ghi nhận số token tiết kiệm được so với gửi cả bảng.
+    """
+    def __init__(self, entries):
+        # Thuật ngữ trùng nhau: giữ bản dịch xuất hiện sau cùng
+        merged = {}
+        for source, target in entries:
+            merged[source] = target
+        self.entries = list(merged.items())
+        # Không phân biệt hoa thường với chữ Latin
+        patterns = [source.casefold() for source, _ in self.entries]
+        self._matcher = AhoCorasickMatcher(patterns)
+        # Thuật ngữ có chữ Latin: đầu/cuối thuật ngữ là chữ Latin thì phải là ranh giới từ
+        self._word_edges = [
+            (_is_latin_word_char(pattern[0]), _is_latin_word_char(pattern[-1])) if any(char.isascii() and char.isalpha() for char in pattern) else None
+            for pattern in patterns
+        ]
+        self.full_block_tokens = estimate_tokens(self.format_block(self.entries))
+        self.requests = 0
+        self.injected_terms = 0
+        self.injected_tokens = 0
+
+    @classmethod
+    def from_file(cls, glossary_file):
+        return cls(load_glossary_entries(glossary_file))
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def format_block(entries):
+        if not entries:
+            return ""
+        return GLOSSARY_HEADER + "\n" + "\n".join(f"{source} = {target}" for source, target in entries)
+
+    def match(self, text):
+        """Các mục glossary xuất hiện trong text, theo thứ tự trong file"""
+        text = text.casefold()
+
+        def is_whole_word(entry_id, start, end):
+            word_edges = self._word_edges[entry_id]
+            if word_edges is None:
+                return True
+            check_start, check_end = word_edges
+            if check_start and start > 0 and _is_latin_word_char(text[start - 1]):
+                return False
+            if check_end and end < len(text) and _is_latin_word_char(text[end]):
+                return False
+            return True
+
+        return [self.entries[entry_id] for entry_id in sorted(self._matcher.find_all(text, is_whole_word))]
+
+    def prompt_block(self, text):
+        """Khối thuật ngữ gửi kèm text (chunk hoặc gói nhiều chunk)"""
+        return self.format_block(self.match(text))
+
+    def record_request(self, block):
+        """Ghi nhận một request thực sự gửi kèm block (không tính chunk lấy từ cache)"""
+        self.requests += 1
+        self.injected_terms += block.count("\n")
+        self.injected_tokens += estimate_tokens(block)
+
+    def summary(self):
+        """Thống kê: số token glossary đã gửi so với gửi cả bảng cho mỗi request"""
+        full_tokens = self.full_block_tokens * self.requests
+        return {
+            'terms': len(self.entries),
+            'requests': self.requests,
+            'avg_terms_per_request': round(self.injected_terms / self.requests, 1) if self.requests else 0.0,
+            'injected_tokens': self.injected_tokens,
+            'full_glossary_tokens': full_tokens,
+            'saved_tokens': full_tokens - self.injected_tokens,
+        }
+
+
+def load_glossary(glossary_file):
+    """Nạp glossary từ file, None nếu không có file hoặc file rỗng/lỗi"""
+    if not glossary_file:
+        return None
+    if not os.path.exists(glossary_file):
+        print(f"⚠️ Không tìm thấy file glossary: {glossary_file}")
+        return None
+    try:
+        glossary = Glossary.from_file(glossary_file)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Lỗi đọc file glossary '{glossary_file}': {e}")
+        return None
+    if not glossary.entries:
+        print(f"⚠️ File glossary không có thuật ngữ hợp lệ: {glossary_file}")
+        return None
+    return glossary
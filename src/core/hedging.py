@@ -0,0 +1,78 @@
+"""
+Gửi request dự phòng (hedged request) cho chunk chậm: output được ghi theo đúng thứ tự, nên chunk đầu hàng chờ ghi
+mà chậm sẽ giữ chân mọi chunk đã xong sau nó (tiến độ đứng yên, cửa sổ gửi chunk không trượt được).
+Khi chunk đó đã chạy lâu hơn phân vị cao của độ trễ các chunk gần đây, gửi thêm một bản sao và nhận
+kết quả nào về trước; bản còn lại bị hủy. Bản sao đi qua rate limiter/key pool như mọi request khác.
+"""
+from array import array
+from collections import deque
+
+# Ngưỡng gửi bản sao: phân vị độ trễ của HEDGE_LATENCY_WINDOW chunk gần nhất, không thấp hơn HEDGE_MIN_DELAY_SECONDS
+HEDGE_LATENCY_PERCENTILE = 0.95
+HEDGE_LATENCY_WINDOW = 200
+HEDGE_MIN_DELAY_SECONDS = 5.0
+
+# Chưa đủ chừng này mẫu độ trễ thì chưa gửi bản sao (ngưỡng chưa đáng tin)
+HEDGE_MIN_SAMPLES = 10
+
+
+def percentile(sorted_values, fraction):
+    """Phân vị theo nearest-rank của dãy đã sắp xếp, None nếu dãy rỗng"""
+    if not sorted_values:
+        return None
+    rank = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class HedgeController:
+    """
+    Quyết định khi nào gửi bản sao cho chunk đầu hàng và thống kê kết quả.
+    record_latency() nhận độ trễ (giây) của mỗi chunk xong, should_hedge() so thời gian chunk đang chạy với ngưỡng.
+    """
+    def __init__(self, latency_percentile=HEDGE_LATENCY_PERCENTILE, min_delay=HEDGE_MIN_DELAY_SECONDS, min_samples=HEDGE_MIN_SAMPLES):
+        self.latency_percentile = latency_percentile
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self._recent = deque(maxlen=HEDGE_LATENCY_WINDOW)
+        # Độ trễ của mọi chunk trong lần dịch (8 byte/chunk) để báo cáo p50/p95/p99
+        self._all = array('d')
+        self.hedges_sent = 0
+        self.hedges_won = 0
+        self.primaries_won = 0
+
+    def record_latency(self, seconds):
+        self._recent.append(seconds)
+        self._all.append(seconds)
+
+    def threshold(self):
+        """Ngưỡng hiện tại (giây), None nếu chưa đủ mẫu"""
+        if len(self._recent) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(sorted(self._recent), self.latency_percentile))
+
+    def should_hedge(self, elapsed_seconds):
+        threshold = self.threshold()
+        return threshold is not None and elapsed_seconds >= threshold
+
+    def on_hedge_sent(self):
+        self.hedges_sent += 1
+
+    def on_hedge_resolved(self, hedge_won):
+        """Một trong hai bản đã có kết quả (bản còn lại bị hủy)"""
+        if hedge_won:
+            self.hedges_won += 1
+        else:
+            self.primaries_won += 1
+
+    def summary(self):
+        latencies = sorted(self._all)
+        threshold = self.threshold()
+        return {
+            'hedges_sent': self.hedges_sent,
+            'hedges_won': self.hedges_won,
+            'primaries_won': self.primaries_won,
+            'threshold_seconds': round(threshold, 2) if threshold is not None else None,
+            'chunk_latency_p50': round(percentile(latencies, 0.5) or 0.0, 2),
+            'chunk_latency_p95': round(percentile(latencies, 0.95) or 0.0, 2),
+            'chunk_latency_p99': round(percentile(latencies, 0.99) or 0.0, 2),
+        }
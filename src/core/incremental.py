@@ -0,0 +1,160 @@
+"""
+Dịch tăng dần: lưu hash nội dung gốc + bản dịch của từng chunk sau mỗi lần dịch xong (manifest).
+Lần sau chỉ dịch lại các chunk bị sửa hoặc mới thêm, phần còn lại lấy từ manifest.
+Ranh giới chunk cũ được dò lại theo nội dung nên chèn/xóa dòng chỉ ảnh hưởng các chunk bị sửa.
+"""
+import itertools
+import json
+import os
+from collections import deque
+
+try:
+    from .chunking import iter_source_lines, split_lines_into_chunks
+    from .journal import chunk_source_hash, line_hash
+except ImportError:
+    from chunking import iter_source_lines, split_lines_into_chunks
+    from journal import chunk_source_hash, line_hash
+
+# Hậu tố file manifest, đặt cạnh file input (ví dụ "truyen.txt.manifest.jsonl")
+MANIFEST_FILE_SUFFIX = ".manifest.jsonl"
+
+# Số dòng mới (không khớp chunk cũ nào) được gom tối đa trước khi chia chunk
+MAX_PENDING_NEW_LINES = 2000
+
+
+def get_manifest_path(input_file):
+    return f"{input_file}{MANIFEST_FILE_SUFFIX}"
+
+
+class TranslationManifest:
+    """
+    Manifest của lần dịch trước: mỗi dòng JSON {h: hash chunk, f: hash dòng đầu, n: số dòng, t: bản dịch}.
+    Chỉ giữ chỉ mục {hash dòng đầu: {số dòng: {hash chunk: offset}}} trong bộ nhớ, bản dịch đọc lại từ file.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.by_first_line = {}
+        self.max_lines = 0
+        self.chunk_count = 0
+        with open(path, 'rb') as f:
+            offset = 0
+            for raw_line in f:
+                line_offset = offset
+                offset += len(raw_line)
+                try:
+                    record = json.loads(raw_line)
+                except ValueError:
+                    break
+                if not record.get('h') or not record.get('f') or not record.get('n'):
+                    continue
+                by_length = self.by_first_line.setdefault(record['f'], {})
+                by_length.setdefault(record['n'], {})[record['h']] = line_offset
+                self.max_lines = max(self.max_lines, record['n'])
+                self.chunk_count += 1
+        self._file = open(path, 'rb')
+
+    def match(self, window):
+        """Tìm chunk cũ trùng với phần đầu của window (deque các dòng), ưu tiên chunk dài nhất. Trả về (số dòng, offset) hoặc None."""
+        by_length = self.by_first_line.get(line_hash(window[0]))
+        if not by_length:
+            return None
+        for lines_count in sorted(by_length, reverse=True):
+            if lines_count > len(window):
+                continue
+            offset = by_length[lines_count].get(chunk_source_hash(itertools.islice(window, 0, lines_count)))
+            if offset is not None:
+                return (lines_count, offset)
+        return None
+
+    def read_text(self, offset):
+        """Đọc bản dịch đã lưu tại offset"""
+        self._file.seek(offset)
+        return json.loads(self._file.readline())['t']
+
+    def close(self):
+        self._file.close()
+
+
+def open_manifest(input_file):
+    """Mở manifest của file input, None nếu chưa có hoặc bị hỏng"""
+    manifest_path = get_manifest_path(input_file)
+    if not os.path.exists(manifest_path):
+        return None
+    try:
+        manifest = TranslationManifest(manifest_path)
+    except OSError as e:
+        print(f"⚠️ Không đọc được manifest '{manifest_path}': {e}")
+        return None
+    if manifest.chunk_count == 0:
+        manifest.close()
+        return None
+    return manifest
+
+
+def plan_incremental_chunks(input_file, manifest, chunk_mode, chunk_size):
+    """
+    Chia file input thành chunk, dùng lại ranh giới chunk cũ ở những chỗ nội dung không đổi.
+    Trả về từng tuple (chunk_index, chunk_lines, start_line_index, reused_offset);
+    reused_offset là vị trí bản dịch cũ trong manifest, None nếu chunk cần dịch mới.
+    """
+    lines_iter = iter_source_lines(input_file)
+    window = deque()
+    new_lines = []
+    chunk_index = 0
+    start_line = 0
+
+    def flush_new_lines(final):
+        nonlocal new_lines, chunk_index, start_line
+        new_chunks = list(split_lines_into_chunks(new_lines, chunk_mode, chunk_size))
+        # Chưa gặp chunk cũ: giữ lại chunk cuối để nối tiếp với các dòng mới phía sau
+        new_lines = [] if final or not new_chunks else new_chunks.pop()
+        for chunk_lines in new_chunks:
+            yield (chunk_index, chunk_lines, start_line, None)
+            chunk_index += 1
+            start_line += len(chunk_lines)
+
+    while True:
+        while len(window) < manifest.max_lines:
+            line = next(lines_iter, None)
+            if line is None:
+                break
+            window.append(line)
+        if not window:
+            break
+
+        matched = manifest.match(window)
+        if matched is None:
+            new_lines.append(window.popleft())
+            if len(new_lines) >= MAX_PENDING_NEW_LINES:
+                yield from flush_new_lines(final=False)
+            continue
+
+        yield from flush_new_lines(final=True)
+        lines_count, offset = matched
+        chunk_lines = [window.popleft() for _ in range(lines_count)]
+        yield (chunk_index, chunk_lines, start_line, offset)
+        chunk_index += 1
+        start_line += lines_count
+
+    yield from flush_new_lines(final=True)
+
+
+def write_manifest(input_file, records):
+    """Ghi manifest mới từ các bản ghi nhật ký (theo thứ tự chunk). Trả về số chunk đã ghi."""
+    manifest_path = get_manifest_path(input_file)
+    temp_path = f"{manifest_path}.tmp"
+    written = 0
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            if not record.get('h') or record.get('t') is None:
+                # Bản ghi chuyển từ tiến độ kiểu cũ không có hash nội dung gốc: không dùng lại được
+                continue
+            if record.get('r') or record.get('x'):
+                # Chunk chưa dịch xong (hết ngân sách retry) hoặc bản dịch lỗi/bị chặn: lần dịch tăng dần sau phải dịch lại
+                continue
+            f.write(json.dumps({'h': record['h'], 'f': record.get('f'), 'n': record['n'], 't': record['t']}, ensure_ascii=False) + "\n")
+            written += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, manifest_path)
+    return written
@@ -0,0 +1,231 @@
+"""
+Nhật ký hoàn thành chunk (append-only, JSON Lines): mỗi chunk dịch xong được ghi một dòng
+{index, hash nội dung gốc, bản dịch} ngay khi xong, không cần chờ các chunk đứng trước.
+Dừng/crash giữa chừng không mất chunk nào đã dịch; file output được ghép lại từ nhật ký.
+Dòng đầu của nhật ký ghi cách chia chunk; đổi cách chia chunk (số dòng/token, lọc rác...) thì bản ghi cũ
+không còn khớp chỉ số chunk nên nhật ký được bắt đầu lại.
+"""
+import hashlib
+import json
+import os
+import time
+
+try:
+    from .chunking import iter_chunks
+except ImportError:
+    from chunking import iter_chunks
+
+# Hậu tố file nhật ký, đặt cạnh file input (ví dụ "truyen.txt.journal.jsonl")
+JOURNAL_FILE_SUFFIX = ".journal.jsonl"
+
+# Gom nhiều bản ghi rồi mới fsync: sau tối đa N bản ghi hoặc T giây
+JOURNAL_FSYNC_EVERY_RECORDS = 32
+JOURNAL_FSYNC_INTERVAL_SECONDS = 2.0
+
+
+def chunk_source_hash(chunk_lines):
+    """Hash nội dung gốc của chunk, dùng để kiểm tra bản ghi trong nhật ký còn khớp với file input"""
+    return hashlib.sha256("".join(chunk_lines).encode('utf-8')).hexdigest()[:20]
+
+
+def chunking_signature(chunk_mode, chunk_size, junk_filter=None, incremental=False):
+    """
+    Cách chia chunk của lần dịch (ghi ở đầu nhật ký): chunk_mode/chunk_size như iter_chunks,
+    junk_filter: chế độ lọc rác đã áp dụng lên file nguồn trước khi chia chunk (None nếu không lọc).
+    """
+    return {'mode': chunk_mode, 'size': chunk_size, 'junk': junk_filter, 'incremental': bool(incremental)}
+
+
+def line_hash(line):
+    """Hash một dòng gốc (dòng đầu của chunk), dùng để dò lại ranh giới chunk khi dịch tăng dần"""
+    return hashlib.sha256(line.encode('utf-8')).hexdigest()[:16]
+
+
+class CompletionJournal:
+    """
+    Nhật ký hoàn thành chunk.
+    Khi mở, chỉ giữ trong bộ nhớ vị trí (offset) và hash của bản ghi mới nhất cho mỗi chunk;
+    bản dịch được đọc lại từ file khi ghép output.
+    signature: cách chia chunk hiện tại (chunking_signature); nhật ký ghi theo cách chia khác bị bắt đầu lại.
+    """
+    def __init__(self, path, signature=None, fsync_every=JOURNAL_FSYNC_EVERY_RECORDS, fsync_interval=JOURNAL_FSYNC_INTERVAL_SECONDS):
+        self.path = path
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        # {chunk_index: (offset, source_hash, lines_count, needs_repair)}
+        self.entries = {}
+        self.signature = None
+        self._load()
+        reset = signature is not None and self.signature != signature and os.path.exists(path) and os.path.getsize(path) > 0
+        if reset:
+            print(f"🔄 Cách chia chunk đã đổi so với nhật ký {os.path.basename(path)}: bỏ {len(self.entries)} chunk cũ, dịch lại từ đầu")
+            self.entries = {}
+        self._file = open(path, 'wb' if reset else 'ab')
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        if signature is not None and self._file.tell() == 0:
+            self._file.write((json.dumps({'sig': signature}) + "\n").encode('utf-8'))
+            self._file.flush()
+            self.signature = signature
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        valid_size = 0
+        with open(self.path, 'rb') as f:
+            offset = 0
+            for raw_line in f:
+                line_offset = offset
+                offset += len(raw_line)
+                if not raw_line.endswith(b"\n"):
+                    # Bản ghi cuối bị cắt ngang do crash: bỏ qua
+                    break
+                try:
+                    record = json.loads(raw_line)
+                except ValueError:
+                    break
+                if 'sig' in record:
+                    self.signature = record['sig']
+                else:
+                    self.entries[record['i']] = (line_offset, record.get('h'), record.get('n', 0), bool(record.get('r')))
+                valid_size = offset
+        if valid_size < os.path.getsize(self.path):
+            # Cắt phần hỏng ở cuối để bản ghi mới nối tiếp đúng chỗ
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_size)
+
+    def is_done(self, chunk_index, source_hash=None):
+        """
+        Chunk đã có trong nhật ký (và nội dung gốc không đổi, nếu truyền source_hash).
+        Chunk cần sửa (needs_repair) chưa được tính là xong: lần chạy sau dịch lại.
+        """
+        entry = self.entries.get(chunk_index)
+        if entry is None or entry[3]:
+            return False
+        return source_hash is None or entry[1] is None or entry[1] == source_hash
+
+    def append(self, chunk_index, source_hash, translated_text, lines_count, first_line_hash=None, needs_repair=False, failed=False):
+        """
+        Ghi một chunk đã dịch xong; fsync theo nhóm.
+        needs_repair: bản ghi tạm (vd. văn bản gốc khi hết ngân sách retry) - vẫn dùng để ghép output nhưng lần sau dịch lại.
+        failed: bản dịch lỗi/bị chặn sau mọi lần thử - vẫn ghép vào output nhưng không vào manifest dịch tăng dần.
+        """
+        offset = self._file.tell()
+        record = {'i': chunk_index, 'h': source_hash, 'f': first_line_hash, 'n': lines_count, 't': translated_text}
+        if needs_repair:
+            record['r'] = 1
+        if failed:
+            record['x'] = 1
+        self._file.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+        self._file.flush()
+        self.entries[chunk_index] = (offset, source_hash, lines_count, needs_repair)
+        self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        """Đẩy các bản ghi đang chờ xuống đĩa"""
+        if self._file.closed:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def iter_records(self, chunk_count, valid_chunks=None):
+        """
+        Đọc lần lượt bản ghi mới nhất của chunk 0..chunk_count-1, dừng ở chunk đầu tiên chưa có.
+        valid_chunks: các chunk có bản ghi đã được đối chiếu hash với nội dung gốc hiện tại (is_done/append trong
+        lần chạy này); dừng ở chunk đầu tiên không nằm trong đó để không ghép bản dịch cũ không còn khớp.
+        """
+        self.sync()
+        with open(self.path, 'rb') as journal_file:
+            for chunk_index in range(chunk_count):
+                entry = self.entries.get(chunk_index)
+                if entry is None or (valid_chunks is not None and chunk_index not in valid_chunks):
+                    return
+                journal_file.seek(entry[0])
+                yield json.loads(journal_file.readline())
+
+    def repair_count(self):
+        """Số chunk đang chờ dịch lại (bản ghi mới nhất là needs_repair)"""
+        return sum(1 for entry in self.entries.values() if entry[3])
+
+    def write_output(self, output_file, chunk_count, valid_chunks=None):
+        """
+        Ghép file output từ nhật ký theo đúng thứ tự cho chunk 0..chunk_count-1.
+        Dừng ở chunk đầu tiên chưa có hoặc không nằm trong valid_chunks (không bao giờ ghi output bị thiếu đoạn
+        hay lẫn bản dịch cũ). Trả về số chunk đã ghi.
+        """
+        written = 0
+        with open(output_file, 'w', encoding='utf-8') as outfile:
+            for record in self.iter_records(chunk_count, valid_chunks):
+                chunk_text = record['t']
+                if chunk_text is None:
+                    # Chunk thuộc phần output chuyển từ file tiến độ kiểu cũ (đã nằm trong bản ghi của chunk 0)
+                    written += 1
+                    continue
+                outfile.write(chunk_text)
+                if not chunk_text.endswith('\n'):
+                    outfile.write('\n')
+                written += 1
+        return written
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def remove(self):
+        """Xóa file nhật ký (khi đã dịch xong)"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def get_journal_path(input_file):
+    return f"{input_file}{JOURNAL_FILE_SUFFIX}"
+
+
+def count_journal_chunks(input_file, signature=None):
+    """
+    Số chunk đã dịch xong còn dùng được trong nhật ký của file input (0 nếu chưa có), dùng để hiển thị "tiếp tục dịch".
+    Không tính chunk chờ dịch lại (hết ngân sách retry), và trả về 0 nếu nhật ký được ghi theo cách chia chunk
+    khác signature (lần dịch tới sẽ bắt đầu lại). Khi file nguồn không qua lọc rác, bản ghi có hash không khớp
+    nội dung hiện tại của chunk (file input đã bị sửa) cũng không được tính.
+    """
+    journal_path = get_journal_path(input_file)
+    if not os.path.exists(journal_path):
+        return 0
+    journal_signature = None
+    latest = {}
+    try:
+        with open(journal_path, 'rb') as f:
+            for raw_line in f:
+                if not raw_line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(raw_line)
+                except ValueError:
+                    break
+                if 'sig' in record:
+                    journal_signature = record['sig']
+                elif 'i' in record:
+                    latest[record['i']] = (record.get('h'), bool(record.get('r')))
+    except OSError:
+        return 0
+    if signature is not None and journal_signature != signature:
+        return 0
+    done = {index: source_hash for index, (source_hash, needs_repair) in latest.items() if not needs_repair}
+    if journal_signature is not None and not journal_signature.get('junk') and not journal_signature.get('incremental'):
+        # Đối chiếu hash với nội dung hiện tại của file input (cùng cách chia chunk với lần dịch trước)
+        try:
+            current_hashes = {
+                chunk_index: chunk_source_hash(chunk_lines)
+                for chunk_index, chunk_lines, _ in iter_chunks(input_file, journal_signature['mode'], journal_signature['size'])
+                if chunk_index in done
+            }
+        except OSError:
+            return 0
+        return sum(1 for index, source_hash in done.items() if source_hash is None or current_hashes.get(index) == source_hash)
+    return len(done)
@@ -0,0 +1,253 @@
+"""
+Lọc rác trước khi chia chunk: watermark/quảng cáo của web truyện ("本章未完，请点击下一页", URL trang web,
+kêu gọi bỏ phiếu...) bị xóa khỏi văn bản nguồn để không tốn token dịch rồi lại phải xóa tay.
+Pattern có sẵn và pattern của người dùng được gộp thành một regex duy nhất; tùy chọn tự phát hiện
+dòng ngắn lặp lại rải rác khắp sách (chân chương của web). Mọi thứ bị xóa được ghi vào file báo cáo.
+"""
+import hashlib
+import os
+import re
+
+try:
+    from .chunking import iter_source_lines, estimate_tokens, _is_wide_char, DIALOGUE_MARKERS
+    from .dedup import _HashCounter, line_key
+except ImportError:
+    from chunking import iter_source_lines, estimate_tokens, _is_wide_char, DIALOGUE_MARKERS
+    from dedup import _HashCounter, line_key
+
+# Pattern rác có sẵn của các web truyện Trung Quốc (mỗi pattern khớp phần cần xóa trong dòng)
+BUILTIN_JUNK_PATTERNS = (
+    r'本章未完[，,。.!！]*\s*(?:请|請)?(?:点击|點擊)下一页(?:继续阅读)?[。.!！]*',
+    r'(?:天才)?一秒记住[^\n]*',
+    r'(?:请|請)?(?:收藏|记住|記住)本站[^\n]*',
+    r'(?:手机|手機)(?:版)?(?:阅读|閱讀|用户|用戶)[^\n]*(?:访问|訪問|阅读|閱讀)[^\n]*',
+    r'最新章节[^\n]*(?:首发|首發|全文阅读|免费阅读)[^\n]*',
+    r'章节错误[，,]?点此(?:举报|報錯|报错)[^\n]*',
+    r'(?:加入书签|加入書籤|返回目录|返回目錄|上一章|下一章)(?:\s*[|/←→]?\s*(?:加入书签|返回目录|上一章|下一章))*',
+    r'[(（]本章完[)）]',
+    r'(?:求|跪求)(?:月票|推荐票|推薦票|收藏|订阅|訂閱)[^\n]*',
+    r'(?:https?://|www\.)\S+',
+    r'\b[a-z0-9-]+(?:\.[a-z0-9-]+)*\.(?:com|net|org|cc|la|info|xyz|top)\b(?:/\S*)?',
+)
+
+# Cách xử lý dòng khớp pattern: "mask" chỉ xóa phần khớp (bỏ cả dòng nếu không còn chữ), "drop" bỏ cả dòng
+JUNK_FILTER_MODES = ("mask", "drop")
+
+# Tự phát hiện rác lặp lại: dòng ngắn xuất hiện ít nhất JUNK_MIN_REPEATS lần, rải trên ít nhất
+# JUNK_MIN_SECTIONS đoạn JUNK_SECTION_LINES dòng khác nhau của sách (xấp xỉ "lặp qua các chương")
+JUNK_MIN_REPEATS = 5
+JUNK_MIN_SECTIONS = 5
+JUNK_SECTION_LINES = 300
+JUNK_MAX_LINE_CHARS = 60
+JUNK_MIN_LINE_CHARS = 4
+
+# Hậu tố file nguồn đã lọc và file báo cáo, đặt cạnh file input
+JUNK_FILTERED_SUFFIX = ".filtered.txt"
+JUNK_REPORT_SUFFIX = ".junk_report.txt"
+
+# Lý do xóa dòng lặp lại tự phát hiện (ghi trong báo cáo)
+REASON_REPEATED = "lặp lại khắp sách"
+
+
+def get_junk_report_path(input_file):
+    return f"{input_file}{JUNK_REPORT_SUFFIX}"
+
+
+def junk_patterns_fingerprint(patterns_file):
+    """Hash nội dung file pattern (ghi vào cách chia chunk: sửa file pattern thì nhật ký cũ không còn khớp), None nếu không có file"""
+    if not patterns_file or not os.path.exists(patterns_file):
+        return None
+    with open(patterns_file, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+
+# Cờ toàn cục đầu pattern ("(?i)...") chỉ hợp lệ ở đầu cả regex: đổi thành cờ trong phạm vi pattern ("(?i:...)")
+_LEADING_FLAGS_RE = re.compile(r'^\(\?([aiLmsux]+)\)')
+
+
+def _scope_inline_flags(pattern):
+    match = _LEADING_FLAGS_RE.match(pattern)
+    if match is None:
+        return pattern
+    return f"(?{match.group(1)}:{pattern[match.end():]})"
+
+
+def load_junk_patterns(patterns_file):
+    """
+    Đọc file pattern của người dùng: mỗi dòng một regex, dòng trống và dòng bắt đầu bằng "#" bị bỏ qua.
+    Mỗi pattern được kiểm tra trong đúng group sẽ gộp vào regex chung; không hợp lệ thì coi là chuỗi thường.
+    """
+    patterns = []
+    with open(patterns_file, 'r', encoding='utf-8-sig', errors='replace') as f:
+        for line in f:
+            pattern = line.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            pattern = _scope_inline_flags(pattern)
+            try:
+                re.compile(f"(?P<j0>{pattern})", re.IGNORECASE)
+            except re.error as e:
+                print(f"⚠️ Pattern lọc rác không hợp lệ, dùng như chuỗi thường: {pattern} ({e})")
+                pattern = re.escape(line.strip())
+            patterns.append(pattern)
+    return patterns
+
+
+def _has_text(text):
+    """Còn chữ cái/chữ CJK (không chỉ dấu câu, khoảng trắng)"""
+    return any(char.isalpha() or _is_wide_char(char) for char in text)
+
+
+def _is_repeat_candidate(text):
+    """Dòng có thể là rác lặp lại: ngắn, có chữ, không phải câu thoại (câu thoại ngắn lặp lại là nội dung truyện)"""
+    if not (JUNK_MIN_LINE_CHARS <= len(text) <= JUNK_MAX_LINE_CHARS):
+        return False
+    if text.startswith(DIALOGUE_MARKERS):
+        return False
+    return sum(1 for char in text if char.isalnum()) >= JUNK_MIN_LINE_CHARS
+
+
+def detect_repeated_junk(input_file, min_repeats=JUNK_MIN_REPEATS, min_sections=JUNK_MIN_SECTIONS, section_lines=JUNK_SECTION_LINES):
+    """
+    Tìm dòng ngắn lặp lại rải rác khắp sách (đọc file hai lượt, chỉ giữ hash 64-bit của dòng).
+    Trả về tập hash dòng (dedup.line_key) được coi là rác.
+    """
+    line_hashes = _HashCounter()
+    for line in iter_source_lines(input_file):
+        text = line.strip()
+        if _is_repeat_candidate(text):
+            line_hashes.add(line_key(text))
+    candidates = line_hashes.repeated(min_repeats)
+    del line_hashes
+    if not candidates:
+        return set()
+
+    # Lượt hai: đếm số đoạn sách khác nhau chứa mỗi dòng ứng viên
+    sections = {}
+    for line_index, line in enumerate(iter_source_lines(input_file)):
+        text = line.strip()
+        if not _is_repeat_candidate(text):
+            continue
+        key = line_key(text)
+        if key not in candidates:
+            continue
+        section = line_index // section_lines
+        count, last_section = sections.get(key, (0, -1))
+        if section != last_section:
+            sections[key] = (count + 1, section)
+    return {key for key, (count, _) in sections.items() if count >= min_sections}
+
+
+class JunkFilter:
+    """
+    Bộ lọc rác: mọi pattern được gộp thành một regex (mỗi pattern là một named group để biết pattern nào khớp).
+    clean_line(line) trả về (dòng đã lọc hoặc None nếu bỏ cả dòng, [(lý do, phần bị xóa)]).
+    """
+    def __init__(self, patterns, mode="mask", repeated_lines=None):
+        self.patterns = list(patterns)
+        self.mode = mode if mode in JUNK_FILTER_MODES else "mask"
+        self.repeated_lines = repeated_lines or set()
+        self._regex = None
+        if self.patterns:
+            self._regex = re.compile("|".join(f"(?P<j{index}>{pattern})" for index, pattern in enumerate(self.patterns)), re.IGNORECASE)
+        self.removed_lines = 0
+        self.masked_lines = 0
+        self.removed_tokens = 0
+        self.total_tokens = 0
+        self.reasons = {}
+
+    def _record(self, removals):
+        for reason, removed_text in removals:
+            self.reasons[reason] = self.reasons.get(reason, 0) + 1
+            self.removed_tokens += estimate_tokens(removed_text)
+
+    def clean_line(self, line):
+        text = line.rstrip("\r\n")
+        newline = line[len(text):]
+        self.total_tokens += estimate_tokens(text)
+        if not text.strip():
+            return line, []
+
+        if self.repeated_lines and line_key(text) in self.repeated_lines:
+            # Cả dòng lặp lại y hệt khắp sách: bỏ cả dòng kể cả khi một phần khớp pattern
+            removals = [(REASON_REPEATED, text)]
+            self._record(removals)
+            self.removed_lines += 1
+            return None, removals
+
+        if self._regex is None:
+            return line, []
+        matches = [match for match in self._regex.finditer(text) if match.end() > match.start()]
+        if not matches:
+            return line, []
+        removals = [(self.patterns[int(match.lastgroup[1:])], match.group()) for match in matches]
+
+        if self.mode == "drop":
+            # Bỏ cả dòng nhưng báo cáo/đếm token theo toàn bộ dòng
+            removals = [(removals[0][0], text)]
+            self._record(removals)
+            self.removed_lines += 1
+            return None, removals
+
+        self._record(removals)
+        cleaned = self._regex.sub("", text).rstrip()
+        if not _has_text(cleaned):
+            # Chỉ còn dấu câu/khoảng trắng: bỏ cả dòng
+            self.removed_lines += 1
+            return None, removals
+        self.masked_lines += 1
+        return cleaned + newline, removals
+
+    def summary(self):
+        return {
+            'removed_lines': self.removed_lines,
+            'masked_lines': self.masked_lines,
+            'removed_tokens': self.removed_tokens,
+            'total_tokens': self.total_tokens,
+            'removed_ratio': round(self.removed_tokens / self.total_tokens, 3) if self.total_tokens else 0.0,
+            'repeated_lines': len(self.repeated_lines),
+            'reasons': dict(sorted(self.reasons.items(), key=lambda item: -item[1])),
+        }
+
+
+def build_junk_filter(input_file, patterns_file=None, use_builtin=True, mode="mask", detect_repeats=False):
+    """Tạo JunkFilter từ pattern có sẵn + file pattern của người dùng, None nếu không có gì để lọc"""
+    patterns = list(BUILTIN_JUNK_PATTERNS) if use_builtin else []
+    if patterns_file:
+        if os.path.exists(patterns_file):
+            try:
+                patterns.extend(load_junk_patterns(patterns_file))
+            except OSError as e:
+                print(f"⚠️ Lỗi đọc file pattern lọc rác '{patterns_file}': {e}")
+        else:
+            print(f"⚠️ Không tìm thấy file pattern lọc rác: {patterns_file}")
+    repeated_lines = detect_repeated_junk(input_file) if detect_repeats else set()
+    if not patterns and not repeated_lines:
+        return None
+    return JunkFilter(patterns, mode, repeated_lines)
+
+
+def filter_source_file(input_file, junk_filter, filtered_file=None, report_file=None):
+    """
+    Ghi bản đã lọc của input_file (streaming) và báo cáo các phần bị xóa.
+    Báo cáo: mỗi dòng "số dòng gốc<TAB>lý do<TAB>nội dung bị xóa", cuối file là thống kê theo lý do.
+    Trả về đường dẫn file đã lọc.
+    """
+    if filtered_file is None:
+        filtered_file = f"{input_file}{JUNK_FILTERED_SUFFIX}"
+    if report_file is None:
+        report_file = get_junk_report_path(input_file)
+    with open(filtered_file, 'w', encoding='utf-8') as outfile, open(report_file, 'w', encoding='utf-8') as report:
+        report.write(f"# Báo cáo lọc rác: {os.path.basename(input_file)}\n")
+        report.write("# dòng\tlý do\tnội dung bị xóa\n")
+        for line_number, line in enumerate(iter_source_lines(input_file), start=1):
+            cleaned, removals = junk_filter.clean_line(line)
+            for reason, removed_text in removals:
+                report.write(f"{line_number}\t{reason}\t{removed_text}\n")
+            if cleaned is not None:
+                outfile.write(cleaned)
+        summary = junk_filter.summary()
+        report.write(f"# Tổng: bỏ {summary['removed_lines']} dòng, xóa một phần {summary['masked_lines']} dòng, ~{summary['removed_tokens']} token\n")
+        for reason, count in summary['reasons'].items():
+            report.write(f"# {count}\t{reason}\n")
+    return filtered_file
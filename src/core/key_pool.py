@@ -0,0 +1,305 @@
+"""
+Pool nhiều API key: chia request theo quota còn lại của từng key, tạm nghỉ key bị rate limit
+và chỉ báo hết quota khi mọi key đều đã cạn. Trạng thái được lưu lại giữa các lần chạy.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+try:
+    from .rate_limiter import create_rate_limiter, get_rate_limit_profile, RATE_LIMIT_TIER_OFF
+except ImportError:
+    from rate_limiter import create_rate_limiter, get_rate_limit_profile, RATE_LIMIT_TIER_OFF
+
+# File lưu trạng thái sử dụng của từng key (chỉ lưu hash của key)
+KEY_POOL_STATE_FILE = "key_pool_state.json"
+
+# Thời gian tạm nghỉ khi key bị 429 mà server không gợi ý thời gian chờ (giây):
+# KEY_BENCH_SECONDS cho lần đầu, gấp đôi sau mỗi lần 429 liên tiếp, tối đa MAX_KEY_BENCH_SECONDS.
+# Key chỉ bị coi là hết quota ngày khi lỗi 429 báo đúng quota ngày (retry_policy.is_quota_exhausted_error)
+KEY_BENCH_SECONDS = 60
+MAX_KEY_BENCH_SECONDS = 600
+
+# Quota ngày của Gemini reset lúc 0h giờ Pacific; dùng UTC-8 để không bao giờ dùng lại key quá sớm
+QUOTA_RESET_UTC_OFFSET_HOURS = -8
+
+# Chu kỳ tối đa khi chờ một key hết thời gian nghỉ (giây)
+MAX_WAIT_STEP_SECONDS = 1.0
+
+
+def parse_api_keys(api_key):
+    """Nhận một key, danh sách key, hoặc chuỗi nhiều key cách nhau bằng dấu phẩy/chấm phẩy/xuống dòng"""
+    if api_key is None:
+        return []
+    if isinstance(api_key, (list, tuple)):
+        raw_keys = api_key
+    else:
+        raw_keys = re.split(r'[,;\s]+', str(api_key))
+    keys = []
+    for key in raw_keys:
+        key = key.strip()
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def key_id(api_key):
+    """Định danh key để log/lưu file mà không lộ key"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def _quota_day(now=None):
+    """Ngày quota hiện tại (theo múi giờ reset quota)"""
+    tz = timezone(timedelta(hours=QUOTA_RESET_UTC_OFFSET_HOURS))
+    return datetime.fromtimestamp(now or time.time(), tz).strftime('%Y-%m-%d')
+
+
+def _next_quota_reset(now=None):
+    """Thời điểm (epoch) quota ngày được reset lần tới"""
+    tz = timezone(timedelta(hours=QUOTA_RESET_UTC_OFFSET_HOURS))
+    current = datetime.fromtimestamp(now or time.time(), tz)
+    next_midnight = (current + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return next_midnight.timestamp()
+
+
+class ApiKeyState:
+    """Trạng thái của một API key trong pool"""
+    def __init__(self, api_key, limiter, requests_per_day):
+        self.api_key = api_key
+        self.key_id = key_id(api_key)
+        self.limiter = limiter
+        self.requests_per_day = requests_per_day
+        self.benched_until = 0.0
+        self.exhausted_until = 0.0
+        self.consecutive_rate_limits = 0
+        self.quota_day = _quota_day()
+        self.requests_today = 0
+        self.tokens_today = 0
+        self.in_flight = 0
+
+    def is_exhausted(self, now):
+        return self.exhausted_until > now
+
+    def is_available(self, now):
+        return not self.is_exhausted(now) and self.benched_until <= now
+
+    def remaining_budget(self):
+        """Tỷ lệ quota còn lại (0..1), dùng để chia request cho key còn nhiều quota nhất"""
+        daily = 1.0
+        if self.requests_per_day:
+            daily = max(0.0, 1 - self.requests_today / self.requests_per_day)
+        minute = 1.0
+        if self.limiter is not None:
+            minute = self.limiter.available_fraction()
+        return daily * max(minute, 0.0) / (1 + self.in_flight)
+
+
+class ApiKeyPool:
+    """
+    Chia request cho nhiều API key.
+    - Mỗi key có rate limiter RPM/TPM riêng và quota ngày (RPD) riêng.
+    - Key bị 429 được tạm nghỉ đến hết thời gian chờ (lâu dần nếu bị 429 liên tục);
+      429 báo hết quota ngày thì nghỉ đến khi quota ngày reset.
+    - acquire() trả về None khi mọi key đều đã hết quota.
+    """
+    def __init__(self, api_keys, model_name, rate_limit_tier="free", state_file=KEY_POOL_STATE_FILE, use_rate_limiter=True):
+        self.model_name = model_name
+        self.state_file = state_file
+        requests_per_day = None
+        if rate_limit_tier and rate_limit_tier != RATE_LIMIT_TIER_OFF:
+            requests_per_day = get_rate_limit_profile(model_name, rate_limit_tier).get("rpd")
+        self.keys = [
+            ApiKeyState(
+                api_key,
+                create_rate_limiter(model_name, rate_limit_tier) if use_rate_limiter else None,
+                requests_per_day,
+            )
+            for api_key in parse_api_keys(api_keys)
+        ]
+        self._load_state()
+
+    @property
+    def pool_id(self):
+        """Định danh của cả pool (dùng cho các trạng thái lưu theo key)"""
+        return ",".join(sorted(key.key_id for key in self.keys))
+
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return
+        now = time.time()
+        today = _quota_day(now)
+        for key in self.keys:
+            key_state = state.get(f"{key.key_id}:{self.model_name}")
+            if not key_state:
+                continue
+            if key_state.get('quota_day') == today:
+                key.requests_today = key_state.get('requests_today', 0)
+                key.tokens_today = key_state.get('tokens_today', 0)
+            key.exhausted_until = max(0.0, key_state.get('exhausted_until', 0.0))
+            key.benched_until = max(0.0, key_state.get('benched_until', 0.0))
+            if key.is_exhausted(now):
+                print(f"🔑 Key {key.key_id} vẫn đang hết quota đến {datetime.fromtimestamp(key.exhausted_until):%H:%M %d/%m}")
+
+    def save_state(self):
+        """Lưu trạng thái sử dụng của từng key để lần chạy sau tiếp tục đúng quota"""
+        if not self.state_file:
+            return
+        state = {}
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                state = {}
+        for key in self.keys:
+            state[f"{key.key_id}:{self.model_name}"] = {
+                'quota_day': key.quota_day,
+                'requests_today': key.requests_today,
+                'tokens_today': key.tokens_today,
+                'benched_until': key.benched_until,
+                'exhausted_until': key.exhausted_until,
+            }
+        try:
+            with open(self.state_file, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2)
+        except OSError as e:
+            print(f"⚠️ Lỗi khi lưu trạng thái API key: {e}")
+
+    def all_exhausted(self):
+        """True nếu mọi key đều đã hết quota ngày"""
+        now = time.time()
+        return all(key.is_exhausted(now) for key in self.keys)
+
+    def available_count(self):
+        now = time.time()
+        return sum(1 for key in self.keys if key.is_available(now))
+
+    async def acquire(self, estimated_tokens, priority=0):
+        """
+        Chọn key còn nhiều quota nhất và chờ rate limiter của key đó (theo priority, số nhỏ được cấp trước).
+        Nếu mọi key đang nghỉ thì chờ key sớm nhất; trả về None khi mọi key đã hết quota.
+        """
+        while True:
+            now = time.time()
+            self._roll_quota_day(now)
+            if self.all_exhausted():
+                return None
+            available = [key for key in self.keys if key.is_available(now)]
+            if available:
+                key = max(available, key=lambda k: k.remaining_budget())
+                break
+            next_ready = min(key.benched_until for key in self.keys if not key.is_exhausted(now))
+            await asyncio.sleep(min(max(next_ready - now, 0.05), MAX_WAIT_STEP_SECONDS))
+
+        key.in_flight += 1
+        try:
+            if key.limiter is not None:
+                await key.limiter.acquire(estimated_tokens, priority)
+        except BaseException:
+            key.in_flight -= 1
+            raise
+        return key
+
+    def release(self, key):
+        key.in_flight -= 1
+
+    def on_success(self, key, estimated_tokens, actual_tokens=None):
+        """Ghi nhận request thành công trên key"""
+        key.consecutive_rate_limits = 0
+        key.requests_today += 1
+        key.tokens_today += actual_tokens if actual_tokens is not None else estimated_tokens
+        if key.limiter is not None:
+            key.limiter.reconcile(estimated_tokens, actual_tokens)
+        if key.requests_per_day and key.requests_today >= key.requests_per_day:
+            self._mark_exhausted(key, "đã dùng hết quota request trong ngày")
+
+    def on_rate_limited(self, key, retry_after=None, quota_exhausted=False):
+        """Key bị 429: tạm nghỉ; quota_exhausted (429 báo hết quota ngày) thì nghỉ đến khi quota reset"""
+        if key.is_exhausted(time.time()):
+            return
+        if quota_exhausted:
+            self._mark_exhausted(key, "đã hết quota ngày (theo lỗi 429 của server)")
+            return
+        if key.benched_until > time.time():
+            # Request gửi trước khi key bị cho nghỉ (cùng một đợt burst): không tính thêm
+            return
+        key.consecutive_rate_limits += 1
+        if retry_after is not None:
+            bench_seconds = retry_after
+        else:
+            bench_seconds = min(KEY_BENCH_SECONDS * 2 ** (key.consecutive_rate_limits - 1), MAX_KEY_BENCH_SECONDS)
+        key.benched_until = max(key.benched_until, time.time() + bench_seconds)
+        print(f"🔑 Key {key.key_id} bị rate limit, tạm nghỉ {bench_seconds:.0f}s ({self.available_count()}/{len(self.keys)} key còn dùng được)")
+
+    def _mark_exhausted(self, key, reason):
+        key.exhausted_until = _next_quota_reset()
+        print(f"🔑 Key {key.key_id} {reason} - nghỉ đến khi quota reset ({self.available_count()}/{len(self.keys)} key còn dùng được)")
+        self.save_state()
+
+    def _roll_quota_day(self, now):
+        today = _quota_day(now)
+        for key in self.keys:
+            if key.quota_day != today:
+                key.quota_day = today
+                key.requests_today = 0
+                key.tokens_today = 0
+
+    def quota_status(self):
+        """
+        Tình trạng quota của cả pool: số key hết quota ngày, số key đang tạm nghỉ và thời điểm (epoch)
+        sớm nhất có key dùng lại được (None nếu đang có key dùng được ngay).
+        """
+        now = time.time()
+        exhausted = [key for key in self.keys if key.is_exhausted(now)]
+        benched = [key for key in self.keys if not key.is_exhausted(now) and key.benched_until > now]
+        next_available_at = None
+        if self.keys and len(exhausted) + len(benched) == len(self.keys):
+            next_available_at = min(max(key.exhausted_until, key.benched_until) for key in self.keys)
+        return {
+            'total_keys': len(self.keys),
+            'exhausted_keys': len(exhausted),
+            'benched_keys': len(benched),
+            'next_available_at': next_available_at,
+        }
+
+    def summary(self):
+        """Thống kê sử dụng của từng key"""
+        return {
+            key.key_id: {
+                'requests_today': key.requests_today,
+                'tokens_today': key.tokens_today,
+                'exhausted': key.is_exhausted(time.time()),
+            }
+            for key in self.keys
+        }
+
+
+def describe_quota_status(status):
+    """Các dòng thông báo (tiếng Việt) khi dịch dừng vì hết quota, dựa trên quota_status() của pool"""
+    if not status:
+        return [
+            "Tất cả API key đã hết quota hoặc đang tạm nghỉ.",
+            "Thêm API key khác vào pool (cách nhau bằng dấu phẩy) hoặc chờ quota reset rồi tiếp tục dịch.",
+        ]
+    lines = [
+        f"Tất cả {status['total_keys']} API key trong pool đều không dùng được: "
+        f"{status['exhausted_keys']} key hết quota ngày, {status['benched_keys']} key đang tạm nghỉ vì rate limit."
+    ]
+    next_available_at = status.get('next_available_at')
+    if next_available_at:
+        wait_minutes = max(0, int((next_available_at - time.time() + 59) // 60))
+        lines.append(
+            f"Key sớm nhất dùng lại được lúc {datetime.fromtimestamp(next_available_at):%H:%M %d/%m} "
+            f"(khoảng {wait_minutes // 60} giờ {wait_minutes % 60} phút nữa)."
+        )
+    lines.append("Để dịch tiếp ngay: thêm API key khác vào pool (cách nhau bằng dấu phẩy) rồi bấm tiếp tục dịch.")
+    return lines
@@ -0,0 +1,187 @@
+"""
+Backend giả lập chạy offline, thay thế Gemini khi model_name bắt đầu bằng LOCAL_MODEL_PREFIX.
+Dùng để đo overhead của engine và kiểm thử mà không cần API key hay mạng.
+"""
+import asyncio
+import itertools
+import os
+import time
+
+try:
+    from .chunking import estimate_tokens
+    from .glossary import GLOSSARY_HEADER
+except ImportError:
+    from chunking import estimate_tokens
+    from glossary import GLOSSARY_HEADER
+
+# model_name bắt đầu bằng tiền tố này sẽ dùng backend giả lập (ví dụ: "local-echo")
+LOCAL_MODEL_PREFIX = "local-"
+
+# Độ trễ giả lập cho mỗi request (giây), có thể chỉnh qua biến môi trường
+LOCAL_BACKEND_LATENCY = float(os.getenv('LOCAL_BACKEND_LATENCY', '0'))
+
+# Response dạng stream (stream=True) được chia thành các phần chừng này ký tự
+LOCAL_STREAM_PIECE_CHARS = 200
+
+# Số lần tạo client/model, dùng để đo hiệu quả của cache model
+local_stats = {
+    'clients_created': 0,
+    'requests': 0,
+}
+
+
+def is_local_model(model_name):
+    """Kiểm tra model_name có dùng backend giả lập không"""
+    return bool(model_name) and model_name.startswith(LOCAL_MODEL_PREFIX)
+
+
+class _LocalCandidate:
+    def __init__(self):
+        self.finish_reason = 'STOP'
+        self.safety_ratings = []
+
+
+class _LocalUsageMetadata:
+    def __init__(self, prompt_token_count, cached_content_token_count):
+        self.prompt_token_count = prompt_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+
+class _LocalResponse:
+    """Mô phỏng các thuộc tính của GenerateContentResponse mà translate.py dùng tới"""
+    def __init__(self, text, usage_metadata=None):
+        self.text = text
+        self.prompt_feedback = None
+        self.candidates = [_LocalCandidate()]
+        self.usage_metadata = usage_metadata
+
+
+class _LocalStream:
+    """
+    Mô phỏng response dạng stream: văn bản được trả về từng phần, lý do kết thúc/safety ratings
+    và usage_metadata nằm ở phần cuối.
+    """
+    def __init__(self, response, piece_chars=LOCAL_STREAM_PIECE_CHARS):
+        self._response = response
+        self._piece_chars = piece_chars
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        text = self._response.text
+        pieces = [text[start:start + self._piece_chars] for start in range(0, len(text), self._piece_chars)] or [""]
+        for index, piece in enumerate(pieces):
+            part = _LocalResponse(piece)
+            if index == len(pieces) - 1:
+                part.candidates = self._response.candidates
+                part.usage_metadata = self._response.usage_metadata
+            else:
+                part.candidates[0].finish_reason = None
+            if LOCAL_BACKEND_LATENCY > 0:
+                await asyncio.sleep(LOCAL_BACKEND_LATENCY / len(pieces))
+            yield part
+
+
+class _LocalCachedContent:
+    def __init__(self, name):
+        self.name = name
+
+
+class LocalCacheService:
+    """
+    Mô phỏng CacheService của Gemini (create/update/delete cached content) để kiểm thử context caching offline.
+    Cache hết hạn theo TTL như thật; request tham chiếu cache đã hết hạn sẽ bị lỗi.
+    """
+    def __init__(self):
+        self._caches = {}
+        self._counter = itertools.count(1)
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+
+    async def create_cached_content(self, cached_content=None, **kwargs):
+        name = f"cachedContents/local-{next(self._counter)}"
+        instruction = cached_content.system_instruction.parts[0].text
+        self._caches[name] = (instruction, time.monotonic() + cached_content.ttl.total_seconds())
+        self.created += 1
+        return _LocalCachedContent(name)
+
+    async def update_cached_content(self, cached_content=None, update_mask=None, **kwargs):
+        instruction = self.get_instruction(cached_content.name)
+        self._caches[cached_content.name] = (instruction, time.monotonic() + cached_content.ttl.total_seconds())
+        self.updated += 1
+        return _LocalCachedContent(cached_content.name)
+
+    async def delete_cached_content(self, name=None, **kwargs):
+        self._caches.pop(name, None)
+        self.deleted += 1
+
+    def get_instruction(self, name):
+        """Nội dung đã cache, lỗi nếu cache không tồn tại hoặc đã hết hạn"""
+        cache = self._caches.get(name)
+        if cache is None or cache[1] <= time.monotonic():
+            self._caches.pop(name, None)
+            raise Exception(f"404 CachedContent not found (or expired): {name}")
+        return cache[0]
+
+
+local_cache_service = LocalCacheService()
+
+
+def _extract_prompt_text(contents):
+    """Lấy nội dung prompt dạng text từ tham số contents"""
+    if isinstance(contents, str):
+        return contents
+    parts = []
+    for content in contents:
+        if isinstance(content, dict):
+            parts.extend(str(part) for part in content.get('parts', []))
+        else:
+            parts.append(str(content))
+    return "\n".join(parts)
+
+
+class LocalGenerativeModel:
+    """
+    Model giả lập có cùng giao diện generate_content với genai.GenerativeModel.
+    "Bản dịch" là phần văn bản sau dòng hướng dẫn đầu tiên của prompt, giữ nguyên từng dòng.
+    """
+    def __init__(self, model_name, system_instruction=None, cached_content=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+        self.cached_content = cached_content
+        local_stats['clients_created'] += 1
+
+    def _respond(self, contents, generation_config=None):
+        local_stats['requests'] += 1
+        prompt_text = _extract_prompt_text(contents)
+        prompt_tokens = estimate_tokens(prompt_text)
+        if (generation_config or {}).get("response_mime_type") == "application/json":
+            # Dịch theo dòng: "bản dịch" là mảng JSON ở cuối prompt
+            usage = _LocalUsageMetadata(estimate_tokens(self.system_instruction or "") + prompt_tokens, 0)
+            return _LocalResponse(prompt_text.rpartition("\n\n")[2], usage)
+        if prompt_text.startswith(GLOSSARY_HEADER):
+            # Bỏ khối thuật ngữ ở đầu prompt (không chứa dòng trống)
+            _, _, prompt_text = prompt_text.partition("\n\n")
+        if self.cached_content:
+            # Hướng dẫn dịch nằm trong cache, prompt chỉ có nội dung cần dịch
+            cached_tokens = estimate_tokens(local_cache_service.get_instruction(self.cached_content))
+            usage = _LocalUsageMetadata(cached_tokens + prompt_tokens, cached_tokens)
+            return _LocalResponse(prompt_text, usage)
+        _, _, body = prompt_text.partition("\n\n")
+        usage = _LocalUsageMetadata(estimate_tokens(self.system_instruction or "") + prompt_tokens, 0)
+        return _LocalResponse(body or prompt_text, usage)
+
+    def generate_content(self, contents=None, generation_config=None, **kwargs):
+        if LOCAL_BACKEND_LATENCY > 0:
+            time.sleep(LOCAL_BACKEND_LATENCY)
+        return self._respond(contents, generation_config)
+
+    async def generate_content_async(self, contents=None, generation_config=None, stream=False, **kwargs):
+        if stream:
+            # Độ trễ được rải đều cho các phần của stream
+            return _LocalStream(self._respond(contents, generation_config))
+        if LOCAL_BACKEND_LATENCY > 0:
+            await asyncio.sleep(LOCAL_BACKEND_LATENCY)
+        return self._respond(contents, generation_config)
@@ -0,0 +1,158 @@
+"""
+Gộp nhiều chunk nhỏ vào một request (chương ngắn, file nhiều dòng thưa): mỗi chunk được bọc trong
+cặp thẻ đánh số, bản dịch trả về được tách lại theo thẻ. Tách không hợp lệ thì các chunk trong gói
+được dịch riêng như bình thường. Giảm mạnh số request khi bị giới hạn RPM (free tier).
+"""
+import asyncio
+import re
+
+# Thẻ bọc từng chunk trong gói (số thứ tự bắt đầu từ 1)
+PACK_TAG_START = '<translate_this id="{number}">'
+PACK_TAG_END = "</translate_this>"
+
+# Hướng dẫn đặt trước các chunk trong gói
+PACK_INSTRUCTION = (
+    "Văn bản gồm nhiều đoạn độc lập, mỗi đoạn nằm giữa cặp thẻ <translate_this id=\"N\"> và </translate_this>. "
+    "Dịch từng đoạn và giữ nguyên các thẻ cùng số thứ tự, không gộp hay bỏ đoạn nào."
+)
+
+# Ngân sách token mặc định của một gói và số chunk tối đa trong một gói
+DEFAULT_PACK_TOKEN_BUDGET = 2000
+MAX_CHUNKS_PER_PACK = 10
+
+# Chờ tối đa bao lâu (giây) để gom thêm chunk trước khi gửi gói
+PACK_LINGER_SECONDS = 0.05
+
+_PACK_SEGMENT_RE = re.compile(r'<translate_this id="(\d+)">[ \t]*\n?(.*?)\s*</translate_this>', re.DOTALL)
+
+
+def build_packed_lines(chunks_lines):
+    """Ghép các chunk (danh sách các danh sách dòng) thành các dòng của một gói"""
+    packed_lines = [PACK_INSTRUCTION, ""]
+    for number, chunk_lines in enumerate(chunks_lines, 1):
+        packed_lines.append(PACK_TAG_START.format(number=number))
+        packed_lines.extend(chunk_lines)
+        packed_lines.append(PACK_TAG_END)
+    return packed_lines
+
+
+def split_packed_response(text, chunk_count):
+    """
+    Tách bản dịch của gói thành bản dịch của từng chunk.
+    Trả về None nếu không khớp: thiếu/thừa/trùng thẻ hoặc có đoạn rỗng.
+    """
+    if not text:
+        return None
+    segments = {}
+    for match in _PACK_SEGMENT_RE.finditer(text):
+        number = int(match.group(1))
+        if number in segments:
+            return None
+        segments[number] = match.group(2)
+    if sorted(segments) != list(range(1, chunk_count + 1)):
+        return None
+    if any(not segment.strip() for segment in segments.values()):
+        return None
+    return [segments[number] for number in range(1, chunk_count + 1)]
+
+
+class ChunkPacker:
+    """
+    Gom các chunk nhỏ đang chờ dịch thành gói và gửi bằng translate_pack(packed_lines) -> bản dịch hoặc None.
+    translate() trả về bản dịch của chunk, hoặc None nếu chunk cần dịch riêng (gói chỉ có một chunk,
+    request lỗi hoặc tách bản dịch không hợp lệ).
+    """
+    def __init__(self, translate_pack, token_budget=DEFAULT_PACK_TOKEN_BUDGET, max_chunks=MAX_CHUNKS_PER_PACK, linger_seconds=PACK_LINGER_SECONDS):
+        self.translate_pack = translate_pack
+        self.token_budget = token_budget
+        self.max_chunks = max_chunks
+        self.linger_seconds = linger_seconds
+        # Chỉ gộp chunk nhỏ hơn nửa ngân sách, chunk lớn hơn tự đủ một request
+        self.max_chunk_tokens = token_budget // 2
+        self._pending = []
+        self._pending_tokens = 0
+        self._timer = None
+        self._pack_tasks = set()
+        self.packs_sent = 0
+        self.chunks_packed = 0
+        self.fallback_chunks = 0
+
+    def accepts(self, chunk_tokens):
+        return chunk_tokens <= self.max_chunk_tokens
+
+    async def translate(self, chunk_lines, chunk_tokens):
+        """Đưa chunk vào gói đang gom và chờ bản dịch"""
+        if self._pending and self._pending_tokens + chunk_tokens > self.token_budget:
+            self._flush()
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((chunk_lines, future))
+        self._pending_tokens += chunk_tokens
+        if len(self._pending) >= self.max_chunks:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.linger_seconds, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pack, self._pending, self._pending_tokens = self._pending, [], 0
+        if not pack:
+            return
+        if len(pack) == 1:
+            # Không có gì để gộp: chunk tự gửi request riêng
+            _resolve(pack[0][1], None)
+            return
+        task = asyncio.ensure_future(self._send(pack))
+        self._pack_tasks.add(task)
+        task.add_done_callback(self._pack_tasks.discard)
+
+    async def _send(self, pack):
+        translated_text = None
+        try:
+            translated_text = await self.translate_pack(build_packed_lines([chunk_lines for chunk_lines, _ in pack]))
+        except Exception as e:
+            print(f"⚠️ Lỗi dịch gói {len(pack)} chunk, dịch riêng từng chunk: {e}")
+        parts = split_packed_response(translated_text, len(pack)) if translated_text is not None else None
+        self.packs_sent += 1
+        if parts is None:
+            self.fallback_chunks += len(pack)
+            for _, future in pack:
+                _resolve(future, None)
+            return
+        self.chunks_packed += len(pack)
+        for (_, future), part in zip(pack, parts):
+            _resolve(future, part)
+
+    def reject(self):
+        """Chunk nhận được bản dịch từ gói nhưng bị đánh giá là hỏng: tính là dịch riêng"""
+        self.chunks_packed -= 1
+        self.fallback_chunks += 1
+
+    async def close(self):
+        """Hủy các gói đang gửi dở (khi dừng dịch)"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        for _, future in self._pending:
+            _resolve(future, None)
+        self._pending = []
+        for task in list(self._pack_tasks):
+            task.cancel()
+        await asyncio.gather(*self._pack_tasks, return_exceptions=True)
+
+    def summary(self):
+        """Thống kê: số request tiết kiệm được nhờ gộp chunk"""
+        return {
+            'packs_sent': self.packs_sent,
+            'chunks_packed': self.chunks_packed,
+            'fallback_chunks': self.fallback_chunks,
+            'requests_saved': max(0, self.chunks_packed - self.packs_sent),
+        }
+
+
+def _resolve(future, result):
+    # Future có thể đã bị hủy (task của chunk bị hủy khi dừng dịch)
+    if not future.done():
+        future.set_result(result)
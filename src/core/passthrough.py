@@ -0,0 +1,105 @@
+"""
+Phân loại nhanh các dòng không cần dịch (dòng phân cách, số trang, URL, chỉ có dấu câu, dòng đã là tiếng Việt).
+Các dòng này được giữ nguyên tại chỗ, chỉ các đoạn cần dịch được gửi lên API.
+Phân loại chỉ dựa vào bảng chữ (script) của ký tự, không gọi API.
+"""
+import re
+import unicodedata
+
+try:
+    from .chunking import estimate_tokens, _is_wide_char
+except ImportError:
+    from chunking import estimate_tokens, _is_wide_char
+
+# Dòng chỉ gồm URL / tên miền
+URL_LINE_RE = re.compile(r'^(?:(?:https?://|www\.)\S+|[\w-]+(?:\.[\w-]+)*\.(?:com|net|org|info|io|cc|cn|vn|me|tv|co)(?:/\S*)?)$', re.IGNORECASE)
+
+# Số trang / số thứ tự: "12", "- 12 -", "12/300", "Page 12", "p. 12"
+PAGE_NUMBER_RE = re.compile(r'^(?:page|p\.|trang)?\s*[-–—(\[]?\s*\d+(?:\s*/\s*\d+)?\s*[-–—)\]]?$', re.IGNORECASE)
+
+# Chữ cái chỉ có trong tiếng Việt (đã chuẩn hóa NFC): đ, ơ, ư và nguyên âm mang dấu thanh riêng của tiếng Việt
+# (nặng, hỏi, ngã, hoặc sắc/huyền chồng lên mũ/trăng). Không tính â, ê, ô, ă, à, é, ã, õ... vì tiếng Pháp,
+# Romania, Bồ Đào Nha cũng dùng: "Il était à côté de la fenêtre" không được coi là tiếng Việt.
+VIETNAMESE_CHARS = frozenset(
+    "đơư"
+    "ạảấầẩẫậắằẳẵặẹẻẽếềểễệỉĩịọỏốồổỗộớờởỡợụủũứừửữựỳỵỷỹ"
+    "ĐƠƯ"
+    "ẠẢẤẦẨẪẬẮẰẲẴẶẸẺẼẾỀỂỄỆỈĨỊỌỎỐỒỔỖỘỚỜỞỠỢỤỦŨỨỪỬỮỰỲỴỶỸ"
+)
+
+# Dòng được coi là tiếng Việt khi tỉ lệ từ có chữ cái riêng của tiếng Việt đạt mức này
+# (dòng tiếng Việt không đạt chỉ bị gửi dịch thừa, còn dòng ngoại ngữ bị giữ nguyên thì mất nội dung)
+MIN_VIETNAMESE_WORD_RATIO = 0.4
+
+# Loại đoạn trong chunk: giữ nguyên, cần dịch, dịch chung (dòng lặp lại nhiều lần trong sách - xem dedup.py)
+SPAN_KEEP = "keep"
+SPAN_TRANSLATE = "translate"
+SPAN_SHARED = "shared"
+
+
+def _is_vietnamese_line(text):
+    words = [word for word in text.split() if any(char.isalpha() for char in word)]
+    if not words:
+        return False
+    vietnamese_words = sum(1 for word in words if any(char in VIETNAMESE_CHARS for char in word))
+    return vietnamese_words / len(words) >= MIN_VIETNAMESE_WORD_RATIO
+
+
+def is_passthrough_line(line):
+    """Dòng không cần dịch: trống, không có chữ cái (dấu câu, dòng phân cách, số), số trang, URL hoặc đã là tiếng Việt"""
+    text = unicodedata.normalize("NFC", line.strip())
+    if not text:
+        return True
+    if any(_is_wide_char(char) for char in text):
+        # Có chữ CJK/Kana/Hangul: luôn cần dịch
+        return False
+    if not any(char.isalpha() for char in text):
+        return True
+    if PAGE_NUMBER_RE.match(text) or URL_LINE_RE.match(text):
+        return True
+    return _is_vietnamese_line(text)
+
+
+def split_passthrough_spans(chunk_lines):
+    """
+    Chia chunk thành các đoạn liên tiếp [(SPAN_KEEP hoặc SPAN_TRANSLATE, lines)].
+    Dòng trống không tự tạo đoạn riêng mà đi theo đoạn phía trước (tránh cắt vụn đoạn cần dịch).
+    """
+    spans = []
+    for line in chunk_lines:
+        kind = SPAN_KEEP if is_passthrough_line(line) else SPAN_TRANSLATE
+        if not line.strip() and spans:
+            kind = spans[-1][0]
+        if spans and spans[-1][0] == kind:
+            spans[-1][1].append(line)
+        else:
+            spans.append((kind, [line]))
+    return spans
+
+
+class PassthroughStats:
+    """Thống kê số token không phải gửi lên API nhờ giữ nguyên dòng không cần dịch"""
+    def __init__(self):
+        self.total_tokens = 0
+        self.skipped_tokens = 0
+        self.skipped_lines = 0
+        self.local_chunks = 0
+
+    def record(self, spans):
+        for kind, lines in spans:
+            tokens = estimate_tokens("".join(lines))
+            self.total_tokens += tokens
+            if kind == SPAN_KEEP:
+                self.skipped_tokens += tokens
+                self.skipped_lines += sum(1 for line in lines if line.strip())
+        if all(kind == SPAN_KEEP for kind, _ in spans):
+            self.local_chunks += 1
+
+    def summary(self):
+        return {
+            'skipped_lines': self.skipped_lines,
+            'skipped_tokens': self.skipped_tokens,
+            'total_tokens': self.total_tokens,
+            'skipped_ratio': round(self.skipped_tokens / self.total_tokens, 3) if self.total_tokens else 0.0,
+            'local_chunks': self.local_chunks,
+        }
@@ -0,0 +1,160 @@
+"""
+Rate limiter dùng chung cho mọi request: giới hạn request/phút (RPM) và token/phút (TPM) theo model.
+"""
+import asyncio
+import json
+import os
+import time
+
+try:
+    from .scheduler import PrioritySemaphore, DEFAULT_PRIORITY
+except ImportError:
+    from scheduler import PrioritySemaphore, DEFAULT_PRIORITY
+
+# Giới hạn RPM/TPM (và RPD - request/ngày nếu có) theo tier tài khoản và model (https://ai.google.dev/gemini-api/docs/rate-limits)
+RATE_LIMIT_PROFILES = {
+    "free": {
+        "gemini-2.0-flash": {"rpm": 15, "tpm": 1_000_000, "rpd": 1500},
+        "gemini-1.5-flash": {"rpm": 15, "tpm": 1_000_000, "rpd": 1500},
+        "gemini-1.5-pro": {"rpm": 2, "tpm": 32_000, "rpd": 50},
+    },
+    "tier1": {
+        "gemini-2.0-flash": {"rpm": 2000, "tpm": 4_000_000},
+        "gemini-1.5-flash": {"rpm": 2000, "tpm": 4_000_000},
+        "gemini-1.5-pro": {"rpm": 1000, "tpm": 4_000_000},
+    },
+}
+
+# Giới hạn dùng khi model không có trong bảng
+DEFAULT_RATE_LIMIT = {"rpm": 15, "tpm": 1_000_000}
+
+# File tùy chỉnh bảng giới hạn, cùng cấu trúc với RATE_LIMIT_PROFILES
+RATE_LIMITS_FILE = "rate_limits.json"
+
+# Tier đặc biệt: tắt rate limiter
+RATE_LIMIT_TIER_OFF = "off"
+
+# Cho phép burst tối đa 10% giới hạn, phần còn lại nạp đều trong một phút.
+# Nhờ vậy trong bất kỳ cửa sổ 60 giây nào cũng không vượt quá giới hạn.
+BURST_FRACTION = 0.1
+
+# Chu kỳ tối đa giữa hai lần kiểm tra khi đang chờ (giây)
+MAX_WAIT_STEP_SECONDS = 1.0
+
+
+def _load_profile_overrides():
+    if not os.path.exists(RATE_LIMITS_FILE):
+        return {}
+    try:
+        with open(RATE_LIMITS_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠️ Không đọc được {RATE_LIMITS_FILE}: {e}")
+        return {}
+
+
+def get_rate_limit_profile(model_name, tier="free"):
+    """
+    Lấy giới hạn {"rpm", "tpm"[, "rpd"]} cho model theo tier.
+    Tên model có hậu tố phiên bản (ví dụ gemini-1.5-pro-002) dùng giới hạn của model gốc.
+    """
+    profiles = dict(RATE_LIMIT_PROFILES.get(tier, {}))
+    profiles.update(_load_profile_overrides().get(tier, {}))
+
+    model_name = (model_name or "").replace("models/", "")
+    best_match = None
+    for profile_model in profiles:
+        if model_name.startswith(profile_model):
+            if best_match is None or len(profile_model) > len(best_match):
+                best_match = profile_model
+    if best_match is None:
+        return dict(DEFAULT_RATE_LIMIT)
+    return dict(profiles[best_match])
+
+
+class TokenBucket:
+    """Token bucket nạp đều theo thời gian; số dư có thể âm khi một request lớn hơn sức chứa."""
+    def __init__(self, per_minute):
+        self.capacity = max(1.0, per_minute * BURST_FRACTION)
+        self.refill_per_second = per_minute * (1 - BURST_FRACTION) / 60.0
+        self.available = self.capacity
+        self._last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self._last_refill) * self.refill_per_second)
+        self._last_refill = now
+
+    def seconds_until(self, amount):
+        """Thời gian chờ đến khi đủ số dư để trừ amount (request lớn hơn sức chứa chỉ cần bucket đầy)"""
+        needed = min(amount, self.capacity)
+        if self.available >= needed:
+            return 0.0
+        return (needed - self.available) / self.refill_per_second
+
+
+class RateLimiter:
+    """
+    Giới hạn RPM và TPM dùng chung cho tất cả request của một API key + model.
+    Mỗi request bị trừ trước số token ước lượng, sau đó điều chỉnh theo số token thực tế.
+    """
+    def __init__(self, rpm, tpm):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._lock = PrioritySemaphore(1)
+        self.total_wait_seconds = 0.0
+        self.total_requests = 0
+        self.total_tokens = 0
+
+    async def acquire(self, estimated_tokens, priority=DEFAULT_PRIORITY):
+        """
+        Chờ đến khi được phép gửi một request tốn estimated_tokens token. Trả về thời gian đã chờ.
+        Lượt được cấp theo priority (số nhỏ trước), cùng priority thì theo thứ tự đến.
+        """
+        wait_start = time.monotonic()
+        # Lock đảm bảo các request được cấp theo thứ tự ưu tiên, không bị "chen ngang"
+        async with self._lock.slot(priority):
+            while True:
+                self._requests.refill()
+                self._tokens.refill()
+                wait_seconds = max(
+                    self._requests.seconds_until(1),
+                    self._tokens.seconds_until(estimated_tokens),
+                )
+                if wait_seconds <= 0:
+                    break
+                await asyncio.sleep(min(wait_seconds, MAX_WAIT_STEP_SECONDS))
+            self._requests.available -= 1
+            self._tokens.available -= estimated_tokens
+            self.total_requests += 1
+            self.total_tokens += estimated_tokens
+        waited = time.monotonic() - wait_start
+        self.total_wait_seconds += waited
+        return waited
+
+    def available_fraction(self):
+        """Tỷ lệ sức chứa còn lại của bucket hạn chế hơn (có thể âm)"""
+        self._requests.refill()
+        self._tokens.refill()
+        return min(
+            self._requests.available / self._requests.capacity,
+            self._tokens.available / self._tokens.capacity,
+        )
+
+    def reconcile(self, estimated_tokens, actual_tokens):
+        """Điều chỉnh bucket token theo số token thực tế API báo về"""
+        if actual_tokens is None:
+            return
+        difference = actual_tokens - estimated_tokens
+        self._tokens.available -= difference
+        self.total_tokens += difference
+
+
+def create_rate_limiter(model_name, tier="free"):
+    """Tạo RateLimiter theo bảng giới hạn, trả về None nếu tier là "off"."""
+    if not tier or tier == RATE_LIMIT_TIER_OFF:
+        return None
+    profile = get_rate_limit_profile(model_name, tier)
+    return RateLimiter(profile["rpm"], profile["tpm"])
@@ -0,0 +1,147 @@
+"""
+Ngân sách retry cho cả lần dịch: giới hạn tổng số lần thử lại theo tỷ lệ số request đã gửi, và trần chi phí
+của từng chunk (số lần thử lại, token gửi đi so với kích thước chunk). Hết ngân sách thì chunk không retry
+thêm mà giữ văn bản gốc kèm dấu đánh dấu, được ghi vào danh sách sửa sau (lần chạy sau chỉ dịch lại các chunk đó)
+thay vì một vài chunk khó đốt hết quota của cả cuốn sách.
+"""
+try:
+    from .chunking import estimate_tokens
+except ImportError:
+    from chunking import estimate_tokens
+
+# Tổng số lần thử lại được phép: tối đa RETRY_BUDGET_RATIO x số request đã gửi (không ít hơn RETRY_BUDGET_MIN_RETRIES)
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MIN_RETRIES = 10
+
+# Trần chi phí mỗi chunk: số lần thử lại (mọi loại lỗi cộng lại) và tổng token gửi đi tính theo số lần kích thước chunk
+MAX_RETRIES_PER_CHUNK = 6
+CHUNK_COST_CEILING = 4.0
+
+# Dấu đánh dấu dòng chưa dịch do hết ngân sách retry
+RETRY_BUDGET_MARKER = "[CHƯA DỊCH - HẾT NGÂN SÁCH RETRY]"
+
+# Dấu của bản dịch chưa đạt (lỗi API, bị bộ lọc an toàn chặn, không cải thiện được, hết ngân sách retry)
+FAILED_TRANSLATION_MARKERS = (
+    "[LỖI XỬ LÝ CHUNK",
+    "[NỘI DỊCH BỊ CHẶN",
+    "[NỘI DUNG GỐC BỊ CHẶN",
+    "[KHÔNG CẢI THIỆN ĐƯỢC]",
+    RETRY_BUDGET_MARKER,
+)
+
+# Lý do từ chối retry (ghi trong thống kê)
+EXHAUSTED_RUN = "run"
+EXHAUSTED_CHUNK = "chunk"
+
+
+def mark_untranslated(chunk_lines, marker=RETRY_BUDGET_MARKER):
+    """Văn bản gốc của chunk, dòng có nội dung đầu tiên mang dấu đánh dấu (giữ nguyên số dòng)"""
+    pieces = list(chunk_lines)
+    for index, line in enumerate(pieces):
+        if line.strip():
+            pieces[index] = f"{marker} {line}"
+            break
+    return "".join(pieces)
+
+
+def is_failed_translation(text):
+    """Bản dịch mang dấu lỗi/chưa dịch: không được dùng lại cho chỗ khác, mỗi chỗ tự thử lại và sửa sau"""
+    return any(marker in text for marker in FAILED_TRANSLATION_MARKERS)
+
+
+class RetryBudget:
+    """
+    Ngân sách retry của một lần dịch.
+    record_call() ghi nhận mỗi request có response (request bị rate limit không tính), allow_retry() quyết định
+    chunk còn được thử lại (hoặc chia đôi) không. Chunk bị từ chối nằm trong repair_chunks.
+    Các chunk đang dịch đồng thời cùng được duyệt trước khi request của nhau có response nên tổng số lần
+    thử lại có thể vượt ngân sách chung một chút (tối đa cỡ số request đồng thời).
+    """
+    def __init__(self, retry_ratio=RETRY_BUDGET_RATIO, min_retries=RETRY_BUDGET_MIN_RETRIES, max_retries_per_chunk=MAX_RETRIES_PER_CHUNK, chunk_cost_ceiling=CHUNK_COST_CEILING):
+        self.retry_ratio = retry_ratio
+        self.min_retries = min_retries
+        self.max_retries_per_chunk = max_retries_per_chunk
+        self.chunk_cost_ceiling = chunk_cost_ceiling
+        self.calls = 0
+        self.retries = 0
+        self.first_attempt_tokens = 0
+        self.retry_tokens = 0
+        # Chunk đang dịch: {chunk_index: [token gốc của chunk, token đã gửi, số lần thử lại]}
+        self._chunks = {}
+        self.repair_chunks = set()
+        self.exhausted = {EXHAUSTED_RUN: 0, EXHAUSTED_CHUNK: 0}
+
+    def open_chunk(self, chunk_index, chunk_lines):
+        """Bắt đầu tính chi phí của chunk (mọi request của chunk, kể cả các đoạn/nửa chunk và bản sao, cộng chung)"""
+        if chunk_index not in self._chunks:
+            self._chunks[chunk_index] = [estimate_tokens("".join(chunk_lines)), 0, 0]
+
+    def close_chunk(self, chunk_index):
+        """Chunk đã xong; True nếu chunk phải dịch lại ở lần sau (hết ngân sách)"""
+        self._chunks.pop(chunk_index, None)
+        return chunk_index in self.repair_chunks
+
+    def allowed_retries(self):
+        return max(self.min_retries, int(self.calls * self.retry_ratio))
+
+    def budgeted_tokens(self):
+        """Token dự kiến: token của lần gửi đầu cộng phần retry được phép"""
+        return int(self.first_attempt_tokens * (1 + self.retry_ratio))
+
+    def spent_tokens(self):
+        return self.first_attempt_tokens + self.retry_tokens
+
+    def record_call(self, chunk_index, request_tokens, request_lines, is_retry):
+        """Một request đã có response (request_tokens: token ước lượng cả prompt)"""
+        self.calls += 1
+        if is_retry:
+            self.retries += 1
+            self.retry_tokens += request_tokens
+        else:
+            self.first_attempt_tokens += request_tokens
+        chunk_cost = self._chunks.get(chunk_index)
+        if chunk_cost is not None:
+            chunk_cost[1] += estimate_tokens("".join(request_lines))
+            if is_retry:
+                chunk_cost[2] += 1
+
+    def allow_retry(self, chunk_index, request_lines, requests=1):
+        """
+        Chunk còn được gửi lại request_lines (chia thành requests request, vd. hai nửa khi chia đôi) không.
+        Hết ngân sách thì chunk được ghi vào repair_chunks
+        (gói nhiều chunk, chunk_index < 0, không vào danh sách: từng chunk trong gói sẽ được dịch riêng).
+        """
+        reason = None
+        if self.retries + requests > self.allowed_retries():
+            reason = EXHAUSTED_RUN
+        else:
+            chunk_cost = self._chunks.get(chunk_index)
+            if chunk_cost is not None:
+                base_tokens, spent_tokens, chunk_retries = chunk_cost
+                next_tokens = estimate_tokens("".join(request_lines))
+                if chunk_retries + requests > self.max_retries_per_chunk or spent_tokens + next_tokens > base_tokens * self.chunk_cost_ceiling:
+                    reason = EXHAUSTED_CHUNK
+        if reason is None:
+            return True
+        self.exhausted[reason] += 1
+        if chunk_index >= 0:
+            self.repair_chunks.add(chunk_index)
+        return False
+
+    def status(self):
+        """Dòng trạng thái ngắn (hiển thị trong log/GUI)"""
+        return f"{self.retries}/{self.allowed_retries()} lượt retry, ~{self.spent_tokens()}/{self.budgeted_tokens()} token"
+
+    def summary(self):
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'allowed_retries': self.allowed_retries(),
+            'first_attempt_tokens': self.first_attempt_tokens,
+            'retry_tokens': self.retry_tokens,
+            'spent_tokens': self.spent_tokens(),
+            'budgeted_tokens': self.budgeted_tokens(),
+            'exhausted_run': self.exhausted[EXHAUSTED_RUN],
+            'exhausted_chunk': self.exhausted[EXHAUSTED_CHUNK],
+            'repair_chunks': len(self.repair_chunks),
+        }
@@ -0,0 +1,156 @@
+"""
+Chính sách retry: exponential backoff với full jitter, lịch retry riêng cho từng loại lỗi
+và tôn trọng thời gian chờ server gợi ý (retry-after).
+"""
+import random
+import re
+
+# Các loại lỗi được retry
+ERROR_NETWORK = "network"            # Lỗi mạng tạm thời (timeout, mất kết nối...)
+ERROR_SERVER = "server"              # Lỗi 5xx từ server
+ERROR_RATE_LIMIT = "rate_limit"      # Lỗi 429 / hết quota tạm thời
+ERROR_SAFETY = "safety"              # Bị bộ lọc an toàn chặn
+ERROR_BAD_TRANSLATION = "bad_translation"  # Bản dịch rỗng hoặc AI từ chối dịch
+ERROR_TRUNCATED = "truncated"        # Bản dịch bị cắt do chạm giới hạn output (finish reason MAX_TOKENS)
+
+# Lịch retry mặc định: số lần thử tối đa, thời gian chờ cơ sở và tối đa (giây)
+DEFAULT_RETRY_SCHEDULE = {
+    ERROR_NETWORK: {"max_attempts": 5, "base_delay": 1, "max_delay": 30},
+    ERROR_SERVER: {"max_attempts": 5, "base_delay": 2, "max_delay": 60},
+    ERROR_RATE_LIMIT: {"max_attempts": 6, "base_delay": 5, "max_delay": 120},
+    ERROR_SAFETY: {"max_attempts": 5, "base_delay": 2, "max_delay": 20},
+    ERROR_BAD_TRANSLATION: {"max_attempts": 5, "base_delay": 2, "max_delay": 20},
+    ERROR_TRUNCATED: {"max_attempts": 3, "base_delay": 1, "max_delay": 10},
+}
+
+RATE_LIMIT_KEYWORDS = [
+    "429",
+    "exceeded your current quota",
+    "quota exceeded",
+    "resource has been exhausted",
+    "resource_exhausted",
+    "rate limit",
+    "billing",
+    "please check your plan",
+]
+
+# 429 do hết quota ngày (không phải giới hạn theo phút): key không dùng lại được đến khi quota reset
+QUOTA_EXHAUSTED_KEYWORDS = [
+    "perday",
+    "per_day",
+    "per day",
+    "daily",
+]
+
+SERVER_ERROR_KEYWORDS = [
+    "500", "502", "503", "504",
+    "internal error", "internal server error",
+    "service unavailable", "unavailable",
+    "bad gateway", "overloaded",
+]
+
+NETWORK_ERROR_KEYWORDS = [
+    "timeout", "timed out", "deadline exceeded",
+    "connection", "connect", "reset by peer",
+    "broken pipe", "ssl", "network", "socket", "eof",
+]
+
+# Các dạng gợi ý thời gian chờ trong thông báo lỗi của Gemini / HTTP
+RETRY_AFTER_PATTERNS = [
+    re.compile(r'retry_delay\s*\{\s*seconds:\s*(\d+)', re.IGNORECASE),
+    re.compile(r'retry[- ]after[:=\s]+(\d+(?:\.\d+)?)', re.IGNORECASE),
+    re.compile(r'retry in (\d+(?:\.\d+)?)\s*s', re.IGNORECASE),
+    re.compile(r'"retryDelay":\s*"(\d+(?:\.\d+)?)s"', re.IGNORECASE),
+]
+
+
+def is_rate_limit_error(error_message):
+    """Kiểm tra lỗi 429 / rate limit / quota"""
+    error_str = str(error_message).lower()
+    return any(keyword in error_str for keyword in RATE_LIMIT_KEYWORDS)
+
+
+def is_quota_exhausted_error(error_message):
+    """Lỗi 429 do hết quota ngày (vd. quota_id "GenerateRequestsPerDayPerProjectPerModel"), không phải giới hạn theo phút"""
+    error_str = str(error_message).lower()
+    return is_rate_limit_error(error_str) and any(keyword in error_str for keyword in QUOTA_EXHAUSTED_KEYWORDS)
+
+
+def classify_error(error):
+    """Phân loại exception của API thành một trong các loại lỗi ở trên"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return ERROR_NETWORK
+    error_str = str(error).lower()
+    if is_rate_limit_error(error_str):
+        return ERROR_RATE_LIMIT
+    if any(keyword in error_str for keyword in SERVER_ERROR_KEYWORDS):
+        return ERROR_SERVER
+    if any(keyword in error_str for keyword in NETWORK_ERROR_KEYWORDS):
+        return ERROR_NETWORK
+    return ERROR_SERVER
+
+
+def parse_retry_after(error):
+    """Đọc thời gian chờ server gợi ý (giây) từ exception, None nếu không có"""
+    retry_after = getattr(error, 'retry_after', None)
+    if retry_after is not None:
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            pass
+    error_str = str(error)
+    for pattern in RETRY_AFTER_PATTERNS:
+        match = pattern.search(error_str)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """
+    Tính thời gian chờ trước mỗi lần retry:
+    delay = random(0, min(max_delay, base_delay * 2^(attempt-1))), không nhỏ hơn retry-after của server.
+    """
+    def __init__(self, schedule=None, jitter=True):
+        self.schedule = {error_class: dict(config) for error_class, config in DEFAULT_RETRY_SCHEDULE.items()}
+        for error_class, config in (schedule or {}).items():
+            self.schedule.setdefault(error_class, dict(DEFAULT_RETRY_SCHEDULE[ERROR_SERVER])).update(config)
+        self.jitter = jitter
+        self.retry_counts = {error_class: 0 for error_class in self.schedule}
+        self.total_sleep_seconds = 0.0
+        self.retry_after_hints_used = 0
+
+    def max_attempts(self, error_class):
+        """Số lần lỗi tối đa của loại lỗi này trước khi bỏ cuộc"""
+        return self.schedule[error_class]["max_attempts"]
+
+    def compute_delay(self, error_class, attempt, retry_after=None):
+        """Thời gian chờ trước lần retry thứ attempt (bắt đầu từ 1)"""
+        config = self.schedule[error_class]
+        cap = min(config["max_delay"], config["base_delay"] * (2 ** (attempt - 1)))
+        delay = random.uniform(0, cap) if self.jitter else cap
+        if retry_after is not None and retry_after > delay:
+            delay = retry_after
+            self.retry_after_hints_used += 1
+        self.retry_counts[error_class] = self.retry_counts.get(error_class, 0) + 1
+        self.total_sleep_seconds += delay
+        return delay
+
+    def record_retry(self, error_class):
+        """Ghi nhận một lần retry không cần chờ (ví dụ chuyển sang API key khác)"""
+        self.retry_counts[error_class] = self.retry_counts.get(error_class, 0) + 1
+
+    def describe(self):
+        """Mô tả ngắn gọn lịch retry để in ra log"""
+        return ", ".join(
+            f"{error_class}: {config['max_attempts']} lần, {config['base_delay']}-{config['max_delay']}s"
+            for error_class, config in self.schedule.items()
+        )
+
+    def summary(self):
+        """Thống kê retry của lần chạy"""
+        return {
+            'retries': dict(self.retry_counts),
+            'total_sleep_seconds': round(self.total_sleep_seconds, 1),
+            'retry_after_hints_used': self.retry_after_hints_used,
+        }
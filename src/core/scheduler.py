@@ -0,0 +1,141 @@
+"""
+Lập lịch theo độ ưu tiên: output được ghi theo đúng thứ tự chunk, nên slot request đồng thời và lượt của rate limiter
+được cấp cho chunk gần chỗ ghi tiếp theo trước (số thứ tự chunk nhỏ hơn), kể cả lần thử lại của chunk đó,
+thay vì theo thứ tự đến. Các chương đầu được ghi xong sớm hơn và số chunk xong nhưng chưa ghi được giữ nhỏ.
+"""
+import asyncio
+import heapq
+import itertools
+import re
+import time
+
+# Độ ưu tiên mặc định khi không gắn với chunk nào (số nhỏ được cấp trước)
+DEFAULT_PRIORITY = 0
+
+# Dòng tiêu đề chương trong truyện gốc ("第十二章 ...", "Chương 12", "Chapter 12"), dùng để đo thời gian ghi xong chương đầu
+CHAPTER_HEADING_RE = re.compile(
+    r'^\s*(?:第[0-9０-９零〇一二三四五六七八九十百千两兩]+[章回节節卷]|chương\s+\d+|chapter\s+\d+)',
+    re.IGNORECASE,
+)
+
+
+class PrioritySemaphore:
+    """
+    Semaphore cấp lượt theo độ ưu tiên: số nhỏ được cấp trước, cùng độ ưu tiên thì theo thứ tự đến.
+    limit có thể đổi khi đang chạy (gọi wake() sau khi tăng để cấp lượt cho người đang chờ).
+    """
+    def __init__(self, limit=1):
+        self.limit = limit
+        self.in_use = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+
+    def _has_waiters(self):
+        # Bỏ các lượt chờ đã bị hủy ở đầu heap
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+        return bool(self._waiters)
+
+    def waiting(self):
+        return sum(1 for _, _, future in self._waiters if not future.done())
+
+    async def acquire(self, priority=DEFAULT_PRIORITY):
+        if self.in_use < self.limit and not self._has_waiters():
+            self.in_use += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Đã được cấp lượt nhưng bị hủy trước khi dùng: trả lại cho người chờ tiếp theo
+                self.release()
+            raise
+
+    def release(self):
+        self.in_use -= 1
+        self.wake()
+
+    def wake(self):
+        """Cấp lượt cho những người chờ ưu tiên nhất khi còn chỗ"""
+        while self.in_use < self.limit and self._has_waiters():
+            _, _, future = heapq.heappop(self._waiters)
+            self.in_use += 1
+            future.set_result(None)
+
+    def slot(self, priority=DEFAULT_PRIORITY):
+        """async with semaphore.slot(priority): ..."""
+        return _PrioritySlot(self, priority)
+
+
+class _PrioritySlot:
+    def __init__(self, semaphore, priority):
+        self._semaphore = semaphore
+        self._priority = priority
+
+    async def __aenter__(self):
+        await self._semaphore.acquire(self._priority)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+        return False
+
+
+def find_first_chapter_end(chunks_iter):
+    """
+    Chunk chứa tiêu đề chương thứ hai (chương đầu xong khi chỗ ghi vượt qua chunk này), None nếu sách không có.
+    chunks_iter: iterable (chunk_index, chunk_lines) của cả cuốn sách, chỉ đọc đến tiêu đề chương thứ hai.
+    """
+    headings_seen = 0
+    for chunk_index, chunk_lines in chunks_iter:
+        for line in chunk_lines:
+            if CHAPTER_HEADING_RE.match(line):
+                headings_seen += 1
+                if headings_seen == 2:
+                    return chunk_index
+    return None
+
+
+class WriteFrontierStats:
+    """
+    Theo dõi chỗ ghi tiếp theo (write frontier): thời gian đến khi chunk đầu tiên và chương đầu tiên được ghi liền mạch,
+    và độ sâu bộ đệm sắp xếp lại (số chunk đã xong nhưng còn chờ chunk đứng trước).
+    first_chapter_end: chunk chứa tiêu đề chương thứ hai (find_first_chapter_end, tính trên cả cuốn sách trước khi
+    gửi chunk); None thì thời gian đến khi xong chương đầu được báo là "n/a".
+    """
+    def __init__(self, first_chapter_end=None):
+        self.start_time = time.monotonic()
+        self.time_to_first_chunk = None
+        self.time_to_first_chapter = None
+        self.first_chapter_end = first_chapter_end
+        self.buffer_depth = 0
+        self.max_buffer_depth = 0
+        self._buffer_depth_total = 0
+        self._samples = 0
+
+    def record(self, frontier, done_count):
+        """Cập nhật sau mỗi chunk xong: frontier là chunk tiếp theo chưa xong, done_count là số chunk đã xong"""
+        elapsed = time.monotonic() - self.start_time
+        if self.time_to_first_chunk is None and frontier > 0:
+            self.time_to_first_chunk = elapsed
+        if self.time_to_first_chapter is None and self.first_chapter_end is not None and frontier > self.first_chapter_end:
+            self.time_to_first_chapter = elapsed
+        self.buffer_depth = max(0, done_count - frontier)
+        self.max_buffer_depth = max(self.max_buffer_depth, self.buffer_depth)
+        self._buffer_depth_total += self.buffer_depth
+        self._samples += 1
+
+    def summary(self):
+        if self.first_chapter_end is None:
+            time_to_first_chapter = "n/a"
+        else:
+            time_to_first_chapter = round(self.time_to_first_chapter, 2) if self.time_to_first_chapter is not None else None
+        return {
+            'time_to_first_chunk_seconds': round(self.time_to_first_chunk, 2) if self.time_to_first_chunk is not None else None,
+            'time_to_first_chapter_seconds': time_to_first_chapter,
+            'buffer_depth': self.buffer_depth,
+            'max_buffer_depth': self.max_buffer_depth,
+            'avg_buffer_depth': round(self._buffer_depth_total / self._samples, 1) if self._samples else 0.0,
+        }
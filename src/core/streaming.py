@@ -0,0 +1,123 @@
+"""
+Nhận response dạng stream: bản dịch được đọc dần từng phần thay vì chờ cả response. Phần đầu (vài trăm ký tự)
+được kiểm tra câu từ chối ngay khi về; AI từ chối thì ngắt stream và thử lại luôn, không phải chờ
+(và trả tiền) cho cả phần output còn lại của một chunk lớn.
+"""
+import asyncio
+import time
+from array import array
+
+try:
+    from .chunking import estimate_tokens
+    from .hedging import percentile
+    from .watchdog import with_timeout, STOP_GRACE_SECONDS
+except ImportError:
+    from chunking import estimate_tokens
+    from hedging import percentile
+    from watchdog import with_timeout, STOP_GRACE_SECONDS
+
+# Số ký tự đầu của response được kiểm tra câu từ chối (câu từ chối luôn nằm ở đầu)
+STREAM_CHECK_CHARS = 300
+
+
+class StreamedResponse:
+    """
+    Response ghép từ các phần của stream, có cùng các thuộc tính với GenerateContentResponse
+    mà translate_chunk_async dùng (text, prompt_feedback, candidates, usage_metadata).
+    """
+    def __init__(self):
+        self._pieces = []
+        self.received_chars = 0
+        self.prompt_feedback = None
+        self.candidates = []
+        self.usage_metadata = None
+        self.aborted = False
+        self.first_token_seconds = None
+
+    @property
+    def text(self):
+        return "".join(self._pieces)
+
+
+async def read_stream(response_stream, should_abort=None, request_start=None, check_chars=STREAM_CHECK_CHARS, read_timeout=None):
+    """
+    Đọc hết stream, hoặc ngắt sớm khi should_abort(phần đầu response) trả về True (chỉ xét check_chars ký tự đầu).
+    request_start: thời điểm gửi request (time.monotonic) để tính thời gian đến token đầu tiên.
+    read_timeout: thời gian chờ tối đa giữa hai phần liên tiếp (giây), quá hạn thì ném RequestTimeoutError.
+    Đóng stream chờ tối đa STOP_GRACE_SECONDS; bị hủy (dừng, watchdog) thì không chờ đóng stream.
+    """
+    if request_start is None:
+        request_start = time.monotonic()
+    streamed = StreamedResponse()
+    iterator = response_stream.__aiter__()
+    cancelled = False
+    try:
+        while True:
+            try:
+                part = await with_timeout(iterator.__anext__(), read_timeout, "chờ phần tiếp theo của stream")
+            except StopAsyncIteration:
+                break
+            if getattr(part, 'prompt_feedback', None):
+                streamed.prompt_feedback = part.prompt_feedback
+            if getattr(part, 'candidates', None):
+                # Lý do kết thúc/safety ratings nằm ở phần cuối
+                streamed.candidates = part.candidates
+            if getattr(part, 'usage_metadata', None) is not None:
+                streamed.usage_metadata = part.usage_metadata
+            try:
+                piece = part.text
+            except ValueError:
+                # Phần không có văn bản (ví dụ chỉ mang lý do kết thúc)
+                piece = ""
+            if not piece:
+                continue
+            if streamed.first_token_seconds is None:
+                streamed.first_token_seconds = time.monotonic() - request_start
+            checked_before = streamed.received_chars
+            streamed._pieces.append(piece)
+            streamed.received_chars += len(piece)
+            if should_abort is not None and checked_before < check_chars and should_abort(streamed.text[:check_chars]):
+                streamed.aborted = True
+                break
+    except asyncio.CancelledError:
+        cancelled = True
+        raise
+    finally:
+        # Đóng stream (ngắt kết nối) khi ngắt sớm hoặc có lỗi
+        aclose = getattr(iterator, 'aclose', None)
+        if aclose is not None and not cancelled:
+            try:
+                await with_timeout(aclose(), STOP_GRACE_SECONDS, "đóng stream")
+            except Exception:
+                # Không đóng được (vd. "aclose(): asynchronous generator is already running" khi phần đang đọc
+                # chưa dừng hẳn): bỏ qua, lỗi gốc (timeout đọc...) vẫn được ném ra
+                pass
+    return streamed
+
+
+class StreamingStats:
+    """Thống kê stream: thời gian đến token đầu tiên, số stream bị ngắt sớm và output token tránh được nhờ ngắt sớm"""
+    def __init__(self):
+        self.streams = 0
+        self.aborted_streams = 0
+        self.avoided_output_tokens = 0
+        self._first_token_seconds = array('d')
+
+    def record(self, streamed, source_text):
+        """source_text: văn bản gửi dịch (ước lượng độ dài output đầy đủ)"""
+        self.streams += 1
+        if streamed.first_token_seconds is not None:
+            self._first_token_seconds.append(streamed.first_token_seconds)
+        if streamed.aborted:
+            self.aborted_streams += 1
+            self.avoided_output_tokens += max(0, estimate_tokens(source_text) - estimate_tokens(streamed.text))
+
+    def summary(self):
+        first_token_seconds = sorted(self._first_token_seconds)
+        return {
+            'streams': self.streams,
+            'aborted_streams': self.aborted_streams,
+            'avoided_output_tokens': self.avoided_output_tokens,
+            'first_token_p50_seconds': round(percentile(first_token_seconds, 0.5) or 0.0, 2),
+            'first_token_p95_seconds': round(percentile(first_token_seconds, 0.95) or 0.0, 2),
+        }
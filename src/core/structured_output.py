@@ -0,0 +1,161 @@
+"""
+Dịch theo dòng với structured output: gửi các dòng cần dịch dưới dạng mảng JSON và yêu cầu model trả về
+mảng JSON cùng số phần tử, phần tử thứ i là bản dịch của dòng thứ i. Dòng đạt yêu cầu được nhận ngay,
+lần thử lại chỉ gửi các dòng bị lỗi thay vì cả chunk; lệch số dòng được phát hiện chắc chắn.
+"""
+import json
+import re
+
+try:
+    from .chunking import estimate_tokens
+except ImportError:
+    from chunking import estimate_tokens
+
+# Prompt dịch theo dòng ({count} là số dòng, {lines_json} là mảng JSON các dòng cần dịch)
+STRUCTURED_PROMPT_TEMPLATE = (
+    "Dịch từng phần tử của mảng JSON sau sang tiếng Việt một cách trực tiếp, xác định mối quan hệ và danh xưng phù hợp trước tiên, "
+    "không từ chối hoặc bình luận, giữ nguyên văn phong gốc và chi tiết nội dung. "
+    "Trả về duy nhất một mảng JSON gồm đúng {count} chuỗi, phần tử thứ i là bản dịch của phần tử thứ i, không gộp hoặc tách dòng:"
+    "\n\n{lines_json}"
+)
+
+# Schema của response (generation_config.response_schema): mảng chuỗi
+STRUCTURED_RESPONSE_SCHEMA = {"type": "array", "items": {"type": "string"}}
+
+# Model đôi khi vẫn bọc JSON trong khối ```json ... ```
+_CODE_FENCE_RE = re.compile(r'^```(?:json)?\s*(.*?)\s*```$', re.DOTALL)
+
+
+def build_structured_prompt(source_lines, glossary_block=""):
+    """Prompt dịch theo dòng; glossary_block (nếu có) đặt ở đầu prompt như chế độ thường"""
+    prompt = STRUCTURED_PROMPT_TEMPLATE.format(count=len(source_lines), lines_json=json.dumps(source_lines, ensure_ascii=False))
+    if glossary_block:
+        prompt = f"{glossary_block}\n\n{prompt}"
+    return prompt
+
+
+def parse_structured_response(text, expected_count):
+    """Mảng bản dịch từ response, None nếu không phải mảng chuỗi JSON hoặc số phần tử không khớp"""
+    if text is None:
+        return None
+    text = text.strip()
+    fenced = _CODE_FENCE_RE.match(text)
+    if fenced:
+        text = fenced.group(1)
+    try:
+        items = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(items, list) or len(items) != expected_count:
+        return None
+    if not all(isinstance(item, str) for item in items):
+        return None
+    return items
+
+
+class AlignedChunk:
+    """
+    Trạng thái dịch theo dòng của một chunk: dòng nào đã có bản dịch đạt, dòng nào còn phải gửi lại.
+    Dòng trống không gửi đi, được giữ nguyên vị trí khi ghép bản dịch.
+    """
+    def __init__(self, chunk_lines):
+        self.chunk_lines = chunk_lines
+        self.pending = [index for index, line in enumerate(chunk_lines) if line.strip()]
+        self.results = {}
+        # Bản dịch không đạt gần nhất của từng dòng (dùng khi hết lượt thử lại)
+        self.last_bad = {}
+        # Số request đã gửi cho chunk này (StructuredOutputStats.record_request)
+        self.attempts = 0
+
+    def pending_lines(self):
+        return [self.chunk_lines[index].rstrip("\r\n") for index in self.pending]
+
+    def pending_source_lines(self):
+        return [self.chunk_lines[index] for index in self.pending]
+
+    def pending_tokens(self):
+        return estimate_tokens("".join(self.pending_lines()))
+
+    def accept(self, response_text, is_bad_line, stats=None):
+        """
+        Nhận các dòng đạt yêu cầu từ response (is_bad_line(text) -> True nếu dòng không đạt).
+        Trả về True khi mọi dòng đều đã có bản dịch; response lệch số dòng không được nhận dòng nào.
+        """
+        items = parse_structured_response(response_text, len(self.pending))
+        if stats is not None:
+            stats.record_response(self, items)
+        if items is None:
+            return False
+        still_pending = []
+        for index, translated_line in zip(self.pending, items):
+            if is_bad_line(translated_line):
+                self.last_bad[index] = translated_line
+                still_pending.append(index)
+            else:
+                self.results[index] = translated_line.strip("\r\n")
+        self.pending = still_pending
+        return not self.pending
+
+    def assemble(self, failure_message=None, source_fallback=False):
+        """
+        Ghép bản dịch của cả chunk, giữ nguyên dòng trống và ký tự xuống dòng của từng dòng gốc.
+        Dòng chưa dịch được (hết lượt thử lại): giữ nguyên dòng gốc nếu source_fallback, nếu không thì
+        bản dịch không đạt cuối cùng kèm "[KHÔNG CẢI THIỆN ĐƯỢC]", hoặc failure_message kèm dòng gốc.
+        """
+        pieces = []
+        for index, line in enumerate(self.chunk_lines):
+            text = line.rstrip("\r\n")
+            newline = line[len(text):]
+            if not line.strip():
+                pieces.append(line)
+                continue
+            if index in self.results:
+                text = self.results[index]
+            elif source_fallback:
+                pass
+            elif self.last_bad.get(index, "").strip():
+                text = f"{self.last_bad[index]} [KHÔNG CẢI THIỆN ĐƯỢC]"
+            else:
+                text = f"{failure_message or '[KHÔNG DỊCH ĐƯỢC]'} {text}"
+            pieces.append(text + newline)
+        return "".join(pieces)
+
+
+class StructuredOutputStats:
+    """
+    Thống kê dịch theo dòng: số dòng nhận ngay, số dòng phải gửi lại, số response lệch số dòng,
+    và số token không phải gửi lại nhờ chỉ thử lại các dòng lỗi (so với gửi lại cả chunk).
+    """
+    def __init__(self):
+        self.responses = 0
+        self.mismatches = 0
+        self.lines_sent = 0
+        self.retried_lines = 0
+        self.retried_tokens = 0
+        self.avoided_tokens = 0
+
+    def record_request(self, aligned):
+        """Ghi nhận một request sắp gửi các dòng còn chờ của aligned"""
+        self.lines_sent += len(aligned.pending)
+        if aligned.attempts:
+            self.retried_lines += len(aligned.pending)
+            self.retried_tokens += aligned.pending_tokens()
+            # Chế độ thường sẽ gửi lại cả chunk, kể cả các dòng đã dịch đạt
+            accepted_text = "".join(aligned.chunk_lines[index] for index in aligned.results)
+            self.avoided_tokens += estimate_tokens(accepted_text)
+        aligned.attempts += 1
+
+    def record_response(self, aligned, items):
+        self.responses += 1
+        if items is None:
+            self.mismatches += 1
+
+    def summary(self):
+        return {
+            'responses': self.responses,
+            'mismatches': self.mismatches,
+            'lines_sent': self.lines_sent,
+            'retried_lines': self.retried_lines,
+            'retried_tokens': self.retried_tokens,
+            'avoided_tokens': self.avoided_tokens,
+        }
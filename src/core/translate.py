@@ -1,9 +1,12 @@
 import os
+import inspect
 import google.generativeai as genai
+from google.ai import generativelanguage as glm
 import time
 import json
 import re
-import concurrent.futures
+import asyncio
+import itertools
 import threading
 from multiprocessing import cpu_count
 
@@ -16,28 +19,187 @@ except ImportError:
     CAN_REFORMAT = False
     print("⚠️ Không thể import reformat.py - chức năng reformat sẽ bị tắt")
 
+# Import chunking helpers (đọc file nguồn theo kiểu streaming)
+try:
+    from .chunking import iter_chunks, count_chunks, count_source_lines, estimate_tokens
+except ImportError:
+    from chunking import iter_chunks, count_chunks, count_source_lines, estimate_tokens
+
+# Import backend giả lập (chạy offline khi model_name bắt đầu bằng "local-")
+try:
+    from .local_backend import LocalGenerativeModel, is_local_model
+except ImportError:
+    from local_backend import LocalGenerativeModel, is_local_model
+
+# Import bộ điều khiển số request đồng thời (AIMD)
+try:
+    from .concurrency import ConcurrencyController, load_concurrency_level, save_concurrency_level
+except ImportError:
+    from concurrency import ConcurrencyController, load_concurrency_level, save_concurrency_level
+
+# Import pool API key (mỗi key có rate limiter RPM/TPM và quota ngày riêng)
+try:
+    from .key_pool import ApiKeyPool, describe_quota_status
+except ImportError:
+    from key_pool import ApiKeyPool, describe_quota_status
+
+# Import cache bản dịch theo nội dung (SQLite)
+try:
+    from .translation_cache import open_translation_cache, make_cache_key, TRANSLATION_CACHE_FILE
+except ImportError:
+    from translation_cache import open_translation_cache, make_cache_key, TRANSLATION_CACHE_FILE
+
+# Import nhật ký hoàn thành chunk (append-only)
+try:
+    from .journal import CompletionJournal, chunk_source_hash, chunking_signature, line_hash, get_journal_path, count_journal_chunks
+except ImportError:
+    from journal import CompletionJournal, chunk_source_hash, chunking_signature, line_hash, get_journal_path, count_journal_chunks
+
+# Import dịch tăng dần (manifest hash nội dung gốc + bản dịch của lần dịch trước)
+try:
+    from .incremental import open_manifest, plan_incremental_chunks, write_manifest
+except ImportError:
+    from incremental import open_manifest, plan_incremental_chunks, write_manifest
+
+# Import context caching (upload phần prompt dùng chung một lần cho mỗi API key)
+try:
+    from .context_cache import ContextCacheManager, is_cache_missing_error, CONTEXT_CACHE_TTL_SECONDS
+except ImportError:
+    from context_cache import ContextCacheManager, is_cache_missing_error, CONTEXT_CACHE_TTL_SECONDS
+
+# Import glossary (chỉ gửi kèm thuật ngữ có trong chunk)
+try:
+    from .glossary import load_glossary
+except ImportError:
+    from glossary import load_glossary
+
+# Import gộp nhiều chunk nhỏ vào một request
+try:
+    from .packing import ChunkPacker, MAX_CHUNKS_PER_PACK
+except ImportError:
+    from packing import ChunkPacker, MAX_CHUNKS_PER_PACK
+
+# Import phân loại dòng không cần dịch (giữ nguyên tại chỗ, không gửi API)
+try:
+    from .passthrough import split_passthrough_spans, PassthroughStats, SPAN_KEEP, SPAN_TRANSLATE, SPAN_SHARED
+except ImportError:
+    from passthrough import split_passthrough_spans, PassthroughStats, SPAN_KEEP, SPAN_TRANSLATE, SPAN_SHARED
+
+# Import khử trùng lặp dòng/chunk lặp lại trong sách
+try:
+    from .dedup import build_book_deduplicator
+except ImportError:
+    from dedup import build_book_deduplicator
+
+# Import dịch theo dòng (structured output: mảng JSON khớp từng dòng)
+try:
+    from .structured_output import AlignedChunk, StructuredOutputStats, build_structured_prompt, STRUCTURED_PROMPT_TEMPLATE, STRUCTURED_RESPONSE_SCHEMA
+except ImportError:
+    from structured_output import AlignedChunk, StructuredOutputStats, build_structured_prompt, STRUCTURED_PROMPT_TEMPLATE, STRUCTURED_RESPONSE_SCHEMA
+
+# Import chia đôi chunk bị chặn/bị cắt để cô lập dòng gây lỗi
+try:
+    from .bisection import split_in_halves, join_translated_parts, BisectionStats, BISECT_LINE_MAX_ATTEMPTS
+except ImportError:
+    from bisection import split_in_halves, join_translated_parts, BisectionStats, BISECT_LINE_MAX_ATTEMPTS
+
+# Import ngân sách retry (giới hạn retry cả lần dịch và chi phí mỗi chunk)
+try:
+    from .retry_budget import RetryBudget, mark_untranslated, is_failed_translation, RETRY_BUDGET_RATIO, RETRY_BUDGET_MARKER
+except ImportError:
+    from retry_budget import RetryBudget, mark_untranslated, is_failed_translation, RETRY_BUDGET_RATIO, RETRY_BUDGET_MARKER
+
+# Import request dự phòng cho chunk chậm đang chặn việc ghi output theo thứ tự
+try:
+    from .hedging import HedgeController
+except ImportError:
+    from hedging import HedgeController
+
+# Import theo dõi chỗ ghi tiếp theo (thời gian ghi xong chương đầu, độ sâu bộ đệm sắp xếp lại)
+try:
+    from .scheduler import WriteFrontierStats, find_first_chapter_end
+except ImportError:
+    from scheduler import WriteFrontierStats, find_first_chapter_end
+
+# Import nhận response dạng stream (ngắt sớm khi AI từ chối)
+try:
+    from .streaming import read_stream, StreamingStats
+except ImportError:
+    from streaming import read_stream, StreamingStats
+
+# Import timeout mỗi request và watchdog cho chunk bị treo
+try:
+    from .watchdog import ChunkWatchdog, RequestTimeoutError, with_timeout, finish_within, run_with_stop_grace, REQUEST_CONNECT_TIMEOUT_SECONDS, REQUEST_READ_TIMEOUT_SECONDS, STOP_GRACE_SECONDS
+except ImportError:
+    from watchdog import ChunkWatchdog, RequestTimeoutError, with_timeout, finish_within, run_with_stop_grace, REQUEST_CONNECT_TIMEOUT_SECONDS, REQUEST_READ_TIMEOUT_SECONDS, STOP_GRACE_SECONDS
+
+# Import lọc rác (watermark/quảng cáo của web truyện) trước khi chia chunk
+try:
+    from .junk_filter import build_junk_filter, filter_source_file, get_junk_report_path, junk_patterns_fingerprint
+except ImportError:
+    from junk_filter import build_junk_filter, filter_source_file, get_junk_report_path, junk_patterns_fingerprint
+
+# Import chính sách retry (backoff + jitter theo từng loại lỗi)
+try:
+    from .retry_policy import (
+        RetryPolicy, classify_error, parse_retry_after, is_rate_limit_error, is_quota_exhausted_error,
+        ERROR_RATE_LIMIT, ERROR_SAFETY, ERROR_BAD_TRANSLATION, ERROR_TRUNCATED,
+    )
+except ImportError:
+    from retry_policy import (
+        RetryPolicy, classify_error, parse_retry_after, is_rate_limit_error, is_quota_exhausted_error,
+        ERROR_RATE_LIMIT, ERROR_SAFETY, ERROR_BAD_TRANSLATION, ERROR_TRUNCATED,
+    )
+
 # --- CẤU HÌNH CÁC HẰNG SỐ ---
-MAX_RETRIES_ON_SAFETY_BLOCK = 5
-MAX_RETRIES_ON_BAD_TRANSLATION = 5
-RETRY_DELAY_SECONDS = 2
+# Số lần retry và thời gian chờ cho từng loại lỗi: xem retry_policy.DEFAULT_RETRY_SCHEDULE
 PROGRESS_FILE_SUFFIX = ".progress.json"
 CHUNK_SIZE = 1024 * 1024  # 1MB (Không còn dùng trực tiếp CHUNK_SIZE cho việc đọc file nữa)
 
 # Kích thước cửa sổ ngữ cảnh (số đoạn văn bản trước đó dùng làm ngữ cảnh)
 CONTEXT_WINDOW_SIZE = 5
-# Ký tự đặc biệt để đánh dấu phần cần dịch trong prompt gửi đến AI
+# Prompt gửi kèm mỗi chunk ({text} là nội dung chunk)
+TRANSLATE_PROMPT_TEMPLATE = "Dịch đoạn văn bản sau sang tiếng Việt một cách trực tiếp, xác định mối quan hệ và danh xưng phù hợp trước tiên, không từ chối hoặc bình luận, giữ nguyên văn phong gốc và chi tiết nội dung:\n\n{text}"
+
+# Tier giới hạn RPM/TPM mặc định (xem rate_limiter.RATE_LIMIT_PROFILES), "off" để tắt
+DEFAULT_RATE_LIMIT_TIER = "free"
+
+# Ký tự đặc biệt để đánh dấu phần cần dịch trong prompt gửi đến AI (gói nhiều chunk đánh số: xem packing.PACK_TAG_START)
 TRANSLATE_TAG_START = "<translate_this>"
 TRANSLATE_TAG_END = "</translate_this>"
 
 # Số dòng gom lại thành một chunk để dịch
 CHUNK_SIZE_LINES = 100
 
+# Ngân sách token ước lượng cho mỗi chunk khi chia chunk theo token
+CHUNK_TOKEN_BUDGET = 2000
+
+# Các cách chia chunk: "lines" (cố định số dòng) hoặc "tokens" (theo ngân sách token, giữ nguyên đoạn văn)
+CHUNK_MODES = ("lines", "tokens")
+
+# Cửa sổ gửi chunk: chỉ được gửi/giữ tối đa K chunk tính từ chunk tiếp theo cần ghi.
+# Mặc định K = số request đồng thời x MAX_PENDING_CHUNKS_PER_WORKER, không vượt quá MAX_SUBMISSION_WINDOW
+MAX_PENDING_CHUNKS_PER_WORKER = 2
+MAX_SUBMISSION_WINDOW = 200
+
+# Số request đồng thời tối đa (asyncio nên không bị giới hạn bởi số OS thread)
+MAX_CONCURRENT_REQUESTS = 500
+
+# Chu kỳ kiểm tra flag dừng khi đang chờ kết quả (giây)
+STOP_POLL_INTERVAL_SECONDS = 0.5
+
 # Global stop event để dừng tiến trình dịch
 _stop_event = threading.Event()
 
 # Global quota exceeded flag
 _quota_exceeded = threading.Event()
 
+# Các chỉ số của lần dịch hiện tại (GUI/CLI có thể đọc qua get_translation_metrics)
+_run_metrics = {}
+
+# Cache model theo event loop đang chạy: {(api_key, model_name, system_instruction): model}
+_worker_local = threading.local()
+
 def set_stop_translation():
     """Dừng tiến trình dịch"""
     global _stop_event
@@ -56,9 +218,11 @@ def is_translation_stopped():
     global _stop_event
     return _stop_event.is_set()
 
-def set_quota_exceeded():
-    """Đánh dấu API đã hết quota"""
+def set_quota_exceeded(quota_status=None):
+    """Đánh dấu API đã hết quota; quota_status (ApiKeyPool.quota_status()) cho biết khi nào có key dùng lại được"""
     global _quota_exceeded, _stop_event
+    if quota_status is not None:
+        _run_metrics['quota'] = quota_status
     _quota_exceeded.set()
     _stop_event.set()  # Cũng dừng dịch
     print("API đã hết quota - dừng tiến trình dịch")
@@ -68,19 +232,17 @@ def is_quota_exceeded():
     global _quota_exceeded
     return _quota_exceeded.is_set()
 
+def get_quota_status():
+    """Tình trạng quota của pool API key lúc dịch dừng vì hết quota (None nếu chưa có)"""
+    return _run_metrics.get('quota')
+
+def get_translation_metrics():
+    """Trả về bản sao các chỉ số của lần dịch hiện tại (ví dụ: concurrency_limit)"""
+    return dict(_run_metrics)
+
 def check_quota_error(error_message):
-    """Kiểm tra xem có phải lỗi quota exceeded không"""
-    error_str = str(error_message).lower()
-    quota_keywords = [
-        "429",
-        "exceeded your current quota",
-        "quota exceeded", 
-        "rate limit",
-        "billing",
-        "please check your plan"
-    ]
-    
-    return any(keyword in error_str for keyword in quota_keywords)
+    """Kiểm tra xem có phải lỗi quota exceeded / rate limit không"""
+    return is_rate_limit_error(error_message)
 
 def get_optimal_threads():
     """
@@ -113,8 +275,8 @@ def validate_threads(num_threads):
         num_threads = int(num_threads)
         if num_threads < 1:
             return 1
-        elif num_threads > 50:  # Giới hạn tối đa để tránh rate limiting
-            return 50
+        elif num_threads > MAX_CONCURRENT_REQUESTS:  # Giới hạn tối đa để tránh rate limiting
+            return MAX_CONCURRENT_REQUESTS
         return num_threads
     except (ValueError, TypeError):
         return get_optimal_threads()
@@ -133,9 +295,46 @@ def validate_chunk_size(chunk_size):
     except (ValueError, TypeError):
         return 100  # Default
 
+def validate_token_budget(token_budget):
+    """
+    Validate ngân sách token mỗi chunk để đảm bảo trong khoảng hợp lý.
+    """
+    try:
+        token_budget = int(token_budget)
+        if token_budget < 200:
+            return 200
+        elif token_budget > 8000:  # Tránh bản dịch bị cắt do vượt giới hạn output
+            return 8000
+        return token_budget
+    except (ValueError, TypeError):
+        return CHUNK_TOKEN_BUDGET
+
 # Default values
 NUM_WORKERS = get_optimal_threads()  # Tự động tính theo máy
 
+# Các từ khóa chỉ báo bản dịch không đạt yêu cầu
+# Các từ khóa này thường xuất hiện khi AI từ chối dịch
+BAD_TRANSLATION_KEYWORDS = [
+    "tôi không thể dịch",
+    "không thể dịch",
+    "xin lỗi, tôi không",
+    "tôi xin lỗi",
+    "nội dung bị chặn", # Thêm kiểm tra thông báo chặn cũng là bản dịch xấu cần retry
+    "as an ai", # Từ chối bằng tiếng Anh
+    "as a language model",
+    "i am unable",
+    "i cannot",
+    "i'm sorry"
+]
+
+def contains_refusal(text):
+    """Văn bản có chứa câu từ chối của AI (dùng cả khi mới nhận được phần đầu của response dạng stream)"""
+    text_lower = text.lower()
+    for keyword in BAD_TRANSLATION_KEYWORDS:
+        if keyword in text_lower:
+            return True
+    return False
+
 def is_bad_translation(text):
     """
     Kiểm tra xem bản dịch của chunk có đạt yêu cầu không (kiểm tra đơn giản dựa vào độ rỗng và từ chối).
@@ -145,97 +344,142 @@ def is_bad_translation(text):
         # Chunk dịch ra rỗng hoặc chỉ trắng => coi là bad translation
         return True
 
-    # Các từ khóa chỉ báo bản dịch không đạt yêu cầu
-    # Các từ khóa này thường xuất hiện khi AI từ chối dịch
-    bad_keywords = [
-        "tôi không thể dịch",
-        "không thể dịch",
-        "xin lỗi, tôi không",
-        "tôi xin lỗi",
-        "nội dung bị chặn", # Thêm kiểm tra thông báo chặn cũng là bản dịch xấu cần retry
-        "as an ai", # Từ chối bằng tiếng Anh
-        "as a language model",
-        "i am unable",
-        "i cannot",
-        "i'm sorry"
-    ]
+    return contains_refusal(text)
 
-    text_lower = text.lower()
-    for keyword in bad_keywords:
-        if keyword in text_lower:
-            return True
+def build_translation_prompt(chunk_lines, instruction_cached=False, glossary_block=""):
+    """
+    Tạo prompt dịch cho một chunk.
+    instruction_cached: hướng dẫn dịch đã nằm trong context cache, prompt chỉ gồm nội dung chunk.
+    glossary_block: khối thuật ngữ có trong chunk (Glossary.prompt_block), đặt ở đầu prompt.
+    """
+    if instruction_cached:
+        prompt = "\n".join(chunk_lines)
+    else:
+        prompt = TRANSLATE_PROMPT_TEMPLATE.format(text="\n".join(chunk_lines))
+    if glossary_block:
+        prompt = f"{glossary_block}\n\n{prompt}"
+    return prompt
 
-    return False
+def build_cached_instruction(system_instruction):
+    """Phần prompt dùng chung cho mọi chunk (system instruction + hướng dẫn dịch) để đưa vào context cache"""
+    prompt_instruction = TRANSLATE_PROMPT_TEMPLATE.split("{text}")[0].strip()
+    return f"{system_instruction}\n\n{prompt_instruction}"
 
-def translate_chunk(model, chunk_lines):
+async def translate_chunk_async(model, chunk_lines, usage=None, instruction_cached=False, glossary_block="", structured=False, stream_stats=None, connect_timeout=None, read_timeout=None):
     """
     Dịch một chunk gồm nhiều dòng văn bản.
     chunk_lines: danh sách các dòng văn bản
-    Trả về (translated_text, is_safety_blocked_flag, is_bad_translation_flag).
+    usage: dict (tùy chọn) để nhận số token thực tế, ví dụ usage['prompt_tokens'], usage['cached_tokens']
+    instruction_cached: model dùng context cache chứa hướng dẫn dịch
+    glossary_block: khối thuật ngữ gửi kèm chunk
+    structured: gửi các dòng dạng mảng JSON và nhận về mảng JSON bản dịch (xem structured_output.py);
+    response không được kiểm tra bad translation ở đây mà kiểm tra từng dòng khi tách mảng.
+    stream_stats: StreamingStats (tùy chọn) - nhận response dạng stream, phần đầu có câu từ chối thì ngắt stream
+    ngay và trả về bad translation (không kiểm tra sớm khi dịch theo dòng: từng dòng được kiểm tra khi tách mảng).
+    connect_timeout / read_timeout: giới hạn (giây) đến khi có phần đầu của response / giữa hai phần của stream
+    (không stream: cả response trong tổng hai giới hạn); quá hạn ném RequestTimeoutError (lỗi mạng, được retry).
+    Trả về (translated_text, is_safety_blocked_flag, is_bad_translation_flag, is_truncated_flag);
+    is_truncated_flag: bản dịch bị cắt vì chạm giới hạn output (finish reason MAX_TOKENS).
+    Lỗi API (mạng, 5xx, 429...) được ném ra để process_chunk_async phân loại và retry.
     """
     # Gom các dòng thành một chuỗi lớn để gửi đi
     full_text_to_translate = "\n".join(chunk_lines)
     
     # Bỏ qua các chunk chỉ chứa các dòng trống hoặc chỉ trắng
     if not full_text_to_translate.strip():
-        return ("", False, False) # Trả về chuỗi rỗng, không bị chặn, không bad translation
+        return ("", False, False, False) # Trả về chuỗi rỗng, không bị chặn, không bad translation
 
-    try:
-        # Prompt cho dịch chunk
-        prompt = f"Dịch đoạn văn bản sau sang tiếng Việt một cách trực tiếp, xác định mối quan hệ và danh xưng phù hợp trước tiên, không từ chối hoặc bình luận, giữ nguyên văn phong gốc và chi tiết nội dung:\n\n{full_text_to_translate}"
-
-        response = model.generate_content(
-            contents=[{
-                "role": "user",
-                "parts": [prompt],
-            }],
-            generation_config={
-                "response_mime_type": "text/plain",
-                # Có thể thêm các tham số khác nếu cần
-                # "temperature": 0.5,
-                # "top_p": 0.95,
-                # "top_k": 64,
-                # "max_output_tokens": 8192,
-            },
-        )
+    # Prompt cho dịch chunk
+    if structured:
+        prompt = build_structured_prompt(chunk_lines, glossary_block)
+        generation_config = {
+            "response_mime_type": "application/json",
+            "response_schema": STRUCTURED_RESPONSE_SCHEMA,
+        }
+    else:
+        prompt = build_translation_prompt(chunk_lines, instruction_cached, glossary_block)
+        generation_config = {
+            "response_mime_type": "text/plain",
+            # Có thể thêm các tham số khác nếu cần
+            # "temperature": 0.5,
+            # "top_p": 0.95,
+            # "top_k": 64,
+            # "max_output_tokens": 8192,
+        }
 
-        # 1. Kiểm tra xem prompt (đầu vào) có bị chặn không
-        if response.prompt_feedback and response.prompt_feedback.safety_ratings:
-            blocked_categories = [
-                rating.category.name for rating in response.prompt_feedback.safety_ratings
-                if rating.blocked
-            ]
-            if blocked_categories:
-                return (f"[NỘI DUNG GỐC BỊ CHẶN BỞI BỘ LỌC AN TOÀN - PROMPT: {', '.join(blocked_categories)}]", True, False)
-
-        # 2. Kiểm tra xem có bất kỳ ứng cử viên nào được tạo ra không
-        if not response.candidates:
-            return ("[NỘI DỊCH BỊ CHẶN HOÀN TOÀN BỞI BỘ LỌC AN TOÀN - KHÔNG CÓ ỨNG CỬ VIÊN]", True, False)
-
-        # 3. Kiểm tra lý do kết thúc của ứng cử viên đầu tiên (nếu có)
-        first_candidate = response.candidates[0]
-        if first_candidate.finish_reason == 'SAFETY':
-            blocked_categories = [
-                rating.category.name for rating in first_candidate.safety_ratings
-                if rating.blocked
-            ]
-            return (f"[NỘI DỊCH BỊ CHẶN BỞI BỘ LỌC AN TOÀN - OUTPUT: {', '.join(blocked_categories)}]", True, False)
-
-        # Nếu không bị chặn, trả về văn bản dịch
-        translated_text = response.text
-        is_bad = is_bad_translation(translated_text)
-        return (translated_text, False, is_bad)
+    contents = [{
+        "role": "user",
+        "parts": [prompt],
+    }]
+    # Timeout của cả request cũng được gửi cho SDK để đóng kết nối ở tầng transport
+    request_kwargs = {}
+    total_timeout = None
+    if connect_timeout is not None and read_timeout is not None:
+        total_timeout = connect_timeout + read_timeout
+        request_kwargs["request_options"] = {"timeout": total_timeout}
+    if stream_stats is not None:
+        request_start = time.monotonic()
+        try:
+            response_stream = await with_timeout(model.generate_content_async(contents=contents, generation_config=generation_config, stream=True, **request_kwargs), connect_timeout, "chờ phần đầu của response")
+        except Exception as e:
+            # SDK báo prompt bị chặn bằng exception ngay khi mở stream (thay vì prompt_feedback)
+            if type(e).__name__ == 'BlockedPromptException':
+                return (f"[NỘI DUNG GỐC BỊ CHẶN BỞI BỘ LỌC AN TOÀN - PROMPT: {e}]", True, False, False)
+            raise
+        response = await read_stream(response_stream, None if structured else contains_refusal, request_start, read_timeout=read_timeout)
+        stream_stats.record(response, full_text_to_translate)
+        if response.aborted:
+            # AI từ chối ngay từ đầu: không đọc phần còn lại, thử lại như bad translation
+            return (response.text, False, True, False)
+    else:
+        response = await with_timeout(model.generate_content_async(
+            contents=contents,
+            generation_config=generation_config,
+            **request_kwargs,
+        ), total_timeout, "chờ response")
 
-    except Exception as e:
-        # Bắt các lỗi khác (ví dụ: lỗi mạng, lỗi API)
-        error_message = str(e)
-        
-        # Kiểm tra lỗi quota exceeded
-        if check_quota_error(error_message):
-            set_quota_exceeded()
-            return (f"[API HẾT QUOTA]", False, True)
-        
-        return (f"[LỖI API KHI DỊCH CHUNK: {e}]", False, True)
+    # Số token thực tế (SDK cũ hoặc backend giả lập có thể không có usage_metadata)
+    usage_metadata = getattr(response, 'usage_metadata', None)
+    if usage is not None and usage_metadata is not None:
+        usage['prompt_tokens'] = getattr(usage_metadata, 'prompt_token_count', None)
+        usage['cached_tokens'] = getattr(usage_metadata, 'cached_content_token_count', None)
+
+    # 1. Kiểm tra xem prompt (đầu vào) có bị chặn không
+    if response.prompt_feedback and response.prompt_feedback.safety_ratings:
+        blocked_categories = [
+            rating.category.name for rating in response.prompt_feedback.safety_ratings
+            if rating.blocked
+        ]
+        if blocked_categories:
+            return (f"[NỘI DUNG GỐC BỊ CHẶN BỞI BỘ LỌC AN TOÀN - PROMPT: {', '.join(blocked_categories)}]", True, False, False)
+
+    # 2. Kiểm tra xem có bất kỳ ứng cử viên nào được tạo ra không
+    if not response.candidates:
+        return ("[NỘI DỊCH BỊ CHẶN HOÀN TOÀN BỞI BỘ LỌC AN TOÀN - KHÔNG CÓ ỨNG CỬ VIÊN]", True, False, False)
+
+    # 3. Kiểm tra lý do kết thúc của ứng cử viên đầu tiên (nếu có)
+    first_candidate = response.candidates[0]
+    # SDK trả về enum FinishReason, backend giả lập trả về chuỗi
+    finish_reason = getattr(first_candidate.finish_reason, 'name', first_candidate.finish_reason)
+    if finish_reason == 'SAFETY':
+        blocked_categories = [
+            rating.category.name for rating in first_candidate.safety_ratings
+            if rating.blocked
+        ]
+        return (f"[NỘI DỊCH BỊ CHẶN BỞI BỘ LỌC AN TOÀN - OUTPUT: {', '.join(blocked_categories)}]", True, False, False)
+
+    # Nếu không bị chặn, trả về văn bản dịch
+    try:
+        translated_text = response.text
+    except ValueError:
+        # Ứng cử viên không có phần văn bản nào (ví dụ bị cắt trước khi sinh ra chữ)
+        translated_text = ""
+    if finish_reason == 'MAX_TOKENS':
+        return (translated_text, False, False, True)
+    if structured:
+        return (translated_text, False, False, False)
+    is_bad = is_bad_translation(translated_text)
+    return (translated_text, False, is_bad, False)
 
 def get_progress(progress_file_path):
     """Đọc tiến độ dịch từ file (số chunk đã hoàn thành)."""
@@ -250,99 +494,436 @@ def get_progress(progress_file_path):
             return 0
     return 0
 
-def save_progress(progress_file_path, completed_chunks):
-    """Lưu tiến độ dịch (số chunk đã hoàn thành) vào file."""
-    try:
-        with open(progress_file_path, 'w', encoding='utf-8') as f:
-            json.dump({
-                'completed_chunks': completed_chunks
-            }, f)
-    except Exception as e:
-        print(f"⚠️ Lỗi khi lưu file tiến độ: {e}")
+def import_legacy_progress(journal, progress_file_path, output_file):
+    """
+    Chuyển tiến độ kiểu cũ (file .progress.json chỉ lưu số chunk liên tiếp đã ghi vào output) sang nhật ký:
+    nội dung output hiện có được ghi thành bản ghi của chunk 0, các chunk còn lại trong phần đó là bản ghi rỗng.
+    """
+    completed_chunks = get_progress(progress_file_path)
+    if completed_chunks <= 0 or not os.path.exists(output_file):
+        return
+    with open(output_file, 'r', encoding='utf-8') as f:
+        journal.append(0, None, f.read(), 0)
+    for chunk_index in range(1, completed_chunks):
+        journal.append(chunk_index, None, None, 0)
+    journal.sync()
+    os.remove(progress_file_path)
+    print(f"🔄 Đã chuyển tiến độ cũ ({completed_chunks} chunks) sang nhật ký {os.path.basename(journal.path)}")
+
+def get_chunking_signature(chunk_mode="lines", chunk_size=None, filter_junk=False, junk_filter_mode="mask", detect_repeated_junk=False, incremental=False, junk_patterns_file=None):
+    """
+    Cách chia chunk mà translate_file_async sẽ dùng với các tham số này (ghi ở đầu nhật ký).
+    Lọc rác theo file pattern: hash nội dung file là một phần của cách chia (sửa file thì các dòng bị lọc thay đổi).
+    """
+    if chunk_mode not in CHUNK_MODES:
+        chunk_mode = "lines"
+    if chunk_mode == "tokens":
+        chunk_size = CHUNK_TOKEN_BUDGET if chunk_size is None else validate_token_budget(chunk_size)
+    else:
+        chunk_size = CHUNK_SIZE_LINES if chunk_size is None else validate_chunk_size(chunk_size)
+    junk_filter = None
+    if filter_junk or detect_repeated_junk:
+        junk_filter = f"{junk_filter_mode if filter_junk else ''}{'+repeat' if detect_repeated_junk else ''}"
+        patterns_fingerprint = junk_patterns_fingerprint(junk_patterns_file)
+        if patterns_fingerprint:
+            junk_filter += f"@{patterns_fingerprint}"
+    return chunking_signature(chunk_mode, chunk_size, junk_filter, incremental)
 
-def process_chunk(api_key, model_name, system_instruction, chunk_data, log_callback=None):
+def get_completed_chunk_count(input_file, signature=None):
+    """
+    Số chunk đã dịch xong của file input (nhật ký hoặc file tiến độ kiểu cũ), 0 nếu chưa dịch.
+    signature: cách chia chunk của lần dịch sắp tới (get_chunking_signature) - nhật ký theo cách chia khác không được tính.
+    """
+    journal_chunks = count_journal_chunks(input_file, signature)
+    if journal_chunks:
+        return journal_chunks
+    return get_progress(f"{input_file}{PROGRESS_FILE_SUFFIX}")
+
+# Phiên bản google-generativeai tối thiểu có context cache (CacheService, GenerativeModel.cached_content) và
+# generate_content_async(stream=True, request_options=...)
+MIN_GENAI_VERSION = "0.7.0"
+
+_sdk_support_error = None
+
+def check_sdk_support():
+    """
+    Kiểm tra google-generativeai đang cài có đủ các API mà engine dùng; trả về thông báo lỗi, None nếu đủ.
+    SDK chưa có cách công khai để mỗi GenerativeModel dùng một API key riêng (chỉ có genai.configure() global),
+    nên create_model gắn client và context cache qua các thuộc tính _client/_async_client/_cached_content:
+    kiểm tra trước các thuộc tính này để phiên bản SDK thay đổi chúng báo lỗi rõ ràng thay vì lỗi ở từng chunk.
+    """
+    global _sdk_support_error
+    if _sdk_support_error is None:
+        missing = []
+        if not hasattr(glm, 'CacheServiceAsyncClient'):
+            missing.append("generativelanguage.CacheServiceAsyncClient")
+        if not hasattr(genai.GenerativeModel, 'cached_content'):
+            missing.append("GenerativeModel.cached_content")
+        if 'request_options' not in inspect.signature(genai.GenerativeModel.generate_content_async).parameters:
+            missing.append("generate_content_async(request_options=...)")
+        probe = genai.GenerativeModel(model_name="gemini-2.0-flash")
+        missing.extend(f"GenerativeModel.{name}" for name in ('_client', '_async_client') if not hasattr(probe, name))
+        _sdk_support_error = ""
+        if missing:
+            _sdk_support_error = (
+                f"google-generativeai {getattr(genai, '__version__', '?')} không hỗ trợ: {', '.join(missing)}. "
+                f"Cần google-generativeai>={MIN_GENAI_VERSION},<0.9 (pip install -r requirements.txt)."
+            )
+    return _sdk_support_error or None
+
+def create_model(api_key, model_name, system_instruction, cached_content=None):
+    """
+    Tạo GenerativeModel với client riêng cho api_key.
+    Không dùng genai.configure() vì hàm này thay đổi trạng thái global của cả process (xem check_sdk_support).
+    cached_content: tên context cache (system instruction nằm trong cache, không gửi kèm request)
+    """
+    if is_local_model(model_name):
+        return LocalGenerativeModel(model_name=model_name, system_instruction=system_instruction, cached_content=cached_content)
+    sdk_error = check_sdk_support()
+    if sdk_error:
+        raise RuntimeError(sdk_error)
+    
+    model = genai.GenerativeModel(
+        model_name=model_name,
+        system_instruction=system_instruction,
+    )
+    if cached_content:
+        # Tương đương GenerativeModel.from_cached_content() nhưng không cần genai.configure()
+        model._cached_content = cached_content
+    # Client gắn với API key này, giữ kết nối để tái sử dụng cho các chunk sau
+    model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+    model._async_client = glm.GenerativeServiceAsyncClient(client_options={"api_key": api_key})
+    return model
+
+def get_cached_model(api_key, model_name, system_instruction, cached_content=None):
+    """
+    Lấy model đã tạo sẵn cho event loop hiện tại, chỉ tạo mới ở lần gọi đầu tiên.
+    Client async gắn với event loop nên mỗi lần chạy (asyncio.run) sẽ có cache riêng.
+    """
+    loop = asyncio.get_running_loop()
+    models = getattr(_worker_local, 'models', None)
+    if models is None or getattr(_worker_local, 'loop', None) is not loop:
+        models = _worker_local.models = {}
+        _worker_local.loop = loop
+    
+    cache_key = (api_key, model_name, system_instruction, cached_content)
+    model = models.get(cache_key)
+    if model is None:
+        model = create_model(api_key, model_name, system_instruction, cached_content)
+        models[cache_key] = model
+    return model
+
+async def sleep_unless_stopped(delay_seconds):
+    """Ngủ không chặn event loop, thoát sớm nếu có yêu cầu dừng."""
+    deadline = time.monotonic() + delay_seconds
+    while not is_translation_stopped():
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        await asyncio.sleep(min(remaining, STOP_POLL_INTERVAL_SECONDS))
+
+def retry_budget_fallback(chunk_index, chunk_lines, aligned=None):
+    """
+    Hết ngân sách retry: giữ văn bản gốc kèm dấu đánh dấu (dịch theo dòng: giữ các dòng đã dịch đạt).
+    Gói nhiều chunk (chunk_index < 0) trả về None để từng chunk trong gói được dịch riêng.
+    """
+    if chunk_index < 0:
+        return (chunk_index, None, len(chunk_lines))
+    if aligned is not None:
+        return (chunk_index, aligned.assemble(RETRY_BUDGET_MARKER), len(chunk_lines))
+    return (chunk_index, mark_untranslated(chunk_lines), len(chunk_lines))
+
+async def process_chunk_async(key_pool, model_name, system_instruction, chunk_data, concurrency, retry_policy=None, translation_cache=None, context_cache=None, glossary=None, packer=None, passthrough_stats=None, dedup=None, structured_stats=None, bisection=None, retry_budget=None, stream_stats=None, watchdog=None, bisect_depth=0, log_callback=None):
     """
     Xử lý dịch một chunk với retry logic.
+    key_pool: ApiKeyPool chọn API key cho mỗi lần gọi (kèm rate limiter RPM/TPM của key đó)
     chunk_data: tuple (chunk_index, chunk_lines, chunk_start_line_index)
-    Trả về: (chunk_index, translated_text, lines_count)
+    concurrency: ConcurrencyController giới hạn số request đồng thời, mỗi lần gọi API giữ một slot;
+    slot và lượt rate limiter được cấp theo chunk_index (chunk gần chỗ ghi tiếp theo và lần thử lại của nó được
+    ưu tiên hơn chunk ở xa; gói nhiều chunk mang chunk_index -1 nên được ưu tiên nhất)
+    retry_policy: RetryPolicy quyết định số lần retry và thời gian chờ cho từng loại lỗi
+    translation_cache: TranslationCache (tùy chọn) - dùng lại bản dịch cũ của cùng nội dung, lưu bản dịch tốt
+    context_cache: ContextCacheManager (tùy chọn) - request chỉ gửi nội dung chunk, hướng dẫn dịch nằm trong cache
+    glossary: Glossary (tùy chọn) - gửi kèm các thuật ngữ xuất hiện trong chunk
+    packer: ChunkPacker (tùy chọn) - chunk nhỏ được gộp với các chunk nhỏ khác vào một request,
+    gộp không thành công thì dịch riêng như bình thường
+    passthrough_stats: PassthroughStats (tùy chọn) - bật giữ nguyên các dòng không cần dịch, chỉ gửi các đoạn cần dịch
+    dedup: BookDeduplicator (tùy chọn) - dòng lặp lại nhiều lần trong sách được dịch riêng một lần rồi dùng lại
+    structured_stats: StructuredOutputStats (tùy chọn) - bật dịch theo dòng: response là mảng JSON khớp từng dòng,
+    dòng đạt được nhận ngay, lần thử lại chỉ gửi các dòng bị lỗi
+    bisection: BisectionStats (tùy chọn) - chunk bị chặn (safety) hoặc bị cắt (MAX_TOKENS) được chia đôi đệ quy
+    đến khi cô lập được dòng gây lỗi; dòng vẫn lỗi sau khi cô lập được giữ nguyên văn bản gốc
+    retry_budget: RetryBudget (tùy chọn) - mỗi lần thử lại/chia đôi phải còn ngân sách retry của cả lần dịch và
+    của chunk; hết ngân sách thì giữ văn bản gốc kèm dấu đánh dấu, chunk được ghi vào danh sách dịch lại sau
+    stream_stats: StreamingStats (tùy chọn) - nhận response dạng stream, ngắt sớm khi phần đầu là câu từ chối
+    watchdog: ChunkWatchdog (tùy chọn) - timeout kết nối/đọc của mỗi request, request của chunk được theo dõi
+    để hủy và gửi lại chunk khi treo quá hạn
+    bisect_depth: độ sâu chia đôi (0 là chunk gốc)
+    Trả về: (chunk_index, translated_text, lines_count); translated_text là None nếu chunk bị bỏ dở
+    (người dùng dừng, mọi API key hết quota hoặc vẫn bị rate limit sau cả lịch retry) - chunk này chưa được tính là xong.
+    Gói nhiều chunk (chunk_index < 0) bị chặn hoặc bị cắt cũng trả về None ngay lần đầu để packer dịch riêng từng chunk.
+    Lỗi 429 khi còn key rảnh thì chuyển ngay sang key khác; khi mọi key đang nghỉ thì chờ theo lịch retry của rate limit.
     """
     chunk_index, chunk_lines, chunk_start_line_index = chunk_data
+    if retry_policy is None:
+        retry_policy = RetryPolicy()
     
-    # Kiểm tra flag dừng và quota exceeded trước khi bắt đầu
-    if is_translation_stopped() or is_quota_exceeded():
-        if is_quota_exceeded():
-            return (chunk_index, f"[CHUNK {chunk_index} - API HẾT QUOTA]", len(chunk_lines))
+    # Chunk chỉ có dòng trống: không cần gọi API (và không tốn lượt rate limit)
+    if not "".join(chunk_lines).strip():
+        return (chunk_index, "", len(chunk_lines))
+    
+    # Dòng không cần dịch (dòng phân cách, số trang, URL, tiếng Việt...): giữ nguyên tại chỗ;
+    # dòng lặp lại nhiều lần trong sách: dịch một lần, dùng lại ở mọi chỗ
+    if passthrough_stats is not None or dedup is not None:
+        if passthrough_stats is not None:
+            spans = split_passthrough_spans(chunk_lines)
         else:
-            return (chunk_index, f"[CHUNK {chunk_index} BỊ DỪNG BỞI NGƯỜI DÙNG]", len(chunk_lines))
+            spans = [(SPAN_TRANSLATE, list(chunk_lines))]
+        # Chỉ tách chunk thành nhiều đoạn gửi riêng khi cả chunk đủ nhỏ để các đoạn được gộp lại vào một request
+        split_spans = packer is not None and packer.accepts(estimate_tokens("".join(chunk_lines)))
+        if dedup is not None:
+            spans = dedup.isolate_repeated_lines(spans, edges_only=not split_spans)
+        if any(kind != SPAN_TRANSLATE for kind, _ in spans):
+            async def translate_span(span_lines):
+                _, span_text, _ = await process_chunk_async(key_pool, model_name, system_instruction, (chunk_index, span_lines, chunk_start_line_index), concurrency, retry_policy, translation_cache, context_cache, glossary, packer, structured_stats=structured_stats, bisection=bisection, retry_budget=retry_budget, stream_stats=stream_stats, watchdog=watchdog)
+                return span_text
+            translated_text = await translate_chunk_spans(spans, translate_span, passthrough_stats, dedup, split_spans=split_spans)
+            return (chunk_index, translated_text, len(chunk_lines))
+        if passthrough_stats is not None:
+            passthrough_stats.record(spans)
     
-    # Cấu hình API cho thread hiện tại
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel(
-        model_name=model_name,
-        system_instruction=system_instruction,
-    )
+    # Thuật ngữ có trong chunk (một phần của prompt nên cũng là một phần của khóa cache)
+    glossary_block = glossary.prompt_block("".join(chunk_lines)) if glossary is not None else ""
     
-    # Thử lại với lỗi bảo mật
-    safety_retries = 0
-    is_safety_blocked = False  # Khởi tạo biến
-    while safety_retries < MAX_RETRIES_ON_SAFETY_BLOCK:
-        # Kiểm tra flag dừng và quota exceeded trong quá trình retry
-        if is_translation_stopped() or is_quota_exceeded():
-            if is_quota_exceeded():
-                return (chunk_index, f"[CHUNK {chunk_index} - API HẾT QUOTA]", len(chunk_lines))
-            else:
-                return (chunk_index, f"[CHUNK {chunk_index} BỊ DỪNG BỞI NGƯỜI DÙNG]", len(chunk_lines))
+    # Tra cache trước khi gọi API
+    cache_key = None
+    if translation_cache is not None:
+        prompt_template = STRUCTURED_PROMPT_TEMPLATE if structured_stats is not None else TRANSLATE_PROMPT_TEMPLATE
+        cache_key = make_cache_key(chunk_lines, model_name, system_instruction, prompt_template + glossary_block)
+        cached_text = translation_cache.get(cache_key)
+        if cached_text is not None:
+            return (chunk_index, cached_text, len(chunk_lines))
+    
+    # Chunk nhỏ: thử dịch chung một request với các chunk nhỏ khác
+    if packer is not None and structured_stats is None:
+        chunk_tokens = estimate_tokens("".join(chunk_lines))
+        if packer.accepts(chunk_tokens):
+            packed_text = await packer.translate(chunk_lines, chunk_tokens)
+            if packed_text is not None and not is_bad_translation(packed_text):
+                if translation_cache is not None:
+                    translation_cache.put(cache_key, packed_text)
+                return (chunk_index, packed_text, len(chunk_lines))
+            if packed_text is not None:
+                packer.reject()
+    
+    if glossary is not None:
+        glossary.record_request(glossary_block)
+    
+    # Dịch theo dòng: mỗi lần thử chỉ gửi các dòng chưa có bản dịch đạt
+    aligned = AlignedChunk(chunk_lines) if structured_stats is not None else None
+    
+    # Số token ước lượng của mỗi request (system instruction + prompt)
+    estimated_tokens = estimate_tokens(system_instruction or "") + estimate_tokens(build_translation_prompt(chunk_lines, glossary_block=glossary_block))
+    
+    # Số lần lỗi theo từng loại: {error_class: count}
+    failures = {}
+    
+    while True:
+        # Kiểm tra flag dừng và quota exceeded trước mỗi lần gửi
+        if is_quota_exceeded():
+            return (chunk_index, None, len(chunk_lines))
+        if is_translation_stopped():
+            return (chunk_index, None, len(chunk_lines))
+        
+        retry_after = None
+        api_key_state = None
+        cache_name = None
+        watch_id = None
+        request_lines = chunk_lines
+        if aligned is not None:
+            request_lines = aligned.pending_lines()
+            estimated_tokens = estimate_tokens(system_instruction or "") + estimate_tokens(build_structured_prompt(request_lines, glossary_block))
+        try:
+            async with concurrency.slot(chunk_index):
+                # Chọn key còn nhiều quota nhất; None nghĩa là mọi key đều đã hết quota
+                api_key_state = await key_pool.acquire(estimated_tokens, chunk_index)
+                if api_key_state is None:
+                    set_quota_exceeded(key_pool.quota_status())
+                    return (chunk_index, None, len(chunk_lines))
+                try:
+                    if context_cache is not None:
+                        cache_name = await context_cache.get(api_key_state.api_key)
+                    if cache_name:
+                        model = get_cached_model(api_key_state.api_key, model_name, None, cache_name)
+                    else:
+                        model = get_cached_model(api_key_state.api_key, model_name, system_instruction)
+                    usage = {}
+                    request_start = time.monotonic()
+                    if aligned is not None:
+                        structured_stats.record_request(aligned)
+                    if bisect_depth:
+                        bisection.record_request(request_lines)
+                    if watchdog is not None and chunk_index >= 0:
+                        # Gói nhiều chunk (chunk_index < 0) chỉ được giới hạn bằng timeout, không có task riêng để gửi lại
+                        watch_id = watchdog.request_started(chunk_index)
+                    translated_text, is_safety_blocked, is_bad, is_truncated = await translate_chunk_async(
+                        model, request_lines, usage, instruction_cached=bool(cache_name), glossary_block=glossary_block, structured=aligned is not None, stream_stats=stream_stats,
+                        connect_timeout=watchdog.connect_timeout if watchdog is not None else None,
+                        read_timeout=watchdog.read_timeout if watchdog is not None else None,
+                    )
+                    concurrency.on_success(time.monotonic() - request_start)
+                    if retry_budget is not None:
+                        # Lần gửi lại sau lỗi, hoặc request của một nửa chunk đang chia đôi, đều là retry
+                        retry_budget.record_call(chunk_index, estimated_tokens, request_lines, is_retry=bool(failures) or bisect_depth > 0)
+                    key_pool.on_success(api_key_state, estimated_tokens, usage.get('prompt_tokens'))
+                    if cache_name:
+                        context_cache.record_usage(usage.get('prompt_tokens'), usage.get('cached_tokens'))
+                finally:
+                    if watch_id is not None:
+                        watchdog.request_finished(watch_id)
+                    key_pool.release(api_key_state)
             
-        # Thử lại với bản dịch xấu  
-        bad_translation_retries = 0
-        while bad_translation_retries < MAX_RETRIES_ON_BAD_TRANSLATION:
-            # Kiểm tra flag dừng và quota exceeded trong quá trình retry
-            if is_translation_stopped() or is_quota_exceeded():
-                if is_quota_exceeded():
-                    return (chunk_index, f"[CHUNK {chunk_index} - API HẾT QUOTA]", len(chunk_lines))
-                else:
-                    return (chunk_index, f"[CHUNK {chunk_index} BỊ DỪNG BỞI NGƯỜI DÙNG]", len(chunk_lines))
-                
-            try:
-                translated_text, is_safety_blocked, is_bad = translate_chunk(model, chunk_lines)
-                
-                # Kiểm tra quota exceeded sau khi dịch
-                if is_quota_exceeded():
-                    return (chunk_index, f"[CHUNK {chunk_index} - API HẾT QUOTA]", len(chunk_lines))
-                
-                if is_safety_blocked:
-                    break # Thoát khỏi vòng lặp bad translation, sẽ retry safety
-                    
+            if aligned is not None and not is_safety_blocked and not is_truncated:
+                # Nhận các dòng đạt, chỉ các dòng còn lỗi (hoặc cả lượt nếu lệch số dòng) phải thử lại
+                is_bad = not aligned.accept(translated_text, is_bad_translation, structured_stats)
                 if not is_bad:
-                    return (chunk_index, translated_text, len(chunk_lines)) # Thành công
-                    
-                # Bản dịch xấu, thử lại
-                bad_translation_retries += 1
-                if bad_translation_retries < MAX_RETRIES_ON_BAD_TRANSLATION:
-                    time.sleep(RETRY_DELAY_SECONDS)
-                else:
-                    # Hết lần thử bad translation, dùng bản dịch cuối
-                    return (chunk_index, translated_text + " [KHÔNG CẢI THIỆN ĐƯỢC]", len(chunk_lines))
-                    
-            except Exception as e:
-                # Kiểm tra quota error
-                if check_quota_error(str(e)):
-                    set_quota_exceeded()
-                    return (chunk_index, f"[CHUNK {chunk_index} - API HẾT QUOTA]", len(chunk_lines))
-                
-                return (chunk_index, f"[LỖI XỬ LÝ CHUNK {chunk_index}: {e}]", len(chunk_lines))
-        
-        # Nếu bị chặn safety, thử lại
-        if is_safety_blocked:
-            safety_retries += 1
-            if safety_retries < MAX_RETRIES_ON_SAFETY_BLOCK:
-                time.sleep(RETRY_DELAY_SECONDS)
-            else:
-                # Hết lần thử safety, trả về thông báo lỗi
+                    translated_text = aligned.assemble()
+            
+            if not is_safety_blocked and not is_bad and not is_truncated:
+                # Thành công: chỉ lưu cache bản dịch tốt (không lưu bản bị chặn/lỗi)
+                if translation_cache is not None:
+                    translation_cache.put(cache_key, translated_text)
                 return (chunk_index, translated_text, len(chunk_lines))
-    
-    # Fallback (không nên đến đây)
-    return (chunk_index, f"[KHÔNG THỂ DỊCH CHUNK {chunk_index}]", len(chunk_lines))
+            if is_safety_blocked:
+                error_class = ERROR_SAFETY
+            elif is_truncated:
+                error_class = ERROR_TRUNCATED
+            else:
+                error_class = ERROR_BAD_TRANSLATION
+            
+        except Exception as e:
+            error_class = classify_error(e)
+            retry_after = parse_retry_after(e)
+            translated_text = f"[LỖI XỬ LÝ CHUNK {chunk_index}: {e}]"
+            if watchdog is not None and isinstance(e, RequestTimeoutError):
+                watchdog.record_timeout()
+            if cache_name and is_cache_missing_error(e):
+                # Context cache hết hạn/bị xóa: lần thử sau tạo cache mới
+                context_cache.invalidate(api_key_state.api_key)
+            if error_class == ERROR_RATE_LIMIT and api_key_state is not None:
+                # Giảm concurrency và cho key này nghỉ; key chỉ bị loại đến khi reset khi server báo hết quota ngày.
+                concurrency.on_rate_limited()
+                key_pool.on_rate_limited(api_key_state, retry_after, quota_exhausted=is_quota_exhausted_error(e))
+                if key_pool.available_count() > 0:
+                    # Còn key rảnh: thử lại ngay với key khác, không tính là một lần lỗi
+                    retry_policy.record_retry(error_class)
+                    continue
+        
+        failures[error_class] = failures.get(error_class, 0) + 1
+        max_attempts = retry_policy.max_attempts(error_class)
+
+        if chunk_index < 0 and error_class in (ERROR_SAFETY, ERROR_TRUNCATED):
+            # Gói nhiều chunk bị chặn/bị cắt: không gửi lại cả gói, trả về ngay để từng chunk được dịch riêng (và chia đôi)
+            return (chunk_index, None, len(chunk_lines))
+
+        if bisection is not None and error_class in (ERROR_SAFETY, ERROR_TRUNCATED):
+            # Chia đôi thay vì gửi lại nguyên chunk (dịch theo dòng: chỉ khi chưa nhận dòng nào)
+            halves = split_in_halves(chunk_lines) if aligned is None or not aligned.results else None
+            if halves is not None:
+                if retry_budget is not None and not retry_budget.allow_retry(chunk_index, chunk_lines, requests=len(halves)):
+                    return retry_budget_fallback(chunk_index, chunk_lines, aligned)
+                if not bisect_depth:
+                    bisection.record_root(chunk_lines, max_attempts - failures[error_class])
+                halves_text = await asyncio.gather(*(
+                    process_chunk_async(key_pool, model_name, system_instruction, (chunk_index, half_lines, chunk_start_line_index), concurrency, retry_policy, translation_cache, context_cache, glossary, structured_stats=structured_stats, bisection=bisection, retry_budget=retry_budget, stream_stats=stream_stats, watchdog=watchdog, bisect_depth=bisect_depth + 1)
+                    for half_lines in halves
+                ))
+                halves_text = [half_text for _, half_text, _ in halves_text]
+                if any(half_text is None for half_text in halves_text):
+                    return (chunk_index, None, len(chunk_lines))
+                return (chunk_index, join_translated_parts(halves, halves_text), len(chunk_lines))
+            if bisect_depth:
+                # Dòng đã được cô lập: lỗi kiểu này thường lặp lại y hệt, không retry đủ lịch
+                max_attempts = min(max_attempts, BISECT_LINE_MAX_ATTEMPTS)
+            if failures[error_class] >= max_attempts:
+                # Dòng vẫn bị chặn/cắt: giữ nguyên văn bản gốc
+                if aligned is not None:
+                    bisection.record_fallback(aligned.pending_source_lines())
+                    return (chunk_index, aligned.assemble(source_fallback=True), len(chunk_lines))
+                bisection.record_fallback(chunk_lines)
+                return (chunk_index, "".join(chunk_lines), len(chunk_lines))
+        
+        if failures[error_class] >= max_attempts:
+            # Hết lượt retry cho loại lỗi này
+            if error_class == ERROR_RATE_LIMIT:
+                # Vẫn bị rate limit sau cả lịch chờ: để lần chạy sau dịch lại thay vì ghi thông báo lỗi vào bản dịch
+                return (chunk_index, None, len(chunk_lines))
+            if aligned is not None:
+                # Giữ các dòng đã dịch đạt, chỉ các dòng còn lại mang thông báo lỗi
+                return (chunk_index, aligned.assemble(translated_text if error_class != ERROR_BAD_TRANSLATION else None), len(chunk_lines))
+            if error_class in (ERROR_BAD_TRANSLATION, ERROR_TRUNCATED):
+                # Dùng bản dịch cuối
+                return (chunk_index, translated_text + " [KHÔNG CẢI THIỆN ĐƯỢC]", len(chunk_lines))
+            # Bị chặn safety hoặc lỗi API: trả về thông báo lỗi
+            return (chunk_index, translated_text, len(chunk_lines))
+        
+        if retry_budget is not None and error_class != ERROR_RATE_LIMIT and not retry_budget.allow_retry(chunk_index, request_lines):
+            # Hết ngân sách retry: không đốt thêm quota cho chunk này, để lần chạy sau dịch lại
+            return retry_budget_fallback(chunk_index, chunk_lines, aligned)
+        
+        delay = retry_policy.compute_delay(error_class, failures[error_class], retry_after)
+        await sleep_unless_stopped(delay)
+
+async def translate_chunk_spans(spans, translate_span, passthrough_stats=None, dedup=None, split_spans=False):
+    """
+    Dịch chunk theo từng đoạn: đoạn giữ nguyên được chèn lại đúng vị trí, chỉ đoạn cần dịch được gửi đi,
+    đoạn dòng lặp lại lấy bản dịch dùng chung (chỉ dịch ở lần gặp đầu tiên).
+    spans: [(SPAN_KEEP / SPAN_TRANSLATE / SPAN_SHARED, lines)]
+    translate_span: coroutine dịch một danh sách dòng, trả về bản dịch hoặc None (bị dừng)
+    split_spans: True thì mỗi đoạn cần dịch là một chunk riêng (dùng khi chunk nhỏ và có packer gộp lại thành một request),
+    False thì gửi liền một khối từ đoạn cần dịch đầu tiên đến cuối cùng (một request) nếu giữa chúng không có dòng lặp lại.
+    Trả về bản dịch của cả chunk, None nếu bị dừng giữa chừng.
+    """
+    translatable_indexes = [index for index, (kind, _) in enumerate(spans) if kind == SPAN_TRANSLATE]
+    if len(translatable_indexes) > 1 and not split_spans:
+        first, last = translatable_indexes[0], translatable_indexes[-1]
+        if not any(kind == SPAN_SHARED for kind, _ in spans[first:last + 1]):
+            merged_lines = [line for _, lines in spans[first:last + 1] for line in lines]
+            spans = spans[:first] + [(SPAN_TRANSLATE, merged_lines)] + spans[last + 1:]
+
+    jobs = []
+    for kind, lines in spans:
+        if kind == SPAN_TRANSLATE:
+            jobs.append(translate_span(lines))
+        elif kind == SPAN_SHARED:
+            # Chỉ dịch dòng lặp lại, các dòng trống theo sau được giữ nguyên
+            jobs.append(dedup.shared_line(lines[0], lambda line=lines[0]: translate_span([line])))
+    translated_spans = await asyncio.gather(*jobs)
+    if any(span_text is None for span_text in translated_spans):
+        return None
+    if passthrough_stats is not None:
+        passthrough_stats.record(spans)
+
+    pieces = []
+    translated_iter = iter(translated_spans)
+    for kind, lines in spans:
+        if kind == SPAN_KEEP:
+            pieces.append("".join(lines))
+            continue
+        span_text = next(translated_iter)
+        pieces.append(span_text if span_text.endswith("\n") else span_text + "\n")
+        if kind == SPAN_SHARED:
+            pieces.append("".join(lines[1:]))
+    return "".join(pieces)
+
+async def process_repeated_chunk_async(dedup, chunk_data, process_chunk):
+    """Chunk lặp lại nhiều lần trong sách: chỉ dịch ở lần đầu (process_chunk(chunk_data)), các lần sau dùng lại bản dịch"""
+    chunk_index, chunk_lines, _ = chunk_data
+    async def translate_once():
+        _, translated_text, _ = await process_chunk(chunk_data)
+        return translated_text
+    translated_text = await dedup.shared_chunk(chunk_lines, translate_once)
+    return (chunk_index, translated_text, len(chunk_lines))
 
 def generate_output_filename(input_filepath):
     """
@@ -363,9 +944,94 @@ def generate_output_filename(input_filepath):
     else:
         return new_name
 
-def translate_file_optimized(input_file, output_file=None, api_key=None, model_name="gemini-2.0-flash", system_instruction=None, num_workers=None, chunk_size_lines=None):
+def translate_file_optimized(input_file, output_file=None, api_key=None, model_name="gemini-2.0-flash", system_instruction=None, num_workers=None, chunk_size_lines=None, chunk_mode="lines", chunk_token_budget=None, adaptive_concurrency=True, rate_limit_tier=DEFAULT_RATE_LIMIT_TIER, submission_window=None, retry_policy=None, use_translation_cache=True, translation_cache_path=TRANSLATION_CACHE_FILE, incremental=False, context_caching=False, context_cache_ttl=CONTEXT_CACHE_TTL_SECONDS, glossary_file=None, pack_small_chunks=False, skip_passthrough_lines=False, deduplicate=False, filter_junk=False, junk_patterns_file=None, junk_filter_mode="mask", detect_repeated_junk=False, structured_output=False, bisect_failed_chunks=True, retry_budget_ratio=RETRY_BUDGET_RATIO, hedge_requests=True, stream_responses=True, request_connect_timeout=REQUEST_CONNECT_TIMEOUT_SECONDS, request_read_timeout=REQUEST_READ_TIMEOUT_SECONDS, hung_chunk_watchdog=True):
     """
-    Phiên bản dịch file với multi-threading chunks.
+    Phiên bản đồng bộ cho GUI và command line: chạy translate_file_async trong một event loop riêng
+    (khi dừng, task/kết nối còn treo chỉ được chờ tối đa STOP_GRACE_SECONDS).
+    """
+    return run_with_stop_grace(translate_file_async(
+        input_file,
+        output_file=output_file,
+        api_key=api_key,
+        model_name=model_name,
+        system_instruction=system_instruction,
+        num_workers=num_workers,
+        chunk_size_lines=chunk_size_lines,
+        chunk_mode=chunk_mode,
+        chunk_token_budget=chunk_token_budget,
+        adaptive_concurrency=adaptive_concurrency,
+        rate_limit_tier=rate_limit_tier,
+        submission_window=submission_window,
+        retry_policy=retry_policy,
+        use_translation_cache=use_translation_cache,
+        translation_cache_path=translation_cache_path,
+        incremental=incremental,
+        context_caching=context_caching,
+        context_cache_ttl=context_cache_ttl,
+        glossary_file=glossary_file,
+        pack_small_chunks=pack_small_chunks,
+        skip_passthrough_lines=skip_passthrough_lines,
+        deduplicate=deduplicate,
+        filter_junk=filter_junk,
+        junk_patterns_file=junk_patterns_file,
+        junk_filter_mode=junk_filter_mode,
+        detect_repeated_junk=detect_repeated_junk,
+        structured_output=structured_output,
+        bisect_failed_chunks=bisect_failed_chunks,
+        retry_budget_ratio=retry_budget_ratio,
+        hedge_requests=hedge_requests,
+        stream_responses=stream_responses,
+        request_connect_timeout=request_connect_timeout,
+        request_read_timeout=request_read_timeout,
+        hung_chunk_watchdog=hung_chunk_watchdog,
+    ))
+
+async def translate_file_async(input_file, output_file=None, api_key=None, model_name="gemini-2.0-flash", system_instruction=None, num_workers=None, chunk_size_lines=None, chunk_mode="lines", chunk_token_budget=None, adaptive_concurrency=True, rate_limit_tier=DEFAULT_RATE_LIMIT_TIER, submission_window=None, retry_policy=None, use_translation_cache=True, translation_cache_path=TRANSLATION_CACHE_FILE, incremental=False, context_caching=False, context_cache_ttl=CONTEXT_CACHE_TTL_SECONDS, glossary_file=None, pack_small_chunks=False, skip_passthrough_lines=False, deduplicate=False, filter_junk=False, junk_patterns_file=None, junk_filter_mode="mask", detect_repeated_junk=False, structured_output=False, bisect_failed_chunks=True, retry_budget_ratio=RETRY_BUDGET_RATIO, hedge_requests=True, stream_responses=True, request_connect_timeout=REQUEST_CONNECT_TIMEOUT_SECONDS, request_read_timeout=REQUEST_READ_TIMEOUT_SECONDS, hung_chunk_watchdog=True):
+    """
+    Dịch file bằng asyncio: một thread duy nhất, nhiều request đồng thời.
+    api_key: một key, list key, hoặc chuỗi nhiều key cách nhau bằng dấu phẩy. Request được chia theo quota
+    còn lại của từng key; key hết quota được cho nghỉ đến khi reset, chỉ dừng khi mọi key đều hết quota.
+    chunk_mode: "lines" chia theo chunk_size_lines dòng, "tokens" chia theo chunk_token_budget token ước lượng.
+    adaptive_concurrency: True thì num_workers chỉ là mức khởi đầu, số request đồng thời tự điều chỉnh (AIMD)
+    theo độ trễ và lỗi 429; False thì cố định num_workers.
+    rate_limit_tier: tier trong bảng giới hạn RPM/TPM ("free", "tier1", ...) hoặc "off" để tắt.
+    submission_window: số chunk tối đa được gửi/chờ ghi tính từ chunk tiếp theo cần ghi (None = tự tính).
+    retry_policy: RetryPolicy, hoặc dict ghi đè lịch retry, ví dụ {"rate_limit": {"max_attempts": 10}}.
+    use_translation_cache: False để bỏ qua cache bản dịch (không đọc, không ghi).
+    translation_cache_path: file SQLite của cache bản dịch.
+    incremental: True để chỉ dịch các chunk bị sửa hoặc mới thêm so với lần dịch xong trước (file .manifest.jsonl),
+    các chunk còn lại lấy bản dịch cũ. Manifest được cập nhật sau mỗi lần dịch xong ở chế độ này.
+    context_caching: True để upload phần prompt dùng chung (system instruction + hướng dẫn dịch) một lần
+    thành context cache của Gemini, gia hạn trước khi hết context_cache_ttl giây.
+    glossary_file: file thuật ngữ (mỗi dòng "nguyên văn = bản dịch", hoặc .json); mỗi request chỉ gửi kèm
+    các thuật ngữ xuất hiện trong chunk đó.
+    pack_small_chunks: True để gộp các chunk nhỏ (dưới nửa chunk_token_budget) vào chung một request,
+    tiết kiệm lượt request khi bị giới hạn RPM.
+    skip_passthrough_lines: True để giữ nguyên các dòng không cần dịch (dòng phân cách, số trang, URL,
+    chỉ có dấu câu, đã là tiếng Việt) thay vì gửi lên API. Mặc định tắt: mọi dòng đều được gửi đi dịch.
+    deduplicate: True để dịch một lần các dòng/chunk lặp lại nhiều lần trong sách (chân chương, watermark...)
+    rồi dùng lại bản dịch ở mọi chỗ xuất hiện.
+    filter_junk: True để xóa watermark/quảng cáo của web truyện trước khi chia chunk (pattern có sẵn
+    + junk_patterns_file, mỗi dòng một regex); junk_filter_mode "mask" chỉ xóa phần khớp, "drop" bỏ cả dòng.
+    detect_repeated_junk: True để xóa thêm các dòng ngắn lặp lại rải rác khắp sách (chân chương của web).
+    Phần bị xóa được ghi vào file báo cáo "<input>.junk_report.txt".
+    structured_output: True để dịch theo dòng: model trả về mảng JSON khớp từng dòng, dòng đạt được nhận ngay,
+    lần thử lại chỉ gửi các dòng bị lỗi (safety/từ chối/rỗng) thay vì cả chunk. Không dùng chung với pack_small_chunks.
+    bisect_failed_chunks: True để chia đôi đệ quy chunk bị chặn (safety) hoặc bị cắt (MAX_TOKENS) thay vì gửi lại
+    nguyên chunk: phần còn lại dịch bình thường, chỉ các dòng vẫn bị chặn được giữ nguyên văn bản gốc.
+    retry_budget_ratio: tổng số lần thử lại tối đa theo tỷ lệ số request đã gửi (None để tắt ngân sách retry);
+    mỗi chunk còn bị giới hạn số lần thử lại và token gửi đi. Chunk hết ngân sách giữ văn bản gốc kèm dấu
+    đánh dấu, nhật ký được giữ lại để lần chạy sau chỉ dịch lại các chunk đó.
+    hedge_requests: True để gửi thêm một bản sao cho chunk đầu hàng chờ ghi khi nó chạy lâu hơn phân vị cao
+    của độ trễ gần đây (tính từ khi request được gửi; nhận bản về trước, hủy bản còn lại), tránh một request chậm
+    giữ chân cả output.
+    stream_responses: True để nhận response dạng stream: phần đầu response có câu từ chối thì ngắt stream và
+    thử lại ngay thay vì chờ cả output của chunk; ghi nhận thời gian đến token đầu tiên.
+    request_connect_timeout / request_read_timeout: giới hạn (giây) đến khi có phần đầu của response / giữa hai phần
+    của stream (None để bỏ); request quá hạn bị hủy và thử lại như lỗi mạng.
+    hung_chunk_watchdog: True để chạy thread watchdog theo dõi tuổi các request đang chạy: chunk có request treo quá hạn
+    bị hủy, gửi lại (tối đa WATCHDOG_MAX_RESCHEDULES lần) và được báo cáo. Khi dừng, các task chưa kết thúc sau
+    STOP_GRACE_SECONDS giây bị bỏ lại để nút dừng không phải chờ kết nối treo.
     """
     # Clear stop flag khi bắt đầu dịch mới
     clear_stop_translation()
@@ -375,12 +1041,25 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
         num_workers = NUM_WORKERS
     else:
         num_workers = validate_threads(num_workers)
+    
+    if submission_window is not None:
+        submission_window = max(1, int(submission_window))
         
     if chunk_size_lines is None:
         chunk_size_lines = CHUNK_SIZE_LINES
     else:
         chunk_size_lines = validate_chunk_size(chunk_size_lines)
     
+    if chunk_mode not in CHUNK_MODES:
+        chunk_mode = "lines"
+    
+    if chunk_token_budget is None:
+        chunk_token_budget = CHUNK_TOKEN_BUDGET
+    else:
+        chunk_token_budget = validate_token_budget(chunk_token_budget)
+    
+    chunk_size = chunk_token_budget if chunk_mode == "tokens" else chunk_size_lines
+    
     # Tự động tạo tên file output nếu không được cung cấp
     if output_file is None:
         output_file = generate_output_filename(input_file)
@@ -388,14 +1067,66 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     
     print(f"Bắt đầu dịch file: {input_file}")
     print(f"File output: {output_file}")
-    print(f"Số worker threads: {num_workers}")
-    print(f"Kích thước chunk: {chunk_size_lines} dòng")
+    
+    # Pool API key: mỗi key có rate limiter RPM/TPM riêng (backend giả lập không cần rate limiter)
+    if is_local_model(model_name):
+        key_pool = ApiKeyPool(api_key, model_name, rate_limit_tier, state_file=None, use_rate_limiter=False)
+    else:
+        key_pool = ApiKeyPool(api_key, model_name, rate_limit_tier)
+    if not key_pool.keys:
+        print("❌ Lỗi: Chưa có API key.")
+        return False
+    if not is_local_model(model_name):
+        sdk_error = check_sdk_support()
+        if sdk_error:
+            print(f"❌ Lỗi: {sdk_error}")
+            return False
+    print(f"🔑 Dùng {len(key_pool.keys)} API key")
+    
+    # Bộ điều khiển số request đồng thời, bắt đầu từ mức ổn định của lần chạy trước (nếu có)
+    initial_concurrency = num_workers
+    if adaptive_concurrency:
+        remembered_level = load_concurrency_level(key_pool.pool_id, model_name)
+        if remembered_level:
+            initial_concurrency = remembered_level
+            print(f"🔁 Dùng mức đồng thời ổn định của lần chạy trước: {remembered_level}")
+    concurrency = ConcurrencyController(
+        initial_concurrency,
+        max_limit=MAX_CONCURRENT_REQUESTS if adaptive_concurrency else num_workers,
+        adaptive=adaptive_concurrency,
+    )
+    _run_metrics.clear()
+    _run_metrics['concurrency_limit'] = concurrency.current_limit
+    
+    # Chính sách retry dùng chung cho mọi chunk
+    if not isinstance(retry_policy, RetryPolicy):
+        retry_policy = RetryPolicy(schedule=retry_policy)
+    print(f"🔁 Retry: {retry_policy.describe()}")
+    
+    # Cache bản dịch theo nội dung: chạy lại sách/bản in mới không phải trả tiền lại cho đoạn đã dịch
+    translation_cache = open_translation_cache(translation_cache_path) if use_translation_cache else None
+    if translation_cache is not None:
+        print(f"🗃️ Cache bản dịch: {translation_cache_path} ({translation_cache.stats()['entries']} bản dịch)")
+    elif not use_translation_cache:
+        print("🗃️ Bỏ qua cache bản dịch")
+    
+    first_limiter = key_pool.keys[0].limiter
+    if first_limiter is not None:
+        print(f"🚦 Giới hạn {rate_limit_tier} mỗi key: {first_limiter.rpm} request/phút, {first_limiter.tpm} token/phút")
+    
+    print(f"Số request đồng thời: {concurrency.current_limit}{' (tự điều chỉnh)' if adaptive_concurrency else ''}")
+    if chunk_mode == "tokens":
+        print(f"Kích thước chunk: ~{chunk_token_budget} token (giữ nguyên đoạn văn)")
+    else:
+        print(f"Kích thước chunk: {chunk_size_lines} dòng")
 
     progress_file_path = f"{input_file}{PROGRESS_FILE_SUFFIX}"
 
-    # Lấy tiến độ từ file - số chunk đã hoàn thành
-    completed_chunks = get_progress(progress_file_path)
-    print(f"Đã hoàn thành {completed_chunks} chunk trước đó.")
+    # Nhật ký hoàn thành: mỗi chunk dịch xong được ghi ngay, kể cả khi chunk đứng trước chưa xong
+    journal = CompletionJournal(get_journal_path(input_file), get_chunking_signature(chunk_mode, chunk_size, filter_junk, junk_filter_mode, detect_repeated_junk, incremental, junk_patterns_file))
+    if not journal.entries:
+        import_legacy_progress(journal, progress_file_path, output_file)
+    print(f"Đã hoàn thành {len(journal.entries) - journal.repair_count()} chunk trước đó.")
 
     # Thời gian bắt đầu để tính hiệu suất
     start_time = time.time()
@@ -406,173 +1137,464 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
     
     print(f"🎯 System instruction: {system_instruction[:100]}...")  # Log first 100 chars
 
+    # Context caching: phần prompt dùng chung chỉ upload một lần cho mỗi API key
+    context_cache = None
+    if context_caching:
+        context_cache = ContextCacheManager(model_name, build_cached_instruction(system_instruction), context_cache_ttl)
+        if context_cache.enabled:
+            print(f"🧊 Context caching: ~{context_cache.cached_tokens_estimate} token prompt dùng chung được cache (TTL {context_cache_ttl}s)")
+        else:
+            print(f"🧊 Context caching: bỏ qua vì prompt dùng chung (~{context_cache.cached_tokens_estimate} token) ngắn hơn mức tối thiểu của model")
+            context_cache = None
+
+    # Glossary: mỗi request chỉ gửi kèm thuật ngữ có trong chunk
+    glossary = load_glossary(glossary_file)
+    if glossary is not None:
+        print(f"📖 Glossary: {len(glossary)} thuật ngữ (~{glossary.full_block_tokens} token nếu gửi cả bảng)")
+
+    # Ngân sách retry: giới hạn số lần thử lại của cả lần dịch và chi phí mỗi chunk
+    retry_budget = RetryBudget(retry_budget_ratio) if retry_budget_ratio else None
+    if retry_budget is not None:
+        print(f"💸 Ngân sách retry: tối đa {retry_budget_ratio:.0%} số request (ít nhất {retry_budget.min_retries} lượt), mỗi chunk tối đa {retry_budget.max_retries_per_chunk} lượt / ~{retry_budget.chunk_cost_ceiling:g} lần kích thước chunk")
+
+    # Gộp chunk nhỏ: một request cho nhiều chunk, tách lại bản dịch theo thẻ đánh số
+    packer = None
+    if pack_small_chunks and structured_output:
+        print("📦 Gộp chunk nhỏ: bỏ qua vì đang dịch theo dòng (structured output)")
+    elif pack_small_chunks:
+        async def translate_pack(packed_lines):
+            # Gói được dịch như một chunk (cùng retry/key pool/context cache), không qua cache bản dịch
+            _, translated_text, _ = await process_chunk_async(key_pool, model_name, system_instruction, (-1, packed_lines, 0), concurrency, retry_policy, None, context_cache, glossary, retry_budget=retry_budget, stream_stats=stream_stats, watchdog=watchdog)
+            return translated_text
+        packer = ChunkPacker(translate_pack, token_budget=chunk_token_budget)
+        print(f"📦 Gộp chunk nhỏ: tối đa {packer.max_chunks} chunk / ~{packer.token_budget} token mỗi request")
+
+    # Dòng không cần dịch được giữ nguyên, không gửi lên API
+    passthrough_stats = PassthroughStats() if skip_passthrough_lines else None
+    
+    # Dịch theo dòng: response mảng JSON, chỉ thử lại các dòng lỗi
+    structured_stats = StructuredOutputStats() if structured_output else None
+    if structured_stats is not None:
+        print("🧾 Dịch theo dòng: response dạng mảng JSON, chỉ dịch lại các dòng bị lỗi")
+    
+    # Chunk bị chặn/bị cắt: chia đôi đệ quy để cô lập dòng gây lỗi
+    bisection = BisectionStats() if bisect_failed_chunks else None
+    
+    # Chunk đầu hàng chờ ghi chạy quá lâu: gửi thêm một bản sao
+    hedger = HedgeController() if hedge_requests else None
+    
+    # Response dạng stream: ngắt sớm khi AI từ chối
+    stream_stats = StreamingStats() if stream_responses else None
+    
+    # Timeout mỗi request, watchdog hủy và gửi lại chunk có request treo
+    watchdog = ChunkWatchdog(request_connect_timeout, request_read_timeout)
+    timeout_text = f"kết nối {request_connect_timeout:g}s, đọc {request_read_timeout:g}s" if request_connect_timeout and request_read_timeout else "không giới hạn"
+    print(f"⏱️ Timeout mỗi request: {timeout_text}{f'; watchdog hủy request treo quá {watchdog.deadline:g}s' if hung_chunk_watchdog else ''}")
+
+    # Dịch tăng dần: đối chiếu với manifest của lần dịch xong trước
+    manifest = open_manifest(input_file) if incremental else None
+    reused_chunks = 0
+
+    # File nguồn thực sự được chia chunk (bản đã lọc rác nếu bật lọc rác)
+    source_file = input_file
+    
     try:
-        # Đọc toàn bộ file và chia thành chunks
-        with open(input_file, 'r', encoding='utf-8', errors='replace') as infile:
-            all_lines = infile.readlines()
+        if hung_chunk_watchdog:
+            watchdog.start(asyncio.get_running_loop())
         
-        total_lines = len(all_lines)
-        print(f"Tổng số dòng trong file: {total_lines}")
+        # Lọc rác trước khi chia chunk: chunk/nhật ký/manifest đều dựa trên bản đã lọc
+        if filter_junk or detect_repeated_junk:
+            junk_filter = build_junk_filter(input_file, junk_patterns_file, use_builtin=filter_junk, mode=junk_filter_mode, detect_repeats=detect_repeated_junk)
+            if junk_filter is not None:
+                source_file = filter_source_file(input_file, junk_filter)
+                junk_summary = junk_filter.summary()
+                _run_metrics['junk_filter'] = junk_summary
+                print(f"🧹 Lọc rác: bỏ {junk_summary['removed_lines']} dòng, xóa một phần {junk_summary['masked_lines']} dòng (~{junk_summary['removed_tokens']}/{junk_summary['total_tokens']} token, {junk_summary['removed_ratio']:.1%}), {junk_summary['repeated_lines']} dòng lặp lại khắp sách")
+                print(f"🧹 Báo cáo lọc rác: {get_junk_report_path(input_file)}")
         
-        # Chia thành chunks
-        chunks = []
-        for i in range(0, total_lines, chunk_size_lines):
-            chunk_lines = all_lines[i:i + chunk_size_lines]
-            chunks.append((len(chunks), chunk_lines, i))  # (chunk_index, chunk_lines, start_line_index)
+        # Đếm số dòng theo kiểu streaming, không nạp toàn bộ file vào bộ nhớ
+        total_lines = count_source_lines(source_file)
+        print(f"Tổng số dòng trong file: {total_lines}")
         
-        total_chunks = len(chunks)
+        # Generator đọc chunk lazily: (chunk_index, chunk_lines, start_line_index, reused_offset)
+        if manifest is not None:
+            total_chunks = sum(1 for _ in plan_incremental_chunks(source_file, manifest, chunk_mode, chunk_size))
+            chunks_iter = plan_incremental_chunks(source_file, manifest, chunk_mode, chunk_size)
+            print(f"♻️ Dịch tăng dần: đối chiếu với {manifest.chunk_count} chunk của lần dịch trước")
+        else:
+            total_chunks = count_chunks(source_file, chunk_mode, chunk_size)
+            chunks_iter = (chunk_data + (None,) for chunk_data in iter_chunks(source_file, chunk_mode, chunk_size))
         print(f"Tổng số chunks: {total_chunks}")
         
-        # Kiểm tra nếu đã dịch hết file rồi
-        if completed_chunks >= total_chunks:
-            print(f"✅ File đã được dịch hoàn toàn ({completed_chunks}/{total_chunks} chunks).")
-            if os.path.exists(progress_file_path):
-                os.remove(progress_file_path)
-                print(f"Đã xóa file tiến độ: {os.path.basename(progress_file_path)}")
-            return True
-
-        # Mở file output để ghi kết quả
-        mode = 'a' if completed_chunks > 0 else 'w'  # Append nếu có tiến độ cũ, write nếu bắt đầu mới
-        with open(output_file, mode, encoding='utf-8') as outfile:
-            
-            # Dictionary để lưu trữ kết quả dịch theo thứ tự chunk index
-            translated_chunks_results = {}
-            next_expected_chunk_to_write = completed_chunks
-            total_lines_processed = completed_chunks * chunk_size_lines
+        # Khử trùng lặp: đọc thêm một lượt để tìm dòng/chunk lặp lại trong cả cuốn sách
+        dedup = None
+        if deduplicate:
+            if manifest is not None:
+                dedup_chunks = (chunk[1] for chunk in plan_incremental_chunks(source_file, manifest, chunk_mode, chunk_size))
+            else:
+                dedup_chunks = (chunk[1] for chunk in iter_chunks(source_file, chunk_mode, chunk_size))
+            dedup = build_book_deduplicator(dedup_chunks)
+            if dedup is not None:
+                print(f"🧬 Khử trùng lặp: {len(dedup.repeated_lines)} dòng và {len(dedup.repeated_chunks)} chunk lặp lại chỉ dịch một lần")
+            else:
+                print("🧬 Khử trùng lặp: không có dòng/chunk lặp lại")
+        
+        def process_chunk(chunk_data, use_dedup=True):
+            if retry_budget is not None:
+                retry_budget.open_chunk(chunk_data[0], chunk_data[1])
+            return process_chunk_async(key_pool, model_name, system_instruction, chunk_data, concurrency, retry_policy, translation_cache, context_cache, glossary, packer, passthrough_stats, dedup if use_dedup else None, structured_stats, bisection, retry_budget, stream_stats, watchdog)
+        
+        def submit_chunk(chunk_data, hedge=False):
+            # Task dịch chunk, được watchdog theo dõi (hủy khi có request treo).
+            # Bản sao dự phòng không qua khử trùng lặp: dùng lại bản dịch đang chờ của bản gốc thì không có request thứ hai
+            if hedge:
+                task = asyncio.create_task(process_chunk(chunk_data, use_dedup=False))
+            elif dedup is not None and dedup.is_repeated_chunk(chunk_data[1]):
+                task = asyncio.create_task(process_repeated_chunk_async(dedup, chunk_data, process_chunk))
+            else:
+                task = asyncio.create_task(process_chunk(chunk_data))
+            watchdog.watch_task(chunk_data[0], task)
+            return task
+        
+        # Trạng thái ngân sách retry in lần cuối (chỉ in lại khi thay đổi)
+        last_budget_status = None
+        
+        # Chunk đã xong trong lần chạy này hoặc các lần trước (có trong nhật ký và nội dung gốc không đổi)
+        done_chunks = set()
+        total_lines_processed = 0
+        
+        # Chunk tiếp theo chưa xong: cửa sổ gửi chunk tính từ đây
+        next_expected_chunk_to_write = 0
 
-            with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
-                
-                futures = {} # Lưu trữ các future: {future_object: chunk_index}
+        tasks = {} # Lưu trữ các task: {task_object: chunk_index}
+        
+        # Thời gian đến khi chương đầu được ghi liền mạch, số chunk xong nhưng còn chờ chunk đứng trước.
+        # Ranh giới chương đầu tìm trên cả cuốn sách trước khi gửi (tiêu đề chương thứ hai có thể nằm ngoài cửa sổ gửi)
+        if manifest is not None:
+            heading_chunks = ((chunk[0], chunk[1]) for chunk in plan_incremental_chunks(source_file, manifest, chunk_mode, chunk_size))
+        else:
+            heading_chunks = ((chunk[0], chunk[1]) for chunk in iter_chunks(source_file, chunk_mode, chunk_size))
+        frontier_stats = WriteFrontierStats(find_first_chapter_end(heading_chunks))
+        
+        # Dữ liệu của chunk đang chạy (gửi bản sao / gửi lại khi bị watchdog hủy)
+        chunk_payloads = {}
+        
+        # Request dự phòng: task gốc của chunk đang chạy, {chunk_index: (task gốc, task bản sao)}
+        # (thời gian chạy của chunk tính từ khi request đầu tiên thực sự được gửi: watchdog.sent_at)
+        primary_tasks = {}
+        hedged_chunks = {}
+        all_chunks_submitted = False
+        next_chunk_to_submit = 0
+        
+        if submission_window is not None:
+            print(f"Gửi các chunk chưa dịch (cửa sổ {submission_window} chunks)...")
+        else:
+            print(f"Gửi các chunk chưa dịch...")
+        
+        while True:
+            # Backpressure: chỉ gửi chunk nằm trong cửa sổ tính từ chunk đầu tiên chưa xong
+            if submission_window is not None:
+                window_size = submission_window
+            else:
+                window_size = min(concurrency.current_limit * MAX_PENDING_CHUNKS_PER_WORKER, MAX_SUBMISSION_WINDOW)
+                if packer is not None:
+                    # Mỗi request có thể mang nhiều chunk: cần nhiều chunk chờ hơn để gom đủ gói
+                    window_size = min(window_size * MAX_CHUNKS_PER_PACK, MAX_SUBMISSION_WINDOW)
+            while not all_chunks_submitted and next_chunk_to_submit < next_expected_chunk_to_write + window_size:
+                # Kiểm tra flag dừng trước khi submit
+                if is_translation_stopped():
+                    print("🛑 Dừng gửi chunks mới do người dùng yêu cầu")
+                    all_chunks_submitted = True
+                    break
                 
-                # Gửi các chunks cần dịch đến thread pool
-                chunks_to_process = chunks[completed_chunks:]  # Chỉ xử lý chunks chưa hoàn thành
+                chunk_data = next(chunks_iter, None)
+                if chunk_data is None:
+                    all_chunks_submitted = True
+                    break
+                next_chunk_to_submit += 1
                 
-                print(f"Gửi {len(chunks_to_process)} chunks đến thread pool...")
+                chunk_index, chunk_lines, _, reused_offset = chunk_data
+                source_hash = chunk_source_hash(chunk_lines)
+                if reused_offset is not None and not journal.is_done(chunk_index, source_hash):
+                    # Chunk không đổi so với lần dịch trước: lấy bản dịch cũ, không gọi API
+                    # (manifest ghi trước khi bản dịch lỗi/bị chặn bị loại khỏi manifest: dịch lại)
+                    reused_text = manifest.read_text(reused_offset)
+                    if not is_failed_translation(reused_text):
+                        journal.append(chunk_index, source_hash, reused_text, len(chunk_lines), line_hash(chunk_lines[0]))
+                        reused_chunks += 1
                 
-                for chunk_data in chunks_to_process:
-                    # Kiểm tra flag dừng trước khi submit
-                    if is_translation_stopped():
-                        print("🛑 Dừng gửi chunks mới do người dùng yêu cầu")
-                        break
-                        
-                    future = executor.submit(process_chunk, api_key, model_name, system_instruction, chunk_data)
-                    futures[future] = chunk_data[0]  # chunk_index
+                # Bỏ qua chunk đã có trong nhật ký (không chỉ đoạn liên tiếp ở đầu file)
+                if journal.is_done(chunk_index, source_hash):
+                    done_chunks.add(chunk_index)
+                    total_lines_processed += len(chunk_lines)
+                    while next_expected_chunk_to_write in done_chunks:
+                        next_expected_chunk_to_write += 1
+                    continue
                 
-                # Thu thập kết quả khi các threads hoàn thành
-                for future in concurrent.futures.as_completed(futures):
-                    # Kiểm tra flag dừng và quota exceeded
-                    if is_translation_stopped():
-                        if is_quota_exceeded():
-                            print("Dừng xử lý kết quả do API hết quota")
-                        else:
-                            print("🛑 Dừng xử lý kết quả do người dùng yêu cầu")
-                        
-                        # Hủy các future chưa hoàn thành
-                        for f in futures:
-                            if not f.done():
-                                f.cancel()
-                        break
-                        
-                    chunk_index = futures[future]
-                    try:
-                        result = future.result()  # (chunk_index, translated_text, lines_count)
-                        processed_chunk_index, translated_text, lines_count = result
-                        
-                        # Lưu kết quả vào buffer tạm chờ ghi theo thứ tự
-                        translated_chunks_results[processed_chunk_index] = (translated_text, lines_count)
-                        
-                        print(f"✅ Hoàn thành chunk {processed_chunk_index + 1}/{total_chunks}")
+                task = submit_chunk(chunk_data[:3])
+                tasks[task] = (chunk_index, source_hash, line_hash(chunk_lines[0]))
+                chunk_payloads[chunk_index] = chunk_data[:3]
+                if hedger is not None:
+                    primary_tasks[chunk_index] = task
+            
+            if not tasks:
+                break
+            
+            # Chờ ít nhất một task hoàn thành (định kỳ thức dậy để kiểm tra flag dừng)
+            done_tasks, _ = await asyncio.wait(tasks, timeout=STOP_POLL_INTERVAL_SECONDS, return_when=asyncio.FIRST_COMPLETED)
+            
+            for task in done_tasks:
+                if task not in tasks:
+                    # Bản còn lại của chunk có request dự phòng, đã bị bỏ khi bản kia về trước
+                    continue
+                chunk_index, source_hash, first_line_hash = tasks.pop(task)
+                watchdog.unwatch_task(chunk_index, task)
+                if task.cancelled():
+                    # Bị watchdog hủy vì có request treo: bỏ mọi bản đang chạy của chunk và gửi lại
+                    for sibling_task in hedged_chunks.pop(chunk_index, ()):
+                        tasks.pop(sibling_task, None)
+                        watchdog.unwatch_task(chunk_index, sibling_task)
+                    if not watchdog.take_abandoned(chunk_index) or is_translation_stopped():
+                        continue
+                    if watchdog.reschedule(chunk_index):
+                        watchdog.forget_chunk(chunk_index)
+                        retry_task = submit_chunk(chunk_payloads[chunk_index])
+                        tasks[retry_task] = (chunk_index, source_hash, first_line_hash)
+                        if hedger is not None:
+                            primary_tasks[chunk_index] = retry_task
+                        print(f"🐕 Gửi lại chunk {chunk_index + 1} sau khi hủy request treo")
+                    else:
+                        # Chunk chưa xong, lần chạy sau dịch lại
+                        print(f"🐕 Bỏ dở chunk {chunk_index + 1} (request treo, đã gửi lại {watchdog.max_reschedules} lần)")
+                    continue
+                try:
+                    processed_chunk_index, translated_text, lines_count = task.result()
+                    if translated_text is None:
+                        # Chunk bị dừng giữa chừng (người dùng dừng / hết quota): chưa xong, lần sau dịch lại
+                        continue
+                    
+                    if hedger is not None:
+                        if chunk_index in hedged_chunks:
+                            # Nhận bản về trước, hủy bản còn lại
+                            primary_task, hedge_task = hedged_chunks.pop(chunk_index)
+                            sibling_task = hedge_task if task is primary_task else primary_task
+                            sibling_task.cancel()
+                            tasks.pop(sibling_task, None)
+                            watchdog.unwatch_task(chunk_index, sibling_task)
+                            hedger.on_hedge_resolved(hedge_won=task is hedge_task)
+                        sent_at = watchdog.sent_at(chunk_index)
+                        if sent_at is not None:
+                            # Chunk không gọi API (cache, dùng lại bản dịch...) không tính vào độ trễ
+                            hedger.record_latency(time.monotonic() - sent_at)
+                        primary_tasks.pop(chunk_index, None)
+                    watchdog.forget_chunk(chunk_index)
+                    chunk_payloads.pop(chunk_index, None)
+                    
+                    # Ghi ngay vào nhật ký, không chờ các chunk đứng trước (chunk hết ngân sách retry: đánh dấu dịch lại sau)
+                    needs_repair = retry_budget is not None and retry_budget.close_chunk(processed_chunk_index)
+                    journal.append(processed_chunk_index, source_hash, translated_text, lines_count, first_line_hash, needs_repair, is_failed_translation(translated_text))
+                    done_chunks.add(processed_chunk_index)
+                    total_lines_processed += lines_count
+                    while next_expected_chunk_to_write in done_chunks:
+                        next_expected_chunk_to_write += 1
+                    
+                    print(f"✅ Hoàn thành chunk {processed_chunk_index + 1}/{total_chunks}")
+                    
+                    had_first_chapter = frontier_stats.time_to_first_chapter is not None
+                    frontier_stats.record(next_expected_chunk_to_write, len(done_chunks))
+                    _run_metrics['write_frontier'] = frontier_stats.summary()
+                    if not had_first_chapter and frontier_stats.time_to_first_chapter is not None:
+                        print(f"📖 Chương đầu đã dịch xong liền mạch sau {frontier_stats.time_to_first_chapter:.1f}s")
+                    
+                    # Hiển thị thông tin tiến độ
+                    elapsed_time = time.time() - start_time
+                    progress_percent = (len(done_chunks) / total_chunks) * 100
+                    avg_speed = total_lines_processed / elapsed_time if elapsed_time > 0 else 0
+                    _run_metrics['concurrency_limit'] = concurrency.current_limit
+                    
+                    print(f"Tiến độ: {len(done_chunks)}/{total_chunks} chunks ({progress_percent:.1f}%) - {avg_speed:.1f} dòng/giây - {concurrency.current_limit} request đồng thời")
+                    if retry_budget is not None and retry_budget.retries:
+                        _run_metrics['retry_budget'] = retry_budget.summary()
+                        budget_status = retry_budget.status()
+                        if budget_status != last_budget_status:
+                            print(f"💸 Ngân sách retry: {budget_status}")
+                            last_budget_status = budget_status
                         
-                        # Ghi các chunks đã hoàn thành vào file output theo đúng thứ tự
-                        while next_expected_chunk_to_write in translated_chunks_results:
-                            chunk_text, chunk_lines_count = translated_chunks_results.pop(next_expected_chunk_to_write)
-                            outfile.write(chunk_text)
-                            if not chunk_text.endswith('\n'):
-                                outfile.write('\n')
-                            outfile.flush()
-                            
-                            # Cập nhật tiến độ
-                            next_expected_chunk_to_write += 1
-                            total_lines_processed += chunk_lines_count
-                            
-                            # Lưu tiến độ sau mỗi chunk hoàn thành
-                            save_progress(progress_file_path, next_expected_chunk_to_write)
-                            
-                            # Hiển thị thông tin tiến độ
-                            current_time = time.time()
-                            elapsed_time = current_time - start_time
-                            progress_percent = (next_expected_chunk_to_write / total_chunks) * 100
-                            avg_speed = total_lines_processed / elapsed_time if elapsed_time > 0 else 0
-                            
-                            print(f"Tiến độ: {next_expected_chunk_to_write}/{total_chunks} chunks ({progress_percent:.1f}%) - {avg_speed:.1f} dòng/giây")
-                            
-                    except Exception as e:
-                        print(f"❌ Lỗi khi xử lý chunk {chunk_index}: {e}")
+                except Exception as e:
+                    print(f"❌ Lỗi khi xử lý chunk {chunk_index}: {e}")
+            
+            # Chunk đầu hàng chờ ghi chạy lâu hơn ngưỡng kể từ khi request được gửi (chunk còn chờ slot/rate limiter
+            # thì chưa tính): gửi bản sao qua rate limiter, key pool và watchdog như request thường, nhưng không qua
+            # khử trùng lặp (bản sao phải là một request thật)
+            if hedger is not None and not is_translation_stopped():
+                head_task = primary_tasks.get(next_expected_chunk_to_write)
+                sent_at = watchdog.sent_at(next_expected_chunk_to_write)
+                if head_task is not None and head_task in tasks and sent_at is not None and next_expected_chunk_to_write not in hedged_chunks:
+                    head_elapsed = time.monotonic() - sent_at
+                    if hedger.should_hedge(head_elapsed):
+                        hedge_task = submit_chunk(chunk_payloads[next_expected_chunk_to_write], hedge=True)
+                        tasks[hedge_task] = tasks[head_task]
+                        hedged_chunks[next_expected_chunk_to_write] = (head_task, hedge_task)
+                        hedger.on_hedge_sent()
+                        print(f"🪁 Gửi request dự phòng cho chunk {next_expected_chunk_to_write + 1} (đã chạy {head_elapsed:.1f}s, ngưỡng {hedger.threshold():.1f}s)")
+            
+            # Kiểm tra flag dừng và quota exceeded
+            if is_translation_stopped():
+                if is_quota_exceeded():
+                    print("Dừng xử lý kết quả do API hết quota")
+                else:
+                    print("🛑 Dừng xử lý kết quả do người dùng yêu cầu")
                 
-                # Ghi nốt các chunks còn sót lại trong buffer (nếu có)
-                if translated_chunks_results:
-                    print("⚠️ Ghi các chunks còn sót lại...")
-                    sorted_remaining_chunks = sorted(translated_chunks_results.items())
-                    for chunk_idx, (chunk_text, chunk_lines_count) in sorted_remaining_chunks:
-                        try:
-                            outfile.write(chunk_text)
-                            if not chunk_text.endswith('\n'):
-                                outfile.write('\n')
-                            outfile.flush()
-                            next_expected_chunk_to_write += 1
-                            save_progress(progress_file_path, next_expected_chunk_to_write)
-                            print(f"✅ Ghi chunk bị sót: {chunk_idx + 1}")
-                        except Exception as e:
-                            print(f"❌ Lỗi khi ghi chunk {chunk_idx}: {e}")
-
-        # Kiểm tra xem có bị dừng giữa chừng không
-        if is_translation_stopped():
+                # Hủy các task chưa hoàn thành; task kịp xong trước khi bị hủy vẫn được ghi vào nhật ký.
+                # Chỉ chờ tối đa STOP_GRACE_SECONDS: task không chịu dừng (kết nối treo) bị bỏ lại
+                for t in tasks:
+                    t.cancel()
+                _, stuck_tasks = await asyncio.wait(tasks, timeout=STOP_GRACE_SECONDS)
+                if stuck_tasks:
+                    print(f"🐕 Bỏ lại {len(stuck_tasks)} chunk chưa dừng sau {STOP_GRACE_SECONDS:g}s, lần sau dịch lại")
+                for task, (chunk_index, source_hash, first_line_hash) in tasks.items():
+                    if not task.done() or task.cancelled() or task.exception() is not None or chunk_index in done_chunks:
+                        continue
+                    _, translated_text, lines_count = task.result()
+                    if translated_text is not None:
+                        needs_repair = retry_budget is not None and retry_budget.close_chunk(chunk_index)
+                        journal.append(chunk_index, source_hash, translated_text, lines_count, first_line_hash, needs_repair, is_failed_translation(translated_text))
+                        done_chunks.add(chunk_index)
+                break
+        
+        journal.sync()
+        if packer is not None:
+            await finish_within(packer.close(), what="hủy các gói chunk đang gửi")
+            packing_summary = packer.summary()
+            _run_metrics['packing'] = packing_summary
+            print(f"📦 Gộp chunk: {packing_summary['chunks_packed']} chunk qua {packing_summary['packs_sent']} request gộp (tiết kiệm {packing_summary['requests_saved']} request), {packing_summary['fallback_chunks']} chunk phải dịch riêng")
+        if dedup is not None:
+            dedup_summary = dedup.summary()
+            _run_metrics['dedup'] = dedup_summary
+            print(f"🧬 Khử trùng lặp: dùng lại bản dịch cho {dedup_summary['reused_chunks']} chunk (tránh {dedup_summary['calls_avoided']} request) và {dedup_summary['reused_lines']} dòng lặp lại, bớt ~{dedup_summary['tokens_avoided']} token gửi đi")
+        if bisection is not None and bisection.bisected_chunks:
+            bisection_summary = bisection.summary()
+            _run_metrics['bisection'] = bisection_summary
+            print(f"✂️ Chia đôi {bisection_summary['bisected_chunks']} chunk bị chặn/bị cắt: {bisection_summary['bisect_requests']} request (~{bisection_summary['bisect_tokens']} token) thay vì {bisection_summary['blind_retry_requests']} lần gửi lại nguyên chunk (~{bisection_summary['blind_retry_tokens']} token): tiết kiệm {bisection_summary['calls_saved']} request, ~{bisection_summary['tokens_saved']} token; dịch được {bisection_summary['recovered_lines']} dòng, {bisection_summary['fallback_lines']} dòng giữ nguyên gốc")
+        frontier_summary = frontier_stats.summary()
+        _run_metrics['write_frontier'] = frontier_summary
+        first_chapter_text = frontier_summary['time_to_first_chapter_seconds']
+        if first_chapter_text != "n/a":
+            first_chapter_text = f"{first_chapter_text}s"
+        print(f"📍 Thứ tự ghi: chunk đầu xong sau {frontier_summary['time_to_first_chunk_seconds']}s, chương đầu sau {first_chapter_text}; bộ đệm chờ ghi tối đa {frontier_summary['max_buffer_depth']} chunk (trung bình {frontier_summary['avg_buffer_depth']})")
+        if stream_stats is not None:
+            stream_summary = stream_stats.summary()
+            _run_metrics['streaming'] = stream_summary
+            print(f"📡 Stream: {stream_summary['streams']} response, token đầu tiên sau {stream_summary['first_token_p50_seconds']}s (p50) / {stream_summary['first_token_p95_seconds']}s (p95); ngắt sớm {stream_summary['aborted_streams']} stream bị từ chối, tránh ~{stream_summary['avoided_output_tokens']} token output")
+        watchdog_summary = watchdog.summary()
+        _run_metrics['watchdog'] = watchdog_summary
+        if watchdog_summary['timeouts'] or watchdog_summary['stuck_requests']:
+            print(f"🐕 Watchdog: {watchdog_summary['timeouts']} request quá timeout, {watchdog_summary['stuck_requests']} request treo quá {watchdog_summary['deadline_seconds']:g}s (chunk {', '.join(map(str, watchdog_summary['stuck_chunks'])) or '-'}), gửi lại {watchdog_summary['rescheduled_chunks']} chunk, bỏ dở {watchdog_summary['given_up_chunks']}; request lâu nhất {watchdog_summary['max_request_age_seconds']}s")
+        if hedger is not None:
+            hedge_summary = hedger.summary()
+            _run_metrics['hedging'] = hedge_summary
+            print(f"🪁 Request dự phòng: gửi {hedge_summary['hedges_sent']} (bản sao về trước {hedge_summary['hedges_won']}, bản gốc về trước {hedge_summary['primaries_won']}), ngưỡng {'chưa đủ mẫu' if hedge_summary['threshold_seconds'] is None else str(hedge_summary['threshold_seconds']) + 's'}; độ trễ chunk p50 {hedge_summary['chunk_latency_p50']}s, p95 {hedge_summary['chunk_latency_p95']}s, p99 {hedge_summary['chunk_latency_p99']}s")
+        if retry_budget is not None:
+            budget_summary = retry_budget.summary()
+            _run_metrics['retry_budget'] = budget_summary
+            print(f"💸 Ngân sách retry: {budget_summary['retries']}/{budget_summary['allowed_retries']} lượt retry, ~{budget_summary['spent_tokens']} token đã gửi / ~{budget_summary['budgeted_tokens']} token dự kiến; {budget_summary['repair_chunks']} chunk hết ngân sách chờ dịch lại ({budget_summary['exhausted_run']} lần hết ngân sách chung, {budget_summary['exhausted_chunk']} lần chạm trần của chunk)")
+        if structured_stats is not None:
+            structured_summary = structured_stats.summary()
+            _run_metrics['structured_output'] = structured_summary
+            print(f"🧾 Dịch theo dòng: {structured_summary['responses']} response ({structured_summary['mismatches']} lệch số dòng), gửi lại {structured_summary['retried_lines']} dòng lỗi (~{structured_summary['retried_tokens']} token), không phải gửi lại ~{structured_summary['avoided_tokens']} token đã dịch đạt")
+        if passthrough_stats is not None:
+            passthrough_summary = passthrough_stats.summary()
+            _run_metrics['passthrough'] = passthrough_summary
+            print(f"⏭️ Giữ nguyên {passthrough_summary['skipped_lines']} dòng không cần dịch: bỏ qua ~{passthrough_summary['skipped_tokens']}/{passthrough_summary['total_tokens']} token ({passthrough_summary['skipped_ratio']:.1%}), {passthrough_summary['local_chunks']} chunk không cần gọi API")
+        if context_cache is not None:
+            await finish_within(context_cache.close(), what="xóa context cache")
+            context_summary = context_cache.summary()
+            _run_metrics['context_cache'] = context_summary
+            print(f"🧊 Context cache: {context_summary['cached_tokens']}/{context_summary['prompt_tokens']} token đầu vào lấy từ cache ({context_summary['cached_ratio']:.0%}) qua {context_summary['requests']} request, tạo {context_summary['caches_created']} cache, gia hạn {context_summary['caches_refreshed']} lần")
+        if incremental:
+            _run_metrics['incremental'] = {'reused_chunks': reused_chunks, 'total_chunks': total_chunks}
+            print(f"♻️ Dùng lại {reused_chunks} chunk từ lần dịch trước, {total_chunks - reused_chunks} chunk dịch mới/đã có trong nhật ký")
+        if glossary is not None:
+            glossary_summary = glossary.summary()
+            _run_metrics['glossary'] = glossary_summary
+            print(f"📖 Glossary: trung bình {glossary_summary['avg_terms_per_request']} thuật ngữ/request, gửi ~{glossary_summary['injected_tokens']} token thay vì ~{glossary_summary['full_glossary_tokens']} (tiết kiệm ~{glossary_summary['saved_tokens']} token prompt)")
+
+        # Ghi nhớ mức đồng thời ổn định cho lần chạy sau
+        if adaptive_concurrency:
+            save_concurrency_level(key_pool.pool_id, model_name, concurrency.current_limit)
+            print(f"📈 Mức đồng thời cuối: {concurrency.current_limit} request ({concurrency.rate_limited_count} lần bị rate limit)")
+        retry_summary = retry_policy.summary()
+        _run_metrics['retry'] = retry_summary
+        print(f"🔁 Retry: {retry_summary['retries']} - chờ tổng {retry_summary['total_sleep_seconds']}s ({retry_summary['retry_after_hints_used']} lần theo gợi ý của server)")
+        limiters = [key.limiter for key in key_pool.keys if key.limiter is not None]
+        if limiters:
+            _run_metrics['rate_limit_wait_seconds'] = sum(limiter.total_wait_seconds for limiter in limiters)
+            print(f"🚦 Rate limiter: {sum(l.total_requests for l in limiters)} request, ~{sum(l.total_tokens for l in limiters)} token, chờ tổng {_run_metrics['rate_limit_wait_seconds']:.1f}s")
+        key_pool.save_state()
+        _run_metrics['api_keys'] = key_pool.summary()
+        for pool_key_id, key_usage in _run_metrics['api_keys'].items():
+            print(f"🔑 Key {pool_key_id}: {key_usage['requests_today']} request hôm nay{' (hết quota)' if key_usage['exhausted'] else ''}")
+        if translation_cache is not None:
+            cache_stats = translation_cache.stats()
+            _run_metrics['translation_cache'] = cache_stats
+            print(f"🗃️ Cache bản dịch: {cache_stats['hits']} hit / {cache_stats['misses']} miss ({cache_stats['hit_rate']:.0%}), lưu mới {cache_stats['stores']}, xóa {cache_stats['evictions']}")
+
+        # Chưa xong hết: ghép output từ phần liên tiếp đã dịch (không bao giờ ghi output bị thiếu đoạn),
+        # các chunk xong sau chỗ trống vẫn nằm trong nhật ký để lần sau dùng lại
+        if len(done_chunks) < total_chunks:
+            written_chunks = journal.write_output(output_file, total_chunks, done_chunks)
+            pending_after_gap = len(done_chunks) - written_chunks
             if is_quota_exceeded():
-                print(f"API đã hết quota!")
-                print(f"Để tiếp tục dịch, vui lòng:")
-                print(f" 1. Tạo tài khoản Google Cloud mới")
-                print(f" 2. Nhận 300$ credit miễn phí") 
-                print(f" 3. Tạo API key mới từ ai.google.dev")
-                print(f" 4. Cập nhật API key và tiếp tục dịch")
-                print(f"Đã xử lý {next_expected_chunk_to_write}/{total_chunks} chunks.")
-                print(f"Tiến độ đã được lưu để tiếp tục sau.")
-                return False
-            else:
+                _run_metrics['quota'] = key_pool.quota_status()
+                for quota_line in describe_quota_status(_run_metrics['quota']):
+                    print(quota_line)
+            elif is_translation_stopped():
                 print(f"🛑 Tiến trình dịch đã bị dừng bởi người dùng.")
-                print(f"Đã xử lý {next_expected_chunk_to_write}/{total_chunks} chunks.")
-                print(f"💾 Tiến độ đã được lưu. Bạn có thể tiếp tục dịch sau.")
-                return False
+            else:
+                print(f"⚠️ Quá trình dịch bị gián đoạn.")
+            print(f"Đã xử lý {len(done_chunks)}/{total_chunks} chunks ({written_chunks} chunk đầu đã ghi vào output, {pending_after_gap} chunk chờ trong nhật ký).")
+            print(f"💾 Tiến độ đã được lưu. Bạn có thể tiếp tục dịch sau.")
+            return False
 
-        # Hoàn thành
+        # Hoàn thành: ghép file output từ nhật ký
+        journal.write_output(output_file, total_chunks, done_chunks)
         total_time = time.time() - start_time
-        if next_expected_chunk_to_write >= total_chunks:
-            print(f"✅ Dịch hoàn thành file: {os.path.basename(input_file)}")
-            print(f"Đã dịch {total_chunks} chunks ({total_lines} dòng) trong {total_time:.2f}s")
-            print(f"Tốc độ trung bình: {total_lines / total_time:.2f} dòng/giây")
-            print(f"File dịch đã được lưu tại: {output_file}")
-
-            # Xóa file tiến độ khi hoàn thành
-            if os.path.exists(progress_file_path):
-                os.remove(progress_file_path)
-                print(f"Đã xóa file tiến độ: {os.path.basename(progress_file_path)}")
-            
-            # Tự động reformat file sau khi dịch xong
-            if CAN_REFORMAT:
-                print("\n🔧 Bắt đầu reformat file đã dịch...")
-                try:
-                    fix_text_format(output_file)
-                    print("✅ Reformat hoàn thành!")
-                except Exception as e:
-                    print(f"⚠️ Lỗi khi reformat: {e}")
-            else:
-                print("⚠️ Chức năng reformat không khả dụng")
-            
-            return True
+        print(f"✅ Dịch hoàn thành file: {os.path.basename(input_file)}")
+        print(f"Đã dịch {total_chunks} chunks ({total_lines} dòng) trong {total_time:.2f}s")
+        print(f"Tốc độ trung bình: {total_lines / total_time:.2f} dòng/giây")
+        print(f"File dịch đã được lưu tại: {output_file}")
+
+        # Dịch tăng dần: lưu hash nội dung gốc + bản dịch của từng chunk cho lần cập nhật sau
+        if incremental:
+            if manifest is not None:
+                manifest.close()
+            manifest_chunks = write_manifest(input_file, journal.iter_records(total_chunks, done_chunks))
+            print(f"♻️ Đã lưu manifest dịch tăng dần ({manifest_chunks} chunks)")
+
+        # Xóa nhật ký và file tiến độ cũ khi hoàn thành (còn chunk chờ dịch lại thì giữ nhật ký cho lần chạy sau)
+        repair_chunks = journal.repair_count()
+        if repair_chunks:
+            journal.close()
+            print(f"💸 {repair_chunks} chunk chưa dịch do hết ngân sách retry (đánh dấu \"{RETRY_BUDGET_MARKER}\" trong output).")
+            print(f"💸 Chạy dịch lại file này để chỉ dịch lại {repair_chunks} chunk đó, nhật ký được giữ tại: {os.path.basename(journal.path)}")
         else:
-            print(f"⚠️ Quá trình dịch bị gián đoạn.")
-            print(f"Đã xử lý {next_expected_chunk_to_write}/{total_chunks} chunks.")
-            print(f"Tiến độ đã được lưu. Bạn có thể chạy lại chương trình để tiếp tục.")
-            return False
+            journal.remove()
+            print(f"Đã xóa nhật ký tiến độ: {os.path.basename(journal.path)}")
+        if os.path.exists(progress_file_path):
+            os.remove(progress_file_path)
+        
+        # Tự động reformat file sau khi dịch xong
+        if CAN_REFORMAT:
+            print("\n🔧 Bắt đầu reformat file đã dịch...")
+            try:
+                fix_text_format(output_file)
+                print("✅ Reformat hoàn thành!")
+            except Exception as e:
+                print(f"⚠️ Lỗi khi reformat: {e}")
+        else:
+            print("⚠️ Chức năng reformat không khả dụng")
+        
+        return True
 
     except FileNotFoundError:
         print(f"❌ Lỗi: Không tìm thấy file đầu vào '{input_file}'.")
@@ -581,7 +1603,19 @@ def translate_file_optimized(input_file, output_file=None, api_key=None, model_n
         print(f"❌ Đã xảy ra lỗi không mong muốn: {e}")
         print("Tiến độ đã được lưu. Bạn có thể chạy lại chương trình để tiếp tục.")
         return False
-
+    finally:
+        watchdog.stop()
+        if packer is not None:
+            await finish_within(packer.close(), what="hủy các gói chunk đang gửi")
+        if context_cache is not None:
+            await finish_within(context_cache.close(), what="xóa context cache")
+        journal.close()
+        if manifest is not None:
+            manifest.close()
+        if translation_cache is not None:
+            translation_cache.close()
+        if source_file != input_file and os.path.exists(source_file):
+            os.remove(source_file)
 
 def load_api_key():
     """Tự động load API key từ environment variable hoặc file config"""
@@ -0,0 +1,141 @@
+"""
+Cache bản dịch theo nội dung (SQLite): cùng một đoạn văn + cùng model/system instruction/prompt
+thì dùng lại bản dịch cũ thay vì gọi API. Giới hạn dung lượng, xóa mục ít dùng nhất (LRU).
+"""
+import hashlib
+import os
+import sqlite3
+import time
+import unicodedata
+
+# File cache mặc định
+TRANSLATION_CACHE_FILE = "translation_cache.db"
+
+# Giới hạn cache: số bản dịch tối đa và tổng dung lượng bản dịch (byte)
+DEFAULT_CACHE_MAX_ENTRIES = 200_000
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Khi vượt giới hạn, xóa bớt đến còn tỷ lệ này của giới hạn để không phải dọn sau mỗi lần ghi
+EVICTION_TARGET_RATIO = 0.9
+
+
+def normalize_chunk_text(chunk_lines):
+    """
+    Chuẩn hóa nội dung chunk trước khi băm: Unicode NFC, bỏ khoảng trắng cuối dòng,
+    bỏ dòng trống ở đầu/cuối chunk. Nhờ vậy đổi cách chia chunk hoặc xuống dòng kiểu Windows vẫn trúng cache.
+    """
+    lines = [unicodedata.normalize('NFC', line).rstrip() for line in "\n".join(chunk_lines).splitlines()]
+    return "\n".join(lines).strip("\n")
+
+
+def make_cache_key(chunk_lines, model_name, system_instruction, prompt_template):
+    """Khóa cache: sha256 của (nội dung chunk đã chuẩn hóa, model, system instruction, prompt template)"""
+    digest = hashlib.sha256()
+    for part in (normalize_chunk_text(chunk_lines), model_name or "", system_instruction or "", prompt_template or ""):
+        digest.update(part.encode('utf-8'))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+class TranslationCache:
+    """
+    Cache bản dịch lưu trong SQLite.
+    get() trả về bản dịch hoặc None và cập nhật thời điểm dùng gần nhất; put() lưu bản dịch và dọn LRU nếu cần.
+    """
+    def __init__(self, path=TRANSLATION_CACHE_FILE, max_entries=DEFAULT_CACHE_MAX_ENTRIES, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+        cache_dir = os.path.dirname(os.path.abspath(path))
+        os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            "key TEXT PRIMARY KEY, translation TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_translations_last_used ON translations(last_used_at)")
+        self._entries, self._bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM translations"
+        ).fetchone()
+
+    def get(self, key):
+        """Bản dịch đã lưu cho key, None nếu chưa có"""
+        row = self._conn.execute("SELECT translation FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._conn.execute("UPDATE translations SET last_used_at = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key, translation):
+        """Lưu bản dịch (ghi đè nếu key đã có)"""
+        size = len(translation.encode('utf-8'))
+        now = time.time()
+        old = self._conn.execute("SELECT size FROM translations WHERE key = ?", (key,)).fetchone()
+        self._conn.execute(
+            "INSERT OR REPLACE INTO translations (key, translation, size, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+            (key, translation, size, now, now),
+        )
+        if old is None:
+            self._entries += 1
+        else:
+            self._bytes -= old[0]
+        self._bytes += size
+        self.stores += 1
+        if self._entries > self.max_entries or self._bytes > self.max_bytes:
+            self._evict()
+
+    def _evict(self):
+        """Xóa các bản dịch lâu không dùng nhất cho đến khi dưới giới hạn"""
+        target_entries = int(self.max_entries * EVICTION_TARGET_RATIO)
+        target_bytes = int(self.max_bytes * EVICTION_TARGET_RATIO)
+        cursor = self._conn.execute("SELECT key, size FROM translations ORDER BY last_used_at ASC")
+        victims = []
+        entries, total_bytes = self._entries, self._bytes
+        for key, size in cursor:
+            if entries <= target_entries and total_bytes <= target_bytes:
+                break
+            victims.append((key,))
+            entries -= 1
+            total_bytes -= size
+        cursor.close()
+        self._conn.executemany("DELETE FROM translations WHERE key = ?", victims)
+        self.evictions += len(victims)
+        self._entries, self._bytes = entries, total_bytes
+
+    def stats(self):
+        """Thống kê cache của lần chạy"""
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'stores': self.stores,
+            'evictions': self.evictions,
+            'entries': self._entries,
+            'size_bytes': self._bytes,
+        }
+
+    def close(self):
+        try:
+            self._conn.close()
+        except sqlite3.Error:
+            pass
+
+
+def open_translation_cache(path=TRANSLATION_CACHE_FILE, max_entries=DEFAULT_CACHE_MAX_ENTRIES, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+    """Mở cache, trả về None (dịch không dùng cache) nếu không mở được file"""
+    try:
+        return TranslationCache(path, max_entries, max_bytes)
+    except (sqlite3.Error, OSError) as e:
+        print(f"⚠️ Không mở được cache bản dịch '{path}': {e} - dịch không dùng cache")
+        return None
@@ -0,0 +1,246 @@
+"""
+Giới hạn thời gian cho từng request và watchdog cho chunk bị treo: một kết nối treo không được giữ chân một slot
+request, chặn việc ghi output theo thứ tự và làm nút dừng phải chờ mãi.
+Mỗi request có timeout kết nối (đến khi nhận được phần đầu của response) và timeout đọc (giữa hai phần liên tiếp
+của stream). Thread watchdog theo dõi tuổi các request đang chạy; request chạy quá hạn (timeout không có tác dụng,
+ví dụ SDK không trả quyền điều khiển) thì chunk của nó bị hủy, gửi lại và được ghi vào báo cáo.
+"""
+import asyncio
+import threading
+import time
+
+# Timeout mỗi request (giây): mở request đến khi có phần đầu tiên của response, và giữa hai phần liên tiếp của stream
+# (không stream: cả response phải về trong tổng hai timeout)
+REQUEST_CONNECT_TIMEOUT_SECONDS = 60.0
+REQUEST_READ_TIMEOUT_SECONDS = 120.0
+
+# Request chạy quá (timeout kết nối + timeout đọc + WATCHDOG_DEADLINE_MARGIN_SECONDS) thì coi là treo
+WATCHDOG_DEADLINE_MARGIN_SECONDS = 30.0
+WATCHDOG_CHECK_INTERVAL_SECONDS = 1.0
+
+# Số lần gửi lại tối đa cho mỗi chunk bị treo (quá số này thì để lần chạy sau dịch lại)
+WATCHDOG_MAX_RESCHEDULES = 2
+
+# Thời gian tối đa chờ các task/việc dọn dẹp kết thúc sau khi dừng (giây)
+STOP_GRACE_SECONDS = 5.0
+
+
+class RequestTimeoutError(TimeoutError):
+    """Request vượt timeout kết nối/đọc (được phân loại như lỗi mạng và retry)"""
+
+
+async def with_timeout(awaitable, seconds, stage):
+    """
+    Chờ awaitable tối đa seconds giây (None = không giới hạn), quá hạn thì ném RequestTimeoutError.
+    Quá hạn thì hủy awaitable và chờ nó dừng tối đa STOP_GRACE_SECONDS (để stream được đóng sau đó);
+    bị hủy (dừng) thì chỉ hủy awaitable chứ không chờ (kết nối treo có thể không bao giờ dừng).
+    """
+    if seconds is None:
+        return await awaitable
+    task = asyncio.ensure_future(awaitable)
+    try:
+        done, _ = await asyncio.wait({task}, timeout=seconds)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    if not done:
+        task.cancel()
+        await asyncio.wait({task}, timeout=STOP_GRACE_SECONDS)
+        if task.done() and not task.cancelled():
+            # Lấy lỗi (nếu có) để không bị báo "exception was never retrieved"
+            task.exception()
+        raise RequestTimeoutError(f"Request timeout: {stage} quá {seconds:g}s")
+    return task.result()
+
+
+async def finish_within(awaitable, seconds=STOP_GRACE_SECONDS, what="dọn dẹp"):
+    """
+    Chờ việc dọn dẹp (xóa context cache, hủy gói chunk...) tối đa seconds giây, quá hạn thì hủy và bỏ qua
+    (không chờ việc đó dừng hẳn như asyncio.wait_for).
+    """
+    task = asyncio.ensure_future(awaitable)
+    done, _ = await asyncio.wait({task}, timeout=seconds)
+    if not done:
+        task.cancel()
+        print(f"⚠️ Bỏ qua {what}: không xong sau {seconds:g}s")
+        return
+    task.result()
+
+
+def run_with_stop_grace(coroutine, grace=STOP_GRACE_SECONDS):
+    """
+    Chạy coroutine trong event loop riêng như asyncio.run, nhưng khi kết thúc chỉ chờ các task còn lại,
+    việc đóng async generator (stream) và thread của executor tổng cộng tối đa grace giây:
+    asyncio.run chờ đến khi mọi task dừng hẳn nên một kết nối treo giữ nút dừng lại vô thời hạn.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+    finally:
+        try:
+            deadline = time.monotonic() + grace
+            pending = [task for task in asyncio.all_tasks(loop) if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                _, stuck = loop.run_until_complete(asyncio.wait(pending, timeout=grace))
+                if stuck:
+                    print(f"🐕 Bỏ lại {len(stuck)} task chưa dừng sau {grace:g}s")
+            shutdown_steps = [loop.shutdown_asyncgens()]
+            if hasattr(loop, 'shutdown_default_executor'):
+                shutdown_steps.append(loop.shutdown_default_executor())
+            for step in shutdown_steps:
+                remaining = max(0.0, deadline - time.monotonic())
+                loop.run_until_complete(finish_within(step, remaining, "đóng stream/thread còn lại"))
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class ChunkWatchdog:
+    """
+    Timeout của request và thread theo dõi các request đang chạy.
+    process_chunk_async gọi request_started()/request_finished() quanh mỗi lần gọi API; vòng lặp dịch đăng ký
+    task của từng chunk (watch_task) và gửi lại chunk bị watchdog hủy (take_abandoned, reschedule).
+    Thread chỉ đọc thời gian và nhờ event loop hủy task (call_soon_threadsafe), không đụng vào task từ thread khác.
+    """
+    def __init__(self, connect_timeout=REQUEST_CONNECT_TIMEOUT_SECONDS, read_timeout=REQUEST_READ_TIMEOUT_SECONDS, deadline=None, max_reschedules=WATCHDOG_MAX_RESCHEDULES, check_interval=WATCHDOG_CHECK_INTERVAL_SECONDS):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        if deadline is None:
+            deadline = (connect_timeout or REQUEST_CONNECT_TIMEOUT_SECONDS) + (read_timeout or REQUEST_READ_TIMEOUT_SECONDS) + WATCHDOG_DEADLINE_MARGIN_SECONDS
+        self.deadline = deadline
+        self.max_reschedules = max_reschedules
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._next_id = 0
+        # Request đang chạy: {watch_id: (chunk_index, thời điểm gửi)}
+        self._requests = {}
+        # Thời điểm request đầu tiên của chunk thực sự được gửi (đã có slot và lượt rate limiter): {chunk_index: time}
+        self._first_sent = {}
+        # Task của từng chunk (task gốc và bản sao), chỉ dùng trong thread của event loop
+        self._tasks = {}
+        self._abandoned = set()
+        self._reschedules = {}
+        self._loop = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self.timeouts = 0
+        self.stuck_requests = 0
+        self.rescheduled_chunks = 0
+        self.given_up_chunks = 0
+        self.max_request_age = 0.0
+        # Báo cáo các chunk bị treo: [(chunk_index, số giây đã chạy)]
+        self.reports = []
+
+    def start(self, loop):
+        """Bắt đầu thread watchdog cho event loop đang chạy"""
+        self._loop = loop
+        self._thread = threading.Thread(target=self._run, name="chunk-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.check_interval * 2)
+            self._thread = None
+
+    def request_started(self, chunk_index):
+        now = time.monotonic()
+        with self._lock:
+            watch_id = self._next_id
+            self._next_id += 1
+            self._requests[watch_id] = (chunk_index, now)
+            self._first_sent.setdefault(chunk_index, now)
+        return watch_id
+
+    def request_finished(self, watch_id):
+        with self._lock:
+            _, started = self._requests.pop(watch_id, (None, None))
+        if started is not None:
+            self.max_request_age = max(self.max_request_age, time.monotonic() - started)
+
+    def sent_at(self, chunk_index):
+        """Thời điểm (time.monotonic) request đầu tiên của chunk được gửi, None nếu chunk còn đang chờ slot/rate limiter"""
+        with self._lock:
+            return self._first_sent.get(chunk_index)
+
+    def forget_chunk(self, chunk_index):
+        """Chunk đã xong hoặc được gửi lại từ đầu: lần gửi sau tính thời gian lại"""
+        with self._lock:
+            self._first_sent.pop(chunk_index, None)
+
+    def record_timeout(self):
+        """Một request bị hủy do vượt timeout kết nối/đọc"""
+        self.timeouts += 1
+
+    def watch_task(self, chunk_index, task):
+        self._tasks.setdefault(chunk_index, set()).add(task)
+
+    def unwatch_task(self, chunk_index, task):
+        chunk_tasks = self._tasks.get(chunk_index)
+        if chunk_tasks is not None:
+            chunk_tasks.discard(task)
+            if not chunk_tasks:
+                del self._tasks[chunk_index]
+
+    def take_abandoned(self, chunk_index):
+        """Chunk vừa bị watchdog hủy (mỗi lần hủy chỉ trả về True một lần)"""
+        if chunk_index in self._abandoned:
+            self._abandoned.discard(chunk_index)
+            return True
+        return False
+
+    def reschedule(self, chunk_index):
+        """Chunk bị hủy còn được gửi lại không (False: bỏ dở, lần chạy sau dịch lại)"""
+        count = self._reschedules.get(chunk_index, 0)
+        if count >= self.max_reschedules:
+            self.given_up_chunks += 1
+            return False
+        self._reschedules[chunk_index] = count + 1
+        self.rescheduled_chunks += 1
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.check_interval):
+            now = time.monotonic()
+            stuck = []
+            with self._lock:
+                for watch_id, (chunk_index, started) in list(self._requests.items()):
+                    if now - started > self.deadline:
+                        # Mỗi request chỉ báo một lần, kể cả khi task không dừng ngay
+                        del self._requests[watch_id]
+                        stuck.append((chunk_index, now - started))
+            for chunk_index, age in stuck:
+                self.stuck_requests += 1
+                self.max_request_age = max(self.max_request_age, age)
+                self.reports.append((chunk_index, round(age, 1)))
+                print(f"🐕 Watchdog: request của chunk {chunk_index + 1} treo {age:.0f}s (quá hạn {self.deadline:g}s), hủy và gửi lại")
+                try:
+                    self._loop.call_soon_threadsafe(self._abandon, chunk_index)
+                except RuntimeError:
+                    # Event loop đã đóng
+                    return
+
+    def _abandon(self, chunk_index):
+        """Chạy trong event loop: hủy mọi task của chunk bị treo"""
+        chunk_tasks = [task for task in self._tasks.get(chunk_index, ()) if not task.done()]
+        if not chunk_tasks:
+            return
+        self._abandoned.add(chunk_index)
+        for task in chunk_tasks:
+            task.cancel()
+
+    def summary(self):
+        return {
+            'connect_timeout_seconds': self.connect_timeout,
+            'read_timeout_seconds': self.read_timeout,
+            'deadline_seconds': self.deadline,
+            'timeouts': self.timeouts,
+            'stuck_requests': self.stuck_requests,
+            'rescheduled_chunks': self.rescheduled_chunks,
+            'given_up_chunks': self.given_up_chunks,
+            'max_request_age_seconds': round(self.max_request_age, 1),
+            'stuck_chunks': [chunk_index + 1 for chunk_index, _ in self.reports],
+        }
@@ -51,7 +51,7 @@ EPUB_AVAILABLE = False
 
 # Try relative imports first (when run as module)
 try:
-    from ..core.translate import translate_file_optimized, generate_output_filename, set_stop_translation, clear_stop_translation, is_translation_stopped, is_quota_exceeded
+    from ..core.translate import translate_file_optimized, generate_output_filename, set_stop_translation, clear_stop_translation, is_translation_stopped, is_quota_exceeded, get_quota_status, describe_quota_status, get_completed_chunk_count, get_chunking_signature, RETRY_BUDGET_RATIO
     from ..core.reformat import fix_text_format
     from ..core.ConvertEpub import txt_to_docx, docx_to_epub
     TRANSLATE_AVAILABLE = True
@@ -59,7 +59,7 @@ try:
 except ImportError:
     # Try absolute imports (when run directly)
     try:
-        from core.translate import translate_file_optimized, generate_output_filename, set_stop_translation, clear_stop_translation, is_translation_stopped, is_quota_exceeded
+        from core.translate import translate_file_optimized, generate_output_filename, set_stop_translation, clear_stop_translation, is_translation_stopped, is_quota_exceeded, get_quota_status, describe_quota_status, get_completed_chunk_count, get_chunking_signature, RETRY_BUDGET_RATIO
         from core.reformat import fix_text_format
         from core.ConvertEpub import txt_to_docx, docx_to_epub
         TRANSLATE_AVAILABLE = True
@@ -69,6 +69,8 @@ except ImportError:
         print("⚠️ Một số chức năng có thể không hoạt động")
         
         # Define fallback functions
+        RETRY_BUDGET_RATIO = 0.2
+        
         def translate_file_optimized(*args, **kwargs):
             print("❌ Chức năng dịch không khả dụng")
             return False
@@ -90,6 +92,18 @@ except ImportError:
         def is_quota_exceeded():
             return False
             
+        def get_quota_status():
+            return None
+            
+        def describe_quota_status(status):
+            return ["Tất cả API key đã hết quota hoặc đang tạm nghỉ."]
+            
+        def get_completed_chunk_count(input_file, signature=None):
+            return 0
+            
+        def get_chunking_signature(*args, **kwargs):
+            return None
+            
         def fix_text_format(*args, **kwargs):
             print("❌ Chức năng reformat không khả dụng")
             return False
@@ -152,6 +166,24 @@ class ModernTranslateNovelAI(ctk.CTk):
         self.custom_chapter_pattern_var = ctk.StringVar(value=r"^Chương\s+\d+:\s+.*$")
         self.threads_var = ctk.StringVar()
         self.chunk_size_var = ctk.StringVar(value="100")
+        self.chunk_mode_var = ctk.StringVar(value="Dòng")
+        self.rate_tier_var = ctk.StringVar(value="Free")
+        self.use_cache_var = ctk.BooleanVar(value=True)
+        self.incremental_var = ctk.BooleanVar(value=False)
+        self.context_cache_var = ctk.BooleanVar(value=False)
+        self.glossary_file_var = ctk.StringVar()
+        self.pack_chunks_var = ctk.BooleanVar(value=False)
+        self.skip_passthrough_var = ctk.BooleanVar(value=False)
+        self.dedup_var = ctk.BooleanVar(value=False)
+        self.junk_patterns_file_var = ctk.StringVar()
+        self.filter_junk_var = ctk.BooleanVar(value=False)
+        self.detect_repeated_junk_var = ctk.BooleanVar(value=False)
+        self.structured_output_var = ctk.BooleanVar(value=False)
+        self.bisect_var = ctk.BooleanVar(value=True)
+        self.retry_budget_var = ctk.BooleanVar(value=True)
+        self.hedge_var = ctk.BooleanVar(value=True)
+        self.stream_var = ctk.BooleanVar(value=True)
+        self.watchdog_var = ctk.BooleanVar(value=True)
         
         # Auto-detect optimal threads on startup
         self.auto_detect_threads(silent=True)
@@ -222,7 +254,7 @@ class ModernTranslateNovelAI(ctk.CTk):
         
         self.api_key_entry = ctk.CTkEntry(
             self.sidebar_frame,
-            placeholder_text="Google AI API Key",
+            placeholder_text="Google AI API Key (nhiều key cách nhau bằng dấu phẩy)",
             textvariable=self.api_key_var,
             show="*",
             width=240
@@ -283,6 +315,16 @@ class ModernTranslateNovelAI(ctk.CTk):
         )
         self.threads_entry.grid(row=0, column=1, padx=(5, 0), sticky="e")
         
+        # Tier giới hạn RPM/TPM của API key
+        self.rate_tier_menu = ctk.CTkOptionMenu(
+            self.threads_frame,
+            values=["Free", "Tier 1", "Off"],
+            variable=self.rate_tier_var,
+            width=70,
+            height=28
+        )
+        self.rate_tier_menu.grid(row=0, column=2, padx=(5, 0), sticky="e")
+        
         # Chunk size setting
         self.chunk_frame = ctk.CTkFrame(self.sidebar_frame, fg_color="transparent")
         self.chunk_frame.grid(row=8, column=0, padx=20, pady=5, sticky="ew")
@@ -303,6 +345,16 @@ class ModernTranslateNovelAI(ctk.CTk):
         )
         self.chunk_entry.grid(row=0, column=1, padx=(5, 0), sticky="e")
         
+        self.chunk_mode_menu = ctk.CTkOptionMenu(
+            self.chunk_frame,
+            values=["Dòng", "Token"],
+            variable=self.chunk_mode_var,
+            command=self.on_chunk_mode_changed,
+            width=70,
+            height=28
+        )
+        self.chunk_mode_menu.grid(row=0, column=2, padx=(5, 0), sticky="e")
+        
         # General Settings
         self.settings_label = ctk.CTkLabel(
             self.sidebar_frame,
@@ -326,9 +378,107 @@ class ModernTranslateNovelAI(ctk.CTk):
         )
         self.auto_epub_check.grid(row=11, column=0, padx=20, pady=5, sticky="w")
         
+        self.use_cache_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Dùng cache bản dịch",
+            variable=self.use_cache_var
+        )
+        self.use_cache_check.grid(row=12, column=0, padx=20, pady=5, sticky="w")
+        
+        self.incremental_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Chỉ dịch phần mới/bị sửa",
+            variable=self.incremental_var
+        )
+        self.incremental_check.grid(row=13, column=0, padx=20, pady=5, sticky="w")
+        
+        self.context_cache_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Context caching (prompt dài)",
+            variable=self.context_cache_var
+        )
+        self.context_cache_check.grid(row=14, column=0, padx=20, pady=5, sticky="w")
+        
+        self.pack_chunks_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Gộp chunk nhỏ (tiết kiệm request)",
+            variable=self.pack_chunks_var
+        )
+        self.pack_chunks_check.grid(row=15, column=0, padx=20, pady=5, sticky="w")
+        
+        self.skip_passthrough_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Giữ nguyên dòng không cần dịch",
+            variable=self.skip_passthrough_var
+        )
+        self.skip_passthrough_check.grid(row=16, column=0, padx=20, pady=5, sticky="w")
+        
+        self.dedup_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Dịch một lần dòng/chunk lặp lại",
+            variable=self.dedup_var
+        )
+        self.dedup_check.grid(row=17, column=0, padx=20, pady=5, sticky="w")
+        
+        self.filter_junk_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Lọc quảng cáo/watermark web",
+            variable=self.filter_junk_var
+        )
+        self.filter_junk_check.grid(row=18, column=0, padx=20, pady=5, sticky="w")
+        
+        self.detect_repeated_junk_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Xóa dòng rác lặp lại khắp sách",
+            variable=self.detect_repeated_junk_var
+        )
+        self.detect_repeated_junk_check.grid(row=19, column=0, padx=20, pady=5, sticky="w")
+        
+        self.structured_output_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Dịch theo dòng (chỉ dịch lại dòng lỗi)",
+            variable=self.structured_output_var
+        )
+        self.structured_output_check.grid(row=20, column=0, padx=20, pady=5, sticky="w")
+        
+        self.bisect_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Chia nhỏ chunk bị chặn/bị cắt",
+            variable=self.bisect_var
+        )
+        self.bisect_check.grid(row=21, column=0, padx=20, pady=5, sticky="w")
+        
+        self.retry_budget_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Giới hạn ngân sách retry",
+            variable=self.retry_budget_var
+        )
+        self.retry_budget_check.grid(row=22, column=0, padx=20, pady=5, sticky="w")
+        
+        self.hedge_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Gửi request dự phòng cho chunk chậm",
+            variable=self.hedge_var
+        )
+        self.hedge_check.grid(row=23, column=0, padx=20, pady=5, sticky="w")
+        
+        self.stream_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Stream response (dừng sớm khi AI từ chối)",
+            variable=self.stream_var
+        )
+        self.stream_check.grid(row=24, column=0, padx=20, pady=5, sticky="w")
+        
+        self.watchdog_check = ctk.CTkCheckBox(
+            self.sidebar_frame,
+            text="Watchdog: hủy và gửi lại request bị treo",
+            variable=self.watchdog_var
+        )
+        self.watchdog_check.grid(row=25, column=0, padx=20, pady=5, sticky="w")
+        
         # Control buttons - Grid 1x2 Layout
         self.control_grid_frame = ctk.CTkFrame(self.sidebar_frame, fg_color="transparent")
-        self.control_grid_frame.grid(row=12, column=0, padx=20, pady=10, sticky="ew")
+        self.control_grid_frame.grid(row=26, column=0, padx=20, pady=10, sticky="ew")
         
         # Configure grid columns với weight đều nhau
         for i in range(2):
@@ -439,7 +589,7 @@ class ModernTranslateNovelAI(ctk.CTk):
         self.output_entry.grid(row=4, column=0, columnspan=2, padx=20, pady=5, sticky="ew")
         
         self.output_btn_frame = ctk.CTkFrame(self.file_frame, fg_color="transparent")
-        self.output_btn_frame.grid(row=5, column=0, columnspan=2, padx=20, pady=(5, 20), sticky="w")
+        self.output_btn_frame.grid(row=5, column=0, columnspan=2, padx=20, pady=5, sticky="w")
         
         self.output_btn = ctk.CTkButton(
             self.output_btn_frame,
@@ -457,6 +607,52 @@ class ModernTranslateNovelAI(ctk.CTk):
         )
         self.reset_output_btn.grid(row=0, column=1)
         
+        # Glossary file (tùy chọn)
+        self.glossary_label = ctk.CTkLabel(
+            self.file_frame,
+            text="Glossary File (tùy chọn):",
+            font=ctk.CTkFont(weight="bold")
+        )
+        self.glossary_label.grid(row=6, column=0, padx=20, pady=(15, 5), sticky="w")
+        
+        self.glossary_entry = ctk.CTkEntry(
+            self.file_frame,
+            textvariable=self.glossary_file_var,
+            placeholder_text="Mỗi dòng: nguyên văn = bản dịch..."
+        )
+        self.glossary_entry.grid(row=7, column=0, columnspan=2, padx=20, pady=5, sticky="ew")
+        
+        self.glossary_btn = ctk.CTkButton(
+            self.file_frame,
+            text="📖 Browse",
+            command=self.browse_glossary_file,
+            width=100
+        )
+        self.glossary_btn.grid(row=8, column=0, padx=20, pady=5, sticky="w")
+        
+        # File pattern lọc rác (tùy chọn)
+        self.junk_patterns_label = ctk.CTkLabel(
+            self.file_frame,
+            text="Pattern lọc rác (tùy chọn):",
+            font=ctk.CTkFont(weight="bold")
+        )
+        self.junk_patterns_label.grid(row=9, column=0, padx=20, pady=(15, 5), sticky="w")
+        
+        self.junk_patterns_entry = ctk.CTkEntry(
+            self.file_frame,
+            textvariable=self.junk_patterns_file_var,
+            placeholder_text="Mỗi dòng một regex cần xóa..."
+        )
+        self.junk_patterns_entry.grid(row=10, column=0, columnspan=2, padx=20, pady=5, sticky="ew")
+        
+        self.junk_patterns_btn = ctk.CTkButton(
+            self.file_frame,
+            text="🧹 Browse",
+            command=self.browse_junk_patterns_file,
+            width=100
+        )
+        self.junk_patterns_btn.grid(row=11, column=0, padx=20, pady=(5, 20), sticky="w")
+        
         # EPUB Settings (initially hidden)
         self.epub_frame = ctk.CTkFrame(self.main_frame)
         self.epub_frame.grid_columnconfigure(0, weight=1)
@@ -552,6 +748,14 @@ class ModernTranslateNovelAI(ctk.CTk):
         self.progress_bar.grid(row=2, column=0, padx=20, pady=(5, 20), sticky="ew")
         self.progress_bar.set(0)
         
+        # Ngân sách retry đã dùng (cập nhật từ log trong khi dịch)
+        self.budget_text = ctk.CTkLabel(
+            self.progress_frame,
+            text="",
+            font=ctk.CTkFont(size=11)
+        )
+        self.budget_text.grid(row=3, column=0, padx=20, pady=(0, 10))
+        
         # Custom prompt frame (hidden by default)
         self.custom_prompt_frame = ctk.CTkFrame(self.main_frame)
         self.custom_prompt_frame.grid_columnconfigure(0, weight=1)
@@ -673,23 +877,16 @@ class ModernTranslateNovelAI(ctk.CTk):
                 filename = os.path.splitext(os.path.basename(file_path))[0]
                 self.book_title_var.set(filename)
             
-            # Check if there's existing progress
-            progress_file = f"{file_path}.progress.json"
-            if os.path.exists(progress_file):
-                try:
-                    with open(progress_file, 'r', encoding='utf-8') as f:
-                        progress_data = json.load(f)
-                        completed_chunks = progress_data.get('completed_chunks', 0)
-                        if completed_chunks > 0:
-                            self.log(f"🔄 Phát hiện tiến độ cũ: {completed_chunks} chunks đã hoàn thành")
-                            self.translate_btn.configure(
-                                text="▶️ Tiếp Tục Dịch",
-                                fg_color=("blue", "darkblue"),
-                                hover_color=("darkblue", "blue")
-                            )
-                            self.progress_text.configure(text=f"Sẵn sàng tiếp tục ({completed_chunks} chunks đã xong)")
-                except Exception as e:
-                    self.log(f"⚠️ Lỗi đọc file tiến độ: {e}")
+            # Check if there's existing progress (nhật ký hoàn thành chunk hoặc file .progress.json kiểu cũ)
+            completed_chunks = get_completed_chunk_count(file_path, self.current_chunking_signature())
+            if completed_chunks > 0:
+                self.log(f"🔄 Phát hiện tiến độ cũ: {completed_chunks} chunks đã hoàn thành")
+                self.translate_btn.configure(
+                    text="▶️ Tiếp Tục Dịch",
+                    fg_color=("blue", "darkblue"),
+                    hover_color=("darkblue", "blue")
+                )
+                self.progress_text.configure(text=f"Sẵn sàng tiếp tục ({completed_chunks} chunks đã xong)")
             else:
                 self.translate_btn.configure(
                     text="🚀 Bắt Đầu Dịch",
@@ -717,6 +914,32 @@ class ModernTranslateNovelAI(ctk.CTk):
             self.output_file_var.set(file_path)
             self.log(f"📁 Đã chọn file output: {os.path.basename(file_path)}")
     
+    def browse_glossary_file(self):
+        """Chọn file glossary"""
+        file_path = filedialog.askopenfilename(
+            title="Chọn file glossary",
+            filetypes=[
+                ("Glossary files", "*.txt *.tsv *.json"),
+                ("All files", "*.*")
+            ]
+        )
+        if file_path:
+            self.glossary_file_var.set(file_path)
+            self.log(f"📖 Đã chọn glossary: {os.path.basename(file_path)}")
+    
+    def browse_junk_patterns_file(self):
+        """Chọn file pattern lọc rác"""
+        file_path = filedialog.askopenfilename(
+            title="Chọn file pattern lọc rác",
+            filetypes=[
+                ("Text files", "*.txt"),
+                ("All files", "*.*")
+            ]
+        )
+        if file_path:
+            self.junk_patterns_file_var.set(file_path)
+            self.log(f"🧹 Đã chọn pattern lọc rác: {os.path.basename(file_path)}")
+    
     def reset_output_filename(self):
         """Reset output filename to auto-generated name"""
         if not self.input_file_var.get():
@@ -727,6 +950,32 @@ class ModernTranslateNovelAI(ctk.CTk):
         self.output_file_var.set(output_path)
         self.log(f"🔄 Đã reset tên file output: {os.path.basename(output_path)}")
     
+    def get_chunk_mode(self):
+        """Lấy cách chia chunk cho translate.py ("lines" hoặc "tokens")"""
+        return "tokens" if self.chunk_mode_var.get() == "Token" else "lines"
+
+    def current_chunking_signature(self):
+        """Cách chia chunk theo cài đặt hiện tại (nhật ký chia chunk kiểu khác sẽ bị dịch lại, không tính là tiến độ cũ)"""
+        try:
+            chunk_size = int(self.chunk_size_var.get())
+        except ValueError:
+            chunk_size = None
+        return get_chunking_signature(self.get_chunk_mode(), chunk_size, self.filter_junk_var.get(), detect_repeated_junk=self.detect_repeated_junk_var.get(), incremental=self.incremental_var.get(), junk_patterns_file=self.junk_patterns_file_var.get().strip() or None)
+
+    def get_rate_limit_tier(self):
+        """Lấy tier giới hạn RPM/TPM cho translate.py"""
+        tier_map = {"Free": "free", "Tier 1": "tier1", "Off": "off"}
+        return tier_map.get(self.rate_tier_var.get(), "free")
+
+    def on_chunk_mode_changed(self, choice):
+        """Đặt lại chunk size mặc định khi đổi cách chia chunk"""
+        if choice == "Token":
+            self.chunk_size_var.set("2000")
+            self.log("📦 Chia chunk theo token - giữ nguyên đoạn văn và khối hội thoại")
+        else:
+            self.chunk_size_var.set("100")
+            self.log("📦 Chia chunk theo số dòng")
+
     def auto_detect_threads(self, silent=False):
         """Tự động phát hiện số threads tối ưu cho máy"""
         try:
@@ -816,6 +1065,12 @@ class ModernTranslateNovelAI(ctk.CTk):
                 self.progress_bar.set(percent / 100)
                 self.progress_text.configure(text=f"Tiến độ: {current}/{total} chunks ({percent:.1f}%)")
                 return
+            
+            # Pattern: "Ngân sách retry: X/Y lượt retry, ..."
+            match3 = re.search(r'Ngân sách retry: (\d+/\d+ lượt retry.*)', message)
+            if match3:
+                self.budget_text.configure(text=f"💸 Ngân sách retry: {match3.group(1)}")
+                return
                 
         except Exception:
             pass
@@ -923,8 +1178,7 @@ class ModernTranslateNovelAI(ctk.CTk):
         
         # Warn if output file exists (only for new translation, not continue)
         if not is_translation_stopped() and os.path.exists(output_file):
-            progress_file = f"{self.input_file_var.get()}.progress.json"
-            if not os.path.exists(progress_file):  # Only warn if not continuing
+            if not get_completed_chunk_count(self.input_file_var.get(), self.current_chunking_signature()):  # Only warn if not continuing
                 result = show_question(
                     f"File output đã tồn tại:\n{os.path.basename(output_file)}\n\nBạn có muốn ghi đè không?",
                     parent=self
@@ -942,6 +1196,7 @@ class ModernTranslateNovelAI(ctk.CTk):
         )
         self.progress_bar.set(0)
         self.progress_text.configure(text="Đang dịch...")
+        self.budget_text.configure(text="")
         
         # Setup log capture
         self.setup_log_capture()
@@ -949,17 +1204,19 @@ class ModernTranslateNovelAI(ctk.CTk):
         # Validate performance settings
         try:
             num_threads = int(self.threads_var.get())
-            if num_threads < 1 or num_threads > 50:
-                show_warning("Số threads phải từ 1 đến 50!", parent=self)
+            if num_threads < 1 or num_threads > 500:
+                show_warning("Số threads phải từ 1 đến 500!", parent=self)
                 return
         except ValueError:
             show_warning("Số threads phải là số nguyên!", parent=self)
             return
             
+        chunk_mode = self.get_chunk_mode()
+        min_chunk, max_chunk = (200, 8000) if chunk_mode == "tokens" else (10, 500)
         try:
             chunk_size = int(self.chunk_size_var.get())
-            if chunk_size < 10 or chunk_size > 500:
-                show_warning("Chunk size phải từ 10 đến 500!", parent=self)
+            if chunk_size < min_chunk or chunk_size > max_chunk:
+                show_warning(f"Chunk size phải từ {min_chunk} đến {max_chunk}!", parent=self)
                 return
         except ValueError:
             show_warning("Chunk size phải là số nguyên!", parent=self)
@@ -970,12 +1227,43 @@ class ModernTranslateNovelAI(ctk.CTk):
         self.log(f"📁 Output: {os.path.basename(output_file)}")
         self.log(f"🤖 Model: {self.model_var.get()}")
         self.log(f"⚡ Threads: {num_threads}")
-        self.log(f"📦 Chunk size: {chunk_size} dòng")
+        self.log(f"🚦 Rate limit tier: {self.rate_tier_var.get()}")
+        if not self.use_cache_var.get():
+            self.log("🗃️ Bỏ qua cache bản dịch")
+        if self.incremental_var.get():
+            self.log("♻️ Dịch tăng dần: chỉ dịch phần mới/bị sửa so với lần dịch trước")
+        if self.context_cache_var.get():
+            self.log("🧊 Context caching: bật")
+        if self.glossary_file_var.get().strip():
+            self.log(f"📖 Glossary: {os.path.basename(self.glossary_file_var.get().strip())}")
+        if self.pack_chunks_var.get():
+            self.log("📦 Gộp chunk nhỏ: bật")
+        if self.skip_passthrough_var.get():
+            self.log("⏭️ Giữ nguyên các dòng không cần dịch (URL, số trang, tiếng Việt...)")
+        if self.dedup_var.get():
+            self.log("🧬 Khử trùng lặp: dòng/chunk lặp lại chỉ dịch một lần")
+        if self.filter_junk_var.get():
+            self.log("🧹 Lọc quảng cáo/watermark web trước khi dịch")
+        if self.detect_repeated_junk_var.get():
+            self.log("🧹 Xóa dòng rác lặp lại khắp sách")
+        if self.structured_output_var.get():
+            self.log("🧾 Dịch theo dòng: chỉ dịch lại các dòng bị lỗi")
+        if not self.bisect_var.get():
+            self.log("✂️ Không chia nhỏ chunk bị chặn/bị cắt (gửi lại nguyên chunk)")
+        if not self.retry_budget_var.get():
+            self.log("💸 Không giới hạn ngân sách retry")
+        if not self.hedge_var.get():
+            self.log("🪁 Không gửi request dự phòng cho chunk chậm")
+        if not self.stream_var.get():
+            self.log("📡 Không dùng stream: chờ cả response của mỗi chunk")
+        if not self.watchdog_var.get():
+            self.log("🐕 Tắt watchdog: request treo chỉ được giới hạn bằng timeout")
+        self.log(f"📦 Chunk size: {chunk_size} {'token' if chunk_mode == 'tokens' else 'dòng'}")
         
         # Run in thread
         self.translation_thread = threading.Thread(
             target=self.run_translation,
-            args=(self.input_file_var.get(), output_file, self.api_key_var.get(), self.model_var.get(), self.get_system_instruction(), num_threads, chunk_size),
+            args=(self.input_file_var.get(), output_file, self.api_key_var.get(), self.model_var.get(), self.get_system_instruction(), num_threads, chunk_size, chunk_mode, self.get_rate_limit_tier(), self.use_cache_var.get(), self.incremental_var.get(), self.context_cache_var.get(), self.glossary_file_var.get().strip() or None, self.pack_chunks_var.get(), self.skip_passthrough_var.get(), self.dedup_var.get(), self.filter_junk_var.get(), self.junk_patterns_file_var.get().strip() or None, self.detect_repeated_junk_var.get(), self.structured_output_var.get(), self.bisect_var.get(), self.retry_budget_var.get(), self.hedge_var.get(), self.stream_var.get(), self.watchdog_var.get()),
             daemon=True
         )
         self.translation_thread.start()
@@ -989,7 +1277,7 @@ class ModernTranslateNovelAI(ctk.CTk):
             if is_translation_stopped():
                 # Translation has been stopped
                 if is_quota_exceeded():
-                    self.log("💳 API đã hết quota!")
+                    self.log("💳 Tất cả API key đã hết quota!")
                     self.is_translating = False
                     self.translate_btn.configure(
                         state="normal", 
@@ -1102,7 +1390,25 @@ class ModernTranslateNovelAI(ctk.CTk):
             "chapter_pattern": self.chapter_pattern_var.get(),
             "custom_chapter_pattern": self.custom_chapter_pattern_var.get(),
             "threads": self.threads_var.get(),
-            "chunk_size": self.chunk_size_var.get()
+            "chunk_size": self.chunk_size_var.get(),
+            "chunk_mode": self.chunk_mode_var.get(),
+            "rate_tier": self.rate_tier_var.get(),
+            "use_cache": self.use_cache_var.get(),
+            "incremental": self.incremental_var.get(),
+            "context_cache": self.context_cache_var.get(),
+            "glossary_file": self.glossary_file_var.get(),
+            "pack_chunks": self.pack_chunks_var.get(),
+            "skip_passthrough": self.skip_passthrough_var.get(),
+            "dedup": self.dedup_var.get(),
+            "filter_junk": self.filter_junk_var.get(),
+            "junk_patterns_file": self.junk_patterns_file_var.get(),
+            "detect_repeated_junk": self.detect_repeated_junk_var.get(),
+            "structured_output": self.structured_output_var.get(),
+            "bisect": self.bisect_var.get(),
+            "retry_budget": self.retry_budget_var.get(),
+            "hedge_requests": self.hedge_var.get(),
+            "stream_responses": self.stream_var.get(),
+            "hung_chunk_watchdog": self.watchdog_var.get()
         }
         
         try:
@@ -1138,6 +1444,24 @@ class ModernTranslateNovelAI(ctk.CTk):
                     self.auto_detect_threads(silent=True)
                     
                 self.chunk_size_var.set(settings.get("chunk_size", "100"))
+                self.chunk_mode_var.set(settings.get("chunk_mode", "Dòng"))
+                self.rate_tier_var.set(settings.get("rate_tier", "Free"))
+                self.use_cache_var.set(settings.get("use_cache", True))
+                self.incremental_var.set(settings.get("incremental", False))
+                self.context_cache_var.set(settings.get("context_cache", False))
+                self.glossary_file_var.set(settings.get("glossary_file", ""))
+                self.pack_chunks_var.set(settings.get("pack_chunks", False))
+                self.skip_passthrough_var.set(settings.get("skip_passthrough", False))
+                self.dedup_var.set(settings.get("dedup", False))
+                self.filter_junk_var.set(settings.get("filter_junk", False))
+                self.junk_patterns_file_var.set(settings.get("junk_patterns_file", ""))
+                self.detect_repeated_junk_var.set(settings.get("detect_repeated_junk", False))
+                self.structured_output_var.set(settings.get("structured_output", False))
+                self.bisect_var.set(settings.get("bisect", True))
+                self.retry_budget_var.set(settings.get("retry_budget", True))
+                self.hedge_var.set(settings.get("hedge_requests", True))
+                self.stream_var.set(settings.get("stream_responses", True))
+                self.watchdog_var.set(settings.get("hung_chunk_watchdog", True))
                 
                 # Load custom prompt if exists
                 if hasattr(self, 'custom_prompt_textbox') and settings.get("custom_prompt"):
@@ -1253,7 +1577,7 @@ class ModernTranslateNovelAI(ctk.CTk):
             }
             return pattern_map.get(self.chapter_pattern_var.get(), r"^Chương\s+\d+:\s+.*$")
 
-    def run_translation(self, input_file, output_file, api_key, model_name, system_instruction, num_threads, chunk_size):
+    def run_translation(self, input_file, output_file, api_key, model_name, system_instruction, num_threads, chunk_size, chunk_mode="lines", rate_limit_tier="free", use_cache=True, incremental=False, context_caching=False, glossary_file=None, pack_chunks=False, skip_passthrough=False, dedup=False, filter_junk=False, junk_patterns_file=None, detect_repeated_junk=False, structured_output=False, bisect=True, retry_budget=True, hedge_requests=True, stream_responses=True, hung_chunk_watchdog=True):
         """Chạy quá trình dịch"""
         try:
             self.start_time = time.time()
@@ -1265,7 +1589,26 @@ class ModernTranslateNovelAI(ctk.CTk):
                 model_name=model_name,
                 system_instruction=system_instruction,
                 num_workers=num_threads,
-                chunk_size_lines=chunk_size
+                chunk_size_lines=chunk_size if chunk_mode == "lines" else None,
+                chunk_mode=chunk_mode,
+                chunk_token_budget=chunk_size if chunk_mode == "tokens" else None,
+                rate_limit_tier=rate_limit_tier,
+                use_translation_cache=use_cache,
+                incremental=incremental,
+                context_caching=context_caching,
+                glossary_file=glossary_file,
+                pack_small_chunks=pack_chunks,
+                skip_passthrough_lines=skip_passthrough,
+                deduplicate=dedup,
+                filter_junk=filter_junk,
+                junk_patterns_file=junk_patterns_file,
+                detect_repeated_junk=detect_repeated_junk,
+                structured_output=structured_output,
+                bisect_failed_chunks=bisect,
+                retry_budget_ratio=RETRY_BUDGET_RATIO if retry_budget else None,
+                hedge_requests=hedge_requests,
+                stream_responses=stream_responses,
+                hung_chunk_watchdog=hung_chunk_watchdog
             )
             
             if success:
@@ -1298,8 +1641,8 @@ class ModernTranslateNovelAI(ctk.CTk):
                 # Translation failed or stopped
                 if is_quota_exceeded():
                     self.log("💳 Dịch dừng do API hết quota")
-                    show_error("API đã hết quota!\n\nVui lòng tạo tài khoản Google Cloud mới để nhận 300$ credit miễn phí.", 
-                             details="Tiến độ đã được lưu, bạn có thể tiếp tục khi có API key mới.", parent=self)
+                    show_error("API đã hết quota!\n\n" + "\n".join(describe_quota_status(get_quota_status())), 
+                             details="Tiến độ đã được lưu, bạn có thể tiếp tục khi thêm key hoặc khi quota reset.", parent=self)
                 else:
                     self.log("❌ Dịch thất bại")
                     show_error("Quá trình dịch thất bại", parent=self)
@@ -1319,26 +1662,37 @@ class ModernTranslateNovelAI(ctk.CTk):
         
         self.log("🧪 Đang test kết nối API...")
         
+        # Có thể nhập nhiều key cách nhau bằng dấu phẩy: test lần lượt từng key
+        api_keys = [key for key in re.split(r'[,;\s]+', api_key) if key]
+        
         # Test in background thread
         def test_api():
-            try:
-                import google.generativeai as genai
-                genai.configure(api_key=api_key)
-                
-                model = genai.GenerativeModel(self.model_var.get())
-                response = model.generate_content("Hello")
-                
-                if response.text:
-                    self.after(0, lambda: self.log("✅ Kết nối API thành công!"))
-                    self.after(0, lambda: show_success("Kết nối API thành công!", parent=self))
-                else:
-                    self.after(0, lambda: self.log("❌ API trả về response rỗng"))
-                    self.after(0, lambda: show_error("API trả về response rỗng", parent=self))
+            failed_keys = []
+            for index, key in enumerate(api_keys, 1):
+                key_label = f"Key {index}/{len(api_keys)} ({key[:6]}***)"
+                try:
+                    import google.generativeai as genai
+                    genai.configure(api_key=key)
                     
-            except Exception as e:
-                error_msg = str(e)
-                self.after(0, lambda: self.log(f"❌ Lỗi API: {error_msg}"))
-                self.after(0, lambda: show_error(f"Lỗi kết nối API:\n{error_msg}", parent=self))
+                    model = genai.GenerativeModel(self.model_var.get())
+                    response = model.generate_content("Hello")
+                    
+                    if response.text:
+                        self.after(0, lambda label=key_label: self.log(f"✅ {label}: kết nối API thành công!"))
+                    else:
+                        failed_keys.append(key_label)
+                        self.after(0, lambda label=key_label: self.log(f"❌ {label}: API trả về response rỗng"))
+                        
+                except Exception as e:
+                    failed_keys.append(key_label)
+                    error_msg = str(e)
+                    self.after(0, lambda label=key_label, msg=error_msg: self.log(f"❌ {label}: lỗi API: {msg}"))
+            
+            if not failed_keys:
+                self.after(0, lambda: show_success(f"Kết nối API thành công ({len(api_keys)} key)!", parent=self))
+            else:
+                failed_list = "\n".join(failed_keys)
+                self.after(0, lambda: show_error(f"Lỗi kết nối API với {len(failed_keys)}/{len(api_keys)} key:\n{failed_list}", parent=self))
         
         threading.Thread(target=test_api, daemon=True).start()
 
@@ -1389,23 +1743,20 @@ class ModernTranslateNovelAI(ctk.CTk):
 
     def show_quota_exceeded_dialog(self):
         """Hiển thị dialog hướng dẫn khi API hết quota"""
-        quota_message = """🚨 API Google AI đã hết quota miễn phí!
+        quota_lines = describe_quota_status(get_quota_status())
+        quota_message = "🚨 " + "\n\n".join(quota_lines) + """
 
-💡 Giải pháp: Tạo tài khoản Google Cloud mới để nhận 300$ credit miễn phí
+💡 Giải pháp: thêm API key vào pool hoặc chờ quota reset
 
-📋 Hướng dẫn chi tiết:
+📋 Hướng dẫn:
 
-1️⃣ Truy cập: https://cloud.google.com/
-2️⃣ Đăng ký tài khoản mới (email khác)
-3️⃣ Nhận 300$ credit miễn phí
-4️⃣ Tạo API key mới tại: https://ai.google.dev/
-5️⃣ Cập nhật API key trong ứng dụng
-6️⃣ Tiếp tục dịch từ nơi đã dừng
+1️⃣ Tạo thêm API key tại Google AI Studio: https://aistudio.google.com/
+2️⃣ Thêm key vào ô API Key (nhiều key cách nhau bằng dấu phẩy), giữ nguyên các key cũ
+3️⃣ Bấm tiếp tục dịch: request được chia cho các key còn quota, key cũ tự dùng lại khi quota reset
 
-💾 Tiến độ dịch đã được lưu, bạn có thể tiếp tục ngay khi có API key mới!
+💾 Tiến độ dịch đã được lưu, bạn có thể tiếp tục ngay khi thêm key hoặc khi quota reset!
 
 🔗 Link hữu ích:
-- Google Cloud Console: https://console.cloud.google.com/
 - Google AI Studio: https://aistudio.google.com/
 - Hướng dẫn tạo API key: https://ai.google.dev/gemini-api/docs/api-key"""
 
@@ -1430,7 +1781,7 @@ class ModernTranslateNovelAI(ctk.CTk):
             # Title
             title_label = ctk.CTkLabel(
                 main_frame,
-                text="💳 API Google AI Đã Hết Quota",
+                text="💳 Tất Cả API Key Đã Hết Quota",
                 font=ctk.CTkFont(size=20, weight="bold"),
                 text_color=("red", "orange")
             )
@@ -1454,15 +1805,6 @@ class ModernTranslateNovelAI(ctk.CTk):
             button_frame.pack(fill="x", padx=20, pady=(10, 20))
             
             # Copy links button
-            def copy_google_cloud_link():
-                import tkinter as tk
-                try:
-                    dialog.clipboard_clear()
-                    dialog.clipboard_append("https://cloud.google.com/")
-                    show_toast_success("Đã copy link Google Cloud!")
-                except:
-                    pass
-            
             def copy_ai_studio_link():
                 import tkinter as tk
                 try:
@@ -1472,21 +1814,13 @@ class ModernTranslateNovelAI(ctk.CTk):
                 except:
                     pass
             
-            copy_gc_btn = ctk.CTkButton(
-                button_frame,
-                text="📋 Copy Link Google Cloud",
-                command=copy_google_cloud_link,
-                width=180
-            )
-            copy_gc_btn.pack(side="left", padx=(0, 10))
-            
             copy_ai_btn = ctk.CTkButton(
                 button_frame,
                 text="📋 Copy Link AI Studio", 
                 command=copy_ai_studio_link,
                 width=180
             )
-            copy_ai_btn.pack(side="left", padx=10)
+            copy_ai_btn.pack(side="left", padx=(0, 10))
             
             close_btn = ctk.CTkButton(
                 button_frame,
@@ -1500,7 +1834,7 @@ class ModernTranslateNovelAI(ctk.CTk):
             
         except Exception as e:
             # Fallback to simple error dialog
-            show_error("API đã hết quota!\n\nVui lòng tạo tài khoản Google Cloud mới để nhận 300$ credit miễn phí.\n\nTruy cập: https://cloud.google.com/", parent=self)
+            show_error("API đã hết quota!\n\n" + "\n".join(describe_quota_status(get_quota_status())), parent=self)
             self.log(f"⚠️ Lỗi hiển thị quota dialog: {e}")
 
 def main():
@@ -0,0 +1,20 @@
+import os
+import sys
+
+import pytest
+
+# Các module trong src/core import lẫn nhau theo kiểu "from chunking import ..." khi chạy độc lập
+# (src/core/__init__.py import translate.py nên cần google-generativeai)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "core"))
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """
+    Module translate chạy với backend giả lập (model_name "local-echo"), file trạng thái nằm trong thư mục tạm.
+    Cần google-generativeai để import translate.py, bỏ qua nếu chưa cài.
+    """
+    pytest.importorskip("google.generativeai")
+    import translate
+    monkeypatch.chdir(tmp_path)
+    return translate
@@ -0,0 +1,50 @@
+from bisection import split_in_halves, join_translated_parts
+
+POISON = "第7行 被屏蔽的内容。\n"
+
+
+async def _no_sleep(delay_seconds):
+    return None
+
+
+def test_split_balances_content_lines():
+    first, second = split_in_halves(["a\n", "\n", "b\n", "c\n", "d\n"])
+    assert first == ["a\n", "\n", "b\n"]
+    assert second == ["c\n", "d\n"]
+    assert split_in_halves(["\n", "a\n", "\n"]) is None
+
+
+def test_join_keeps_blank_only_parts():
+    assert join_translated_parts([["a\n"], ["\n"], ["b\n"]], ["A", "", "B\n"]) == "A\n\nB\n"
+
+
+def test_blocked_line_is_isolated(engine, tmp_path, monkeypatch):
+    import local_backend
+
+    lines = [f"第{i}行 他说了一些话。\n" for i in range(20)]
+    lines[7] = POISON
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(lines), encoding="utf-8")
+    respond = local_backend.LocalGenerativeModel._respond
+
+    async def generate_content_async(self, contents=None, generation_config=None, **kwargs):
+        response = respond(self, contents, generation_config)
+        if POISON.strip() in response.text:
+            # Request nào chứa dòng này cũng bị bộ lọc an toàn chặn
+            response.candidates[0].finish_reason = 'SAFETY'
+        return response
+
+    monkeypatch.setattr(local_backend.LocalGenerativeModel, "generate_content_async", generate_content_async)
+    monkeypatch.setattr(engine, "sleep_unless_stopped", _no_sleep)
+
+    output_file = tmp_path / "book.out"
+    assert engine.translate_file_optimized(
+        str(input_file), str(output_file), api_key="k1", model_name="local-echo", chunk_size_lines=10,
+        use_translation_cache=False, rate_limit_tier="off", stream_responses=False, retry_budget_ratio=None,
+    )
+    bisection = engine.get_translation_metrics()['bisection']
+    assert bisection['bisected_chunks'] == 1
+    assert bisection['fallback_lines'] == 1
+    assert bisection['recovered_lines'] == 9
+    # Dòng bị chặn giữ nguyên văn bản gốc, không có thông báo lỗi thay cho cả chunk
+    assert [line for line in output_file.read_text(encoding="utf-8").splitlines() if line.strip()] == [line.rstrip("\n") for line in lines]
@@ -0,0 +1,47 @@
+from chunking import count_chunks, estimate_tokens, iter_chunks, split_lines_into_chunks
+
+
+def _write(tmp_path, lines):
+    source = tmp_path / "book.txt"
+    source.write_text("".join(lines), encoding="utf-8")
+    return str(source)
+
+
+def test_estimate_counts_cjk_per_char():
+    assert estimate_tokens("他说了一些话") == 6
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("  \n") == 0
+
+
+def test_token_chunks_respect_budget_and_paragraphs():
+    paragraphs = [f"第{i}段" + "字" * 20 + "。\n" for i in range(30)]
+    lines = [line for paragraph in paragraphs for line in (paragraph, "\n")]
+    chunks = list(split_lines_into_chunks(lines, "tokens", 100))
+    assert "".join("".join(chunk) for chunk in chunks) == "".join(lines)
+    for chunk in chunks:
+        assert estimate_tokens("".join(chunk)) <= 100
+        # Dòng trống đi cùng đoạn văn phía trước, chunk không bắt đầu giữa đoạn
+        assert chunk[0].strip()
+
+
+def test_dialogue_block_is_not_split():
+    lines = ["旁白" + "字" * 30 + "\n"] + ["“对话" + "字" * 30 + "”\n" for _ in range(4)] + ["旁白结束。\n"]
+    chunks = list(split_lines_into_chunks(lines, "tokens", 80))
+    dialogue_chunks = [chunk for chunk in chunks if any(line.startswith("“") for line in chunk)]
+    # Khối thoại (vượt ngân sách nhưng dưới 2 lần) nằm trọn trong một chunk
+    assert len(dialogue_chunks) == 1
+    assert sum(line.startswith("“") for line in dialogue_chunks[0]) == 4
+
+
+def test_oversized_paragraph_stands_alone():
+    lines = ["短。\n", "长" * 500 + "\n", "短。\n"]
+    assert list(split_lines_into_chunks(lines, "tokens", 100)) == [[lines[0]], [lines[1]], [lines[2]]]
+
+
+def test_chunk_indexes_and_start_lines(tmp_path):
+    lines = [f"第{i}行。\n" for i in range(25)]
+    source = _write(tmp_path, lines)
+    chunks = list(iter_chunks(source, "lines", 10))
+    assert [(index, start, len(chunk_lines)) for index, chunk_lines, start in chunks] == [(0, 0, 10), (1, 10, 10), (2, 20, 5)]
+    assert count_chunks(source, "lines", 10) == 3
+    assert count_chunks(source, "tokens", 20) == len(list(iter_chunks(source, "tokens", 20)))
@@ -0,0 +1,68 @@
+import asyncio
+
+import concurrency
+from concurrency import ConcurrencyController, load_concurrency_level, save_concurrency_level
+
+
+def test_additive_increase_while_latency_is_stable():
+    controller = ConcurrencyController(4, max_limit=20)
+    for _ in range(30):
+        controller.on_success(1.0)
+    # Khoảng +1 sau mỗi vòng request (limit request) thành công
+    assert 8 <= controller.current_limit <= 10
+
+
+def test_rate_limit_halves_once_per_burst(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr(concurrency.time, "monotonic", lambda: clock[0])
+    controller = ConcurrencyController(16)
+    controller.on_rate_limited()
+    controller.on_rate_limited()
+    assert controller.current_limit == 8
+    clock[0] += concurrency.DECREASE_COOLDOWN_SECONDS + 0.1
+    controller.on_rate_limited()
+    assert controller.current_limit == 4
+    assert controller.rate_limited_count == 3
+
+
+def test_latency_spike_backs_off_without_rate_limit():
+    controller = ConcurrencyController(10)
+    controller.on_success(1.0)
+    for _ in range(20):
+        controller.on_success(5.0)
+    assert controller.current_limit < 10
+    assert controller.rate_limited_count == 0
+
+
+def test_limit_stays_within_bounds_and_fixed_mode_never_changes():
+    controller = ConcurrencyController(2, min_limit=2, max_limit=3)
+    controller._decrease(0.1)
+    assert controller.current_limit == 2
+    fixed = ConcurrencyController(6, adaptive=False)
+    fixed.on_rate_limited()
+    fixed.on_success(0.1)
+    assert fixed.current_limit == 6
+
+
+def test_slots_never_exceed_limit():
+    controller = ConcurrencyController(3, adaptive=False)
+    peak = [0]
+
+    async def request(priority):
+        async with controller.slot(priority):
+            peak[0] = max(peak[0], controller.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(*(request(i) for i in range(12)))
+
+    asyncio.run(run())
+    assert peak[0] == 3
+
+
+def test_stable_level_is_remembered(tmp_path, monkeypatch):
+    monkeypatch.setattr(concurrency, "CONCURRENCY_STATE_FILE", str(tmp_path / "state.json"))
+    assert load_concurrency_level("key-a", "gemini-2.0-flash") is None
+    save_concurrency_level("key-a", "gemini-2.0-flash", 12)
+    assert load_concurrency_level("key-a", "gemini-2.0-flash") == 12
+    assert load_concurrency_level("key-b", "gemini-2.0-flash") is None
@@ -0,0 +1,72 @@
+import asyncio
+
+from dedup import BookDeduplicator, build_book_deduplicator, chunk_key
+from passthrough import SPAN_SHARED, SPAN_TRANSLATE
+from retry_budget import mark_untranslated
+
+FOOTER = ["求月票！\n"]
+
+
+def _deduplicator():
+    return BookDeduplicator(set(), {chunk_key(FOOTER)})
+
+
+def _translator(results):
+    calls = []
+
+    async def translate_once():
+        calls.append(len(calls))
+        await asyncio.sleep(0)
+        return results[min(len(calls), len(results)) - 1]
+
+    return translate_once, calls
+
+
+def test_successful_translation_is_shared():
+    dedup = _deduplicator()
+    translate_once, calls = _translator(["Xin phiếu tháng!\n"])
+
+    async def run():
+        return await asyncio.gather(*(dedup.shared_chunk(FOOTER, translate_once) for _ in range(3)))
+
+    assert asyncio.run(run()) == ["Xin phiếu tháng!\n"] * 3
+    assert len(calls) == 1
+    assert dedup.summary()['reused_chunks'] == 2
+
+
+def test_failed_translation_is_not_shared():
+    dedup = _deduplicator()
+    failed = [mark_untranslated(FOOTER), "[LỖI XỬ LÝ CHUNK 3: 500 Internal error]"]
+    translate_once, calls = _translator(failed + ["Xin phiếu tháng!\n"])
+
+    async def run():
+        concurrent = await asyncio.gather(dedup.shared_chunk(FOOTER, translate_once), dedup.shared_chunk(FOOTER, translate_once))
+        later = await dedup.shared_chunk(FOOTER, translate_once)
+        return concurrent, later
+
+    concurrent, later = asyncio.run(run())
+    # Chỗ đang chờ bản dịch lỗi tự dịch lại thay vì nhận luôn dấu lỗi
+    assert concurrent == failed
+    assert later == "Xin phiếu tháng!\n"
+    assert len(calls) == 3
+    assert dedup.summary()['reused_chunks'] == 0
+
+
+def test_book_index_finds_repeated_lines_and_chunks():
+    chapter = ["第{}章\n", "他说了一些话。\n", "求月票！\n"]
+    chunks = [[line.format(i) for line in chapter] for i in range(3)] + [["相同的一块\n"]] * 2
+    dedup = build_book_deduplicator(chunks)
+    assert dedup.is_repeated_line("求月票！\n")
+    assert not dedup.is_repeated_line("第1章\n")
+    assert dedup.is_repeated_chunk(["相同的一块\n"])
+    assert build_book_deduplicator([["a\n"], ["b\n"]]) is None
+
+
+def test_repeated_lines_are_isolated_from_spans():
+    dedup = build_book_deduplicator([["求月票！\n"]] * 3 + [["x\n"]])
+    spans = [(SPAN_TRANSLATE, ["正文一\n", "求月票！\n", "\n", "正文二\n"])]
+    assert dedup.isolate_repeated_lines(spans) == [
+        (SPAN_TRANSLATE, ["正文一\n"]), (SPAN_SHARED, ["求月票！\n", "\n"]), (SPAN_TRANSLATE, ["正文二\n"]),
+    ]
+    # Chỉ tách ở đầu/cuối: dòng lặp lại ở giữa không cắt đoạn thành nhiều request
+    assert dedup.isolate_repeated_lines(spans, edges_only=True) == [(SPAN_TRANSLATE, spans[0][1])]
@@ -0,0 +1,25 @@
+from glossary import Glossary, load_glossary_entries
+
+
+def _sources(glossary, text):
+    return [source for source, _ in glossary.match(text)]
+
+
+def test_latin_terms_match_whole_words_only():
+    glossary = Glossary([("Li", "Lý"), ("Light", "Ánh Sáng")])
+    assert _sources(glossary, "Lin went into the Light.") == ["Light"]
+    assert _sources(glossary, "Li said hello.") == ["Li"]
+    # Chữ Hán sát bên thuật ngữ Latin vẫn là ranh giới từ
+    assert _sources(glossary, "他叫Li。") == ["Li"]
+
+
+def test_cjk_terms_match_inside_text():
+    glossary = Glossary([("李", "Lý"), ("李Li", "Lý Li")])
+    assert _sources(glossary, "李Lin来了") == ["李"]
+    assert _sources(glossary, "李Li来了") == ["李", "李Li"]
+
+
+def test_full_width_colon_separator(tmp_path):
+    glossary_file = tmp_path / "glossary.txt"
+    glossary_file.write_text("张三：Trương Tam\n王五: Vương Ngũ\n", encoding="utf-8")
+    assert load_glossary_entries(str(glossary_file)) == [("张三", "Trương Tam"), ("王五", "Vương Ngũ")]
@@ -0,0 +1,47 @@
+import asyncio
+import functools
+
+from hedging import HedgeController
+
+
+def _book(tmp_path):
+    # Chunk 30 và chunk 50 giống hệt nhau: chunk lặp lại được khử trùng lặp
+    lines = [f"第{i}行 他说了一些话。\n" for i in range(600)]
+    lines[500:510] = lines[300:310]
+    book = tmp_path / "book.txt"
+    book.write_text("".join(lines), encoding="utf-8")
+    return str(book), lines
+
+
+def test_hedge_of_repeated_chunk_sends_second_request(engine, tmp_path, monkeypatch):
+    import local_backend
+
+    input_file, lines = _book(tmp_path)
+    slow_calls = []
+    respond = local_backend.LocalGenerativeModel._respond
+
+    async def generate_content_async(self, contents=None, generation_config=None, **kwargs):
+        response = respond(self, contents, generation_config)
+        if "第300行" in response.text:
+            slow_calls.append(len(slow_calls))
+            # Request đầu của chunk lặp lại bị treo, bản sao dự phòng trả về ngay
+            await asyncio.sleep(30 if len(slow_calls) == 1 else 0.01)
+        else:
+            await asyncio.sleep(0.01)
+        return response
+
+    monkeypatch.setattr(local_backend.LocalGenerativeModel, "generate_content_async", generate_content_async)
+    monkeypatch.setattr(engine, "HedgeController", functools.partial(HedgeController, min_delay=0.3, min_samples=10))
+
+    output_file = str(tmp_path / "book.out")
+    assert engine.translate_file_optimized(
+        input_file, output_file, api_key="k1", model_name="local-echo", chunk_size_lines=10, num_workers=4,
+        use_translation_cache=False, rate_limit_tier="off", deduplicate=True, stream_responses=False,
+    )
+    hedging = engine.get_translation_metrics()['hedging']
+    assert hedging['hedges_sent'] == 1
+    assert hedging['hedges_won'] == 1
+    # Bản gốc treo và bản sao là hai request thật
+    assert len(slow_calls) >= 2
+    with open(output_file, encoding="utf-8") as f:
+        assert [line for line in f.read().split("\n") if line.strip()] == [line.rstrip("\n") for line in lines]
@@ -0,0 +1,27 @@
+from chunking import iter_chunks
+from incremental import open_manifest, plan_incremental_chunks, write_manifest
+from journal import CompletionJournal, chunk_source_hash, chunking_signature, get_journal_path, line_hash
+from retry_budget import is_failed_translation
+
+SIGNATURE = chunking_signature("lines", 10, incremental=True)
+
+
+def test_failed_and_blocked_chunks_are_not_reused(tmp_path):
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(f"第{i}行\n" for i in range(30)), encoding="utf-8")
+    results = {
+        0: "dịch 0\n",
+        1: "[LỖI XỬ LÝ CHUNK 1: 500 Internal error]",
+        2: "[NỘI DỊCH BỊ CHẶN BỞI BỘ LỌC AN TOÀN - OUTPUT: HARASSMENT]",
+    }
+    journal = CompletionJournal(get_journal_path(str(input_file)), SIGNATURE)
+    for chunk_index, chunk_lines, _ in iter_chunks(str(input_file), "lines", 10):
+        text = results[chunk_index]
+        journal.append(chunk_index, chunk_source_hash(chunk_lines), text, len(chunk_lines), line_hash(chunk_lines[0]), failed=is_failed_translation(text))
+    assert write_manifest(str(input_file), journal.iter_records(3)) == 1
+    journal.close()
+
+    manifest = open_manifest(str(input_file))
+    reused = [offset is not None for _, _, _, offset in plan_incremental_chunks(str(input_file), manifest, "lines", 10)]
+    manifest.close()
+    assert reused == [True, False, False]
@@ -0,0 +1,56 @@
+from chunking import iter_chunks
+from journal import CompletionJournal, chunk_source_hash, chunking_signature, count_journal_chunks, get_journal_path
+
+LINES_10 = chunking_signature("lines", 10)
+LINES_20 = chunking_signature("lines", 20)
+
+
+def _write_source(path, count=40):
+    lines = [f"第{i}行\n" for i in range(count)]
+    path.write_text("".join(lines), encoding="utf-8")
+    return lines
+
+
+def _journal_chunks(journal, input_file, chunk_size, indexes, needs_repair=()):
+    for chunk_index, chunk_lines, _ in iter_chunks(str(input_file), "lines", chunk_size):
+        if chunk_index in indexes:
+            journal.append(chunk_index, chunk_source_hash(chunk_lines), f"dịch {chunk_index}\n", len(chunk_lines), needs_repair=chunk_index in needs_repair)
+
+
+def test_changed_chunking_resets_journal(tmp_path):
+    input_file = tmp_path / "book.txt"
+    _write_source(input_file)
+    journal = CompletionJournal(get_journal_path(str(input_file)), LINES_10)
+    _journal_chunks(journal, input_file, 10, {0, 1, 2, 3})
+    journal.close()
+
+    journal = CompletionJournal(get_journal_path(str(input_file)), LINES_20)
+    assert journal.entries == {}
+    assert count_journal_chunks(str(input_file), LINES_20) == 0
+    journal.close()
+
+
+def test_write_output_stops_at_first_unchecked_chunk(tmp_path):
+    input_file = tmp_path / "book.txt"
+    _write_source(input_file)
+    journal = CompletionJournal(get_journal_path(str(input_file)), LINES_10)
+    _journal_chunks(journal, input_file, 10, {0, 1, 2, 3})
+    output_file = tmp_path / "out.txt"
+    assert journal.write_output(str(output_file), 4, valid_chunks={0, 1, 3}) == 2
+    assert output_file.read_text(encoding="utf-8") == "dịch 0\ndịch 1\n"
+    journal.close()
+
+
+def test_count_skips_repair_and_stale_records(tmp_path):
+    input_file = tmp_path / "book.txt"
+    lines = _write_source(input_file)
+    journal = CompletionJournal(get_journal_path(str(input_file)), LINES_10)
+    _journal_chunks(journal, input_file, 10, {0, 1, 2}, needs_repair={2})
+    journal.close()
+    assert count_journal_chunks(str(input_file), LINES_10) == 2
+    assert count_journal_chunks(str(input_file), LINES_20) == 0
+
+    # Sửa nội dung chunk 1: bản dịch cũ của nó không còn dùng được
+    lines[12] = "第12行 đã sửa\n"
+    input_file.write_text("".join(lines), encoding="utf-8")
+    assert count_journal_chunks(str(input_file), LINES_10) == 1
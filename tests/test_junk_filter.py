@@ -0,0 +1,39 @@
+from junk_filter import BUILTIN_JUNK_PATTERNS, JunkFilter, junk_patterns_fingerprint, load_junk_patterns
+
+
+def _load(tmp_path, text):
+    patterns_file = tmp_path / "junk.txt"
+    patterns_file.write_text(text, encoding="utf-8")
+    return load_junk_patterns(str(patterns_file))
+
+
+def test_pattern_with_leading_inline_flags_combines_with_builtin(tmp_path):
+    patterns = _load(tmp_path, "(?i)visit\\s+\\S+\\.com\n")
+    junk_filter = JunkFilter(list(BUILTIN_JUNK_PATTERNS) + patterns)
+    cleaned, removals = junk_filter.clean_line("他走了。VISIT mysite.com\n")
+    assert cleaned == "他走了。\n"
+    assert removals
+
+
+def test_invalid_pattern_is_used_as_plain_text(tmp_path):
+    patterns = _load(tmp_path, "# chú thích\n[广告\n")
+    junk_filter = JunkFilter(patterns)
+    assert junk_filter.clean_line("正文[广告\n")[0] == "正文\n"
+
+
+def test_fingerprint_changes_when_pattern_file_is_edited(tmp_path):
+    patterns_file = tmp_path / "junk.txt"
+    patterns_file.write_text("广告\n", encoding="utf-8")
+    before = junk_patterns_fingerprint(str(patterns_file))
+    patterns_file.write_text("广告\n求票\n", encoding="utf-8")
+    assert junk_patterns_fingerprint(str(patterns_file)) != before
+    assert junk_patterns_fingerprint(str(tmp_path / "missing.txt")) is None
+
+
+def test_chunking_signature_tracks_pattern_file(engine, tmp_path):
+    patterns_file = tmp_path / "junk.txt"
+    patterns_file.write_text("广告\n", encoding="utf-8")
+    before = engine.get_chunking_signature(filter_junk=True, junk_filter_mode="drop", junk_patterns_file=str(patterns_file))
+    patterns_file.write_text("广告\n求票\n", encoding="utf-8")
+    after = engine.get_chunking_signature(filter_junk=True, junk_filter_mode="drop", junk_patterns_file=str(patterns_file))
+    assert before != after
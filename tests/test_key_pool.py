@@ -0,0 +1,51 @@
+import time
+
+from key_pool import ApiKeyPool, KEY_BENCH_SECONDS, describe_quota_status
+from retry_policy import is_quota_exhausted_error
+
+PER_MINUTE_429 = "429 Resource has been exhausted (e.g. check quota). quota_id: GenerateRequestsPerMinutePerProjectPerModel"
+PER_DAY_429 = "429 You exceeded your current quota. quota_id: GenerateRequestsPerDayPerProjectPerModel-FreeTier"
+
+
+def _pool(tmp_path, keys="key-a"):
+    return ApiKeyPool(keys, "gemini-2.0-flash", rate_limit_tier="off", state_file=str(tmp_path / "key_state.json"))
+
+
+def test_quota_exhausted_only_for_daily_quota_errors():
+    assert is_quota_exhausted_error(PER_DAY_429)
+    assert not is_quota_exhausted_error(PER_MINUTE_429)
+    assert not is_quota_exhausted_error("500 Internal error")
+
+
+def test_repeated_per_minute_429_never_exhausts_key(tmp_path):
+    pool = _pool(tmp_path)
+    key = pool.keys[0]
+    for _ in range(10):
+        key.benched_until = 0.0
+        pool.on_rate_limited(key)
+    assert not pool.all_exhausted()
+    assert key.benched_until - time.time() > KEY_BENCH_SECONDS
+
+    # Trạng thái lưu lại không làm lần chạy sau dừng ngay
+    assert not _pool(tmp_path).all_exhausted()
+
+
+def test_daily_quota_429_exhausts_key(tmp_path):
+    pool = _pool(tmp_path, "key-a,key-b")
+    pool.on_rate_limited(pool.keys[0], quota_exhausted=is_quota_exhausted_error(PER_DAY_429))
+    assert pool.keys[0].is_exhausted(time.time())
+    assert pool.available_count() == 1
+
+
+def test_quota_status_reports_earliest_key(tmp_path):
+    pool = _pool(tmp_path, "key-a,key-b")
+    assert pool.quota_status()['next_available_at'] is None
+    pool.on_rate_limited(pool.keys[0], quota_exhausted=True)
+    pool.on_rate_limited(pool.keys[1])
+    status = pool.quota_status()
+    assert (status['exhausted_keys'], status['benched_keys']) == (1, 1)
+    # Key chỉ tạm nghỉ dùng lại được trước key hết quota ngày
+    assert status['next_available_at'] == pool.keys[1].benched_until
+    message = "\n".join(describe_quota_status(status))
+    assert "thêm API key" in message
+    assert "Google Cloud" not in message
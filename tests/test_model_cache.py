@@ -0,0 +1,14 @@
+def test_model_is_created_once_per_key(engine, tmp_path):
+    import local_backend
+
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(f"第{i}行 他说了一些话。\n" for i in range(200)), encoding="utf-8")
+    clients_before = local_backend.local_stats['clients_created']
+    requests_before = local_backend.local_stats['requests']
+    assert engine.translate_file_optimized(
+        str(input_file), str(tmp_path / "book.out"), api_key="k1,k2", model_name="local-echo", chunk_size_lines=10,
+        num_workers=8, use_translation_cache=False, rate_limit_tier="off",
+    )
+    assert local_backend.local_stats['requests'] - requests_before == 20
+    # Mỗi API key một model/client, dùng lại cho mọi chunk
+    assert local_backend.local_stats['clients_created'] - clients_before <= 2
@@ -0,0 +1,108 @@
+import asyncio
+
+from packing import ChunkPacker, build_packed_lines, split_packed_response
+
+CHUNKS = [["第一段\n"], ["第二段\n", "还有一行\n"], ["第三段\n"]]
+
+
+def _echo_pack(packed_lines):
+    # "Bản dịch" giữ nguyên thẻ và nội dung, bỏ dòng hướng dẫn ở đầu gói
+    return "\n".join(line.rstrip("\n") for line in packed_lines[2:])
+
+
+def test_packed_response_splits_by_tag():
+    parts = split_packed_response(_echo_pack(build_packed_lines(CHUNKS)), len(CHUNKS))
+    assert parts == ["第一段", "第二段\n还有一行", "第三段"]
+
+
+def test_mismatched_tags_fall_back():
+    text = _echo_pack(build_packed_lines(CHUNKS))
+    # Thiếu đoạn, thừa đoạn, trùng thẻ hoặc đoạn rỗng: không tách được
+    assert split_packed_response(text, len(CHUNKS) + 1) is None
+    assert split_packed_response(text.replace('id="3"', 'id="2"'), len(CHUNKS)) is None
+    assert split_packed_response(text.replace("第三段", " "), len(CHUNKS)) is None
+    assert split_packed_response("", len(CHUNKS)) is None
+
+
+def test_failed_pack_sends_chunks_individually():
+    async def failing_pack(packed_lines):
+        return None
+
+    async def run():
+        packer = ChunkPacker(failing_pack, token_budget=1000)
+        results = await asyncio.gather(*(packer.translate(chunk_lines, 5) for chunk_lines in CHUNKS))
+        return results, packer.summary()
+
+    results, summary = asyncio.run(run())
+    assert results == [None] * len(CHUNKS)
+    assert summary['fallback_chunks'] == len(CHUNKS)
+
+
+def test_packs_respect_token_budget_and_chunk_limit():
+    sizes = []
+
+    async def echo_pack(packed_lines):
+        sizes.append(sum(line.startswith("<translate_this") for line in packed_lines))
+        return _echo_pack(packed_lines)
+
+    async def run():
+        packer = ChunkPacker(echo_pack, token_budget=100, max_chunks=4)
+        chunks = [[f"第{i}段\n"] for i in range(10)]
+        results = await asyncio.gather(*(packer.translate(chunk_lines, 20) for chunk_lines in chunks))
+        return results, packer.summary()
+
+    results, summary = asyncio.run(run())
+    assert results == [f"第{i}段" for i in range(10)]
+    # 100 token / 20 token mỗi chunk nhưng tối đa 4 chunk một gói
+    assert sizes == [4, 4, 2]
+    assert summary['requests_saved'] == 7
+
+
+def test_engine_packs_short_chunks(engine, tmp_path):
+    import local_backend
+
+    lines = [f"第{i}章\n" for i in range(40)]
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(lines), encoding="utf-8")
+    requests_before = local_backend.local_stats['requests']
+    output_file = str(tmp_path / "book.out")
+    assert engine.translate_file_optimized(
+        input_file=str(input_file), output_file=output_file, api_key="k1", model_name="local-echo", chunk_size_lines=10,
+        use_translation_cache=False, rate_limit_tier="off", pack_small_chunks=True, stream_responses=False,
+    )
+    # 4 chunk rất ngắn đi chung một request
+    assert engine.get_translation_metrics()['packing']['chunks_packed'] == 4
+    assert local_backend.local_stats['requests'] - requests_before == 1
+    with open(output_file, encoding="utf-8") as f:
+        assert [line for line in f.read().split("\n") if line.strip()] == [line.rstrip("\n") for line in lines]
+
+
+def test_blocked_pack_is_split_after_first_request(engine, tmp_path, monkeypatch):
+    import local_backend
+
+    lines = [f"第{i}行 他说了一些话。\n" for i in range(12)]
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(lines), encoding="utf-8")
+    pack_calls = []
+    respond = local_backend.LocalGenerativeModel._respond
+
+    async def generate_content_async(self, contents=None, generation_config=None, **kwargs):
+        response = respond(self, contents, generation_config)
+        if "<translate_this" in response.text:
+            # Cả gói bị bộ lọc an toàn chặn, từng chunk riêng thì không
+            pack_calls.append(len(pack_calls))
+            response.candidates[0].finish_reason = 'SAFETY'
+        return response
+
+    monkeypatch.setattr(local_backend.LocalGenerativeModel, "generate_content_async", generate_content_async)
+
+    output_file = str(tmp_path / "book.out")
+    assert engine.translate_file_optimized(
+        str(input_file), output_file, api_key="k1", model_name="local-echo", chunk_size_lines=3, num_workers=4,
+        use_translation_cache=False, rate_limit_tier="off", pack_small_chunks=True, stream_responses=False,
+    )
+    # Gói bị chặn không được gửi lại nguyên gói theo lịch retry
+    assert pack_calls
+    assert len(pack_calls) == engine.get_translation_metrics()['packing']['packs_sent']
+    with open(output_file, encoding="utf-8") as f:
+        assert [line for line in f.read().split("\n") if line.strip()] == [line.rstrip("\n") for line in lines]
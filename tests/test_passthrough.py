@@ -0,0 +1,40 @@
+import pytest
+
+from passthrough import is_passthrough_line, split_passthrough_spans, SPAN_KEEP, SPAN_TRANSLATE
+
+
+@pytest.mark.parametrize("line", [
+    "Il était à côté de la fenêtre, même très tôt.",
+    "Ea a mâncat pâine în București.",
+    "Ele não está aqui hoje, irmão.",
+    "他说了一些话。",
+])
+def test_foreign_lines_are_translated(line):
+    assert not is_passthrough_line(line)
+
+
+@pytest.mark.parametrize("line", [
+    "Anh ấy đã đi học ở trường từ sáng sớm.",
+    "Cô ấy mỉm cười, nhẹ nhàng bước vào phòng.",
+    "- 12 -",
+    "www.example.com",
+    "* * *",
+    "",
+])
+def test_passthrough_lines_are_kept(line):
+    assert is_passthrough_line(line)
+
+
+def test_french_line_between_kept_lines_is_sent():
+    spans = split_passthrough_spans(["* * *\n", "Il était à côté de la fenêtre, même très tôt.\n", "- 12 -\n"])
+    assert [kind for kind, _ in spans] == [SPAN_KEEP, SPAN_TRANSLATE, SPAN_KEEP]
+
+
+def test_engine_sends_every_line_by_default(engine, tmp_path):
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("* * *\nAnh ấy đã đi học ở trường từ sáng sớm.\n他说了一些话。\n", encoding="utf-8")
+    assert engine.translate_file_optimized(
+        str(input_file), str(tmp_path / "book.out"), api_key="k1", model_name="local-echo",
+        use_translation_cache=False, rate_limit_tier="off",
+    )
+    assert 'passthrough' not in engine.get_translation_metrics()
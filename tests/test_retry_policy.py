@@ -0,0 +1,52 @@
+import random
+
+import pytest
+
+from retry_policy import (
+    ERROR_NETWORK, ERROR_RATE_LIMIT, ERROR_SAFETY, ERROR_SERVER, RetryPolicy, classify_error, parse_retry_after,
+)
+
+
+def test_backoff_doubles_up_to_cap():
+    policy = RetryPolicy(jitter=False)
+    assert [policy.compute_delay(ERROR_RATE_LIMIT, attempt) for attempt in range(1, 7)] == [5, 10, 20, 40, 80, 120]
+    assert [policy.compute_delay(ERROR_SAFETY, attempt) for attempt in range(1, 5)] == [2, 4, 8, 16]
+    assert policy.summary()['retries'][ERROR_RATE_LIMIT] == 6
+
+
+def test_full_jitter_stays_within_cap():
+    random.seed(1234)
+    policy = RetryPolicy()
+    delays = [policy.compute_delay(ERROR_NETWORK, 3) for _ in range(200)]
+    assert all(0 <= delay <= 4 for delay in delays)
+    # Full jitter: thời gian chờ trải đều, không dồn về mức trần
+    assert min(delays) < 1 < 3 < max(delays)
+
+
+def test_retry_after_hint_is_a_floor():
+    policy = RetryPolicy(jitter=False)
+    assert policy.compute_delay(ERROR_RATE_LIMIT, 1, retry_after=42) == 42
+    assert policy.compute_delay(ERROR_RATE_LIMIT, 1, retry_after=1) == 5
+    assert policy.summary()['retry_after_hints_used'] == 1
+
+
+def test_custom_schedule_overrides_one_class():
+    policy = RetryPolicy({ERROR_SAFETY: {"max_attempts": 1}})
+    assert policy.max_attempts(ERROR_SAFETY) == 1
+    assert policy.max_attempts(ERROR_SERVER) == 5
+
+
+@pytest.mark.parametrize("message, error_class", [
+    ("429 Resource has been exhausted (e.g. check quota).", ERROR_RATE_LIMIT),
+    ("503 The model is overloaded. Please try again later.", ERROR_SERVER),
+    ("Deadline Exceeded", ERROR_NETWORK),
+    ("Connection reset by peer", ERROR_NETWORK),
+])
+def test_errors_are_classified(message, error_class):
+    assert classify_error(Exception(message)) == error_class
+
+
+def test_retry_after_is_parsed_from_error_text():
+    assert parse_retry_after(Exception("429 quota exceeded retry_delay { seconds: 17 }")) == 17
+    assert parse_retry_after(Exception('"retryDelay": "2.5s"')) == 2.5
+    assert parse_retry_after(Exception("500 Internal error")) is None
@@ -0,0 +1,52 @@
+import asyncio
+
+from scheduler import PrioritySemaphore, WriteFrontierStats, find_first_chapter_end
+
+
+def _book(chapter_lengths, chunk_size=10):
+    lines = []
+    for number, length in enumerate(chapter_lengths, 1):
+        lines.append(f"第{number}章 标题\n")
+        lines.extend(f"正文{number}-{i}\n" for i in range(length - 1))
+    return [(index, lines[start:start + chunk_size]) for index, start in enumerate(range(0, len(lines), chunk_size))]
+
+
+def test_first_chapter_end_found_beyond_submission_window():
+    # Chương đầu dài 200 dòng: tiêu đề chương 2 nằm ở chunk 20, xa hơn mọi cửa sổ gửi nhỏ
+    assert find_first_chapter_end(_book([200, 50])) == 20
+
+
+def test_first_chapter_time_waits_for_whole_chapter():
+    stats = WriteFrontierStats(find_first_chapter_end(_book([200, 50])))
+    stats.record(frontier=1, done_count=1)
+    assert stats.time_to_first_chunk is not None
+    assert stats.time_to_first_chapter is None
+    stats.record(frontier=21, done_count=21)
+    assert stats.summary()['time_to_first_chapter_seconds'] is not None
+
+
+def test_book_without_second_heading_reports_na():
+    stats = WriteFrontierStats(find_first_chapter_end(_book([60])))
+    stats.record(frontier=6, done_count=6)
+    assert stats.summary()['time_to_first_chapter_seconds'] == "n/a"
+
+
+def test_slots_go_to_chunk_nearest_the_write_frontier():
+    order = []
+
+    async def run():
+        semaphore = PrioritySemaphore(1)
+        await semaphore.acquire()
+
+        async def request(chunk_index):
+            async with semaphore.slot(chunk_index):
+                order.append(chunk_index)
+
+        # Chunk ở xa đến trước, lần thử lại của chunk 2 đến sau cùng
+        waiters = [asyncio.ensure_future(request(chunk_index)) for chunk_index in (9, 5, 7, 2)]
+        await asyncio.sleep(0)
+        semaphore.release()
+        await asyncio.gather(*waiters)
+
+    asyncio.run(run())
+    assert order == [2, 5, 7, 9]
@@ -0,0 +1,19 @@
+class _OldGenerativeModel:
+    """GenerativeModel của SDK cũ: chưa có context cache, request_options hay client riêng theo model"""
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    async def generate_content_async(self, contents, generation_config=None, stream=False):
+        raise AssertionError("không được gửi request với SDK không được hỗ trợ")
+
+
+def test_old_sdk_fails_before_translating(engine, tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(engine.genai, "GenerativeModel", _OldGenerativeModel)
+    monkeypatch.setattr(engine, "_sdk_support_error", None)
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("第1行\n", encoding="utf-8")
+
+    assert not engine.translate_file_optimized(str(input_file), str(tmp_path / "book.out"), api_key="k1", model_name="gemini-2.0-flash")
+    output = capsys.readouterr().out
+    assert "request_options" in output
+    assert f">={engine.MIN_GENAI_VERSION}" in output
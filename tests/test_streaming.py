@@ -0,0 +1,85 @@
+import asyncio
+
+from streaming import StreamingStats, read_stream
+
+REFUSAL = "Xin lỗi, tôi không thể dịch nội dung này."
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+def _stream(pieces, sent, closed):
+    async def iterate():
+        try:
+            for piece in pieces:
+                sent.append(piece)
+                await asyncio.sleep(0)
+                yield _Part(piece)
+        finally:
+            closed.append(True)
+
+    return iterate()
+
+
+def _is_refusal(text):
+    return "xin lỗi" in text.lower()
+
+
+def test_refusal_in_first_piece_aborts_stream():
+    sent, closed = [], []
+    pieces = [REFUSAL] + ["Phần còn lại của output.\n"] * 50
+    streamed = asyncio.run(read_stream(_stream(pieces, sent, closed), should_abort=_is_refusal))
+    assert streamed.aborted
+    assert streamed.text == REFUSAL
+    # Ngắt ngay sau phần đầu, stream được đóng
+    assert len(sent) == 1
+    assert closed == [True]
+
+    stats = StreamingStats()
+    stats.record(streamed, "第1行\n" * 200)
+    assert stats.summary()['aborted_streams'] == 1
+    assert stats.summary()['avoided_output_tokens'] > 0
+
+
+def test_refusal_after_check_window_is_not_aborted():
+    sent, closed = [], []
+    pieces = ["Chương 1\n" * 40, REFUSAL]
+    streamed = asyncio.run(read_stream(_stream(pieces, sent, closed), should_abort=_is_refusal, check_chars=100))
+    assert not streamed.aborted
+    assert streamed.text == "".join(pieces)
+    assert streamed.first_token_seconds is not None
+
+
+def test_engine_retries_refused_stream(engine, tmp_path, monkeypatch):
+    import local_backend
+
+    lines = [f"第{i}行 他说了一些话。\n" for i in range(20)]
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(lines), encoding="utf-8")
+    respond = local_backend.LocalGenerativeModel._respond
+    refused, sent = [], []
+
+    async def no_sleep(delay_seconds):
+        return None
+
+    async def generate_content_async(self, contents=None, generation_config=None, stream=False, **kwargs):
+        response = respond(self, contents, generation_config)
+        if "第0行" in response.text and not refused:
+            # Lần đầu chunk 1 bị từ chối: output dài phía sau câu từ chối không được đọc
+            refused.append(True)
+            return _stream([REFUSAL] + ["Phần còn lại.\n"] * 50, sent, [])
+        return local_backend._LocalStream(response)
+
+    monkeypatch.setattr(local_backend.LocalGenerativeModel, "generate_content_async", generate_content_async)
+    monkeypatch.setattr(engine, "sleep_unless_stopped", no_sleep)
+
+    output_file = tmp_path / "book.out"
+    assert engine.translate_file_optimized(
+        str(input_file), str(output_file), api_key="k1", model_name="local-echo", chunk_size_lines=10,
+        use_translation_cache=False, rate_limit_tier="off", stream_responses=True,
+    )
+    assert len(sent) == 1
+    assert engine.get_translation_metrics()['streaming']['aborted_streams'] == 1
+    assert [line for line in output_file.read_text(encoding="utf-8").splitlines() if line.strip()] == [line.rstrip("\n") for line in lines]
@@ -0,0 +1,60 @@
+import json
+
+from structured_output import AlignedChunk, StructuredOutputStats, parse_structured_response
+
+CHUNK = ["第1行\n", "\n", "第2行\n", "第3行\n"]
+
+
+def _is_bad(text):
+    return not text.strip() or "xin lỗi" in text.lower()
+
+
+def test_parse_accepts_fenced_array_and_rejects_mismatch():
+    assert parse_structured_response('```json\n["a", "b"]\n```', 2) == ["a", "b"]
+    assert parse_structured_response('["a", "b"]', 3) is None
+    assert parse_structured_response('["a", 2]', 2) is None
+    assert parse_structured_response("không phải JSON", 1) is None
+
+
+def test_retry_sends_only_bad_lines():
+    aligned = AlignedChunk(CHUNK)
+    stats = StructuredOutputStats()
+    # Dòng trống không được gửi đi
+    assert aligned.pending_lines() == ["第1行", "第2行", "第3行"]
+
+    stats.record_request(aligned)
+    assert not aligned.accept(json.dumps(["Dòng 1", "Xin lỗi, tôi không thể dịch", "Dòng 3"]), _is_bad, stats)
+    assert aligned.pending_lines() == ["第2行"]
+
+    stats.record_request(aligned)
+    assert aligned.accept(json.dumps(["Dòng 2"]), _is_bad, stats)
+    assert aligned.assemble() == "Dòng 1\n\nDòng 2\nDòng 3\n"
+    assert stats.summary()['retried_lines'] == 1
+
+
+def test_mismatched_response_accepts_no_line():
+    aligned = AlignedChunk(CHUNK)
+    stats = StructuredOutputStats()
+    assert not aligned.accept(json.dumps(["Dòng 1 và 2", "Dòng 3"]), _is_bad, stats)
+    assert aligned.results == {}
+    assert stats.summary()['mismatches'] == 1
+
+
+def test_unfixed_lines_keep_source_or_last_attempt():
+    aligned = AlignedChunk(CHUNK)
+    aligned.accept(json.dumps(["Dòng 1", "Xin lỗi", "Dòng 3"]), _is_bad)
+    assert aligned.assemble(source_fallback=True) == "Dòng 1\n\n第2行\nDòng 3\n"
+    assert aligned.assemble() == "Dòng 1\n\nXin lỗi [KHÔNG CẢI THIỆN ĐƯỢC]\nDòng 3\n"
+
+
+def test_engine_structured_output_keeps_line_count(engine, tmp_path):
+    lines = [f"第{i}行 他说了一些话。\n" if i % 4 else "\n" for i in range(30)]
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(lines), encoding="utf-8")
+    output_file = tmp_path / "book.out"
+    assert engine.translate_file_optimized(
+        str(input_file), str(output_file), api_key="k1", model_name="local-echo", chunk_size_lines=10,
+        use_translation_cache=False, rate_limit_tier="off", structured_output=True, stream_responses=False,
+    )
+    assert output_file.read_text(encoding="utf-8").splitlines() == [line.rstrip("\n") for line in lines]
+    assert engine.get_translation_metrics()['structured_output']['mismatches'] == 0
@@ -0,0 +1,57 @@
+import time
+
+from translation_cache import TranslationCache, make_cache_key
+
+CHUNK = ["第1章 开始\n", "他说了一些话。\n"]
+
+
+def _key(chunk_lines, model_name="gemini-2.0-flash"):
+    return make_cache_key(chunk_lines, model_name, "Dịch sang tiếng Việt", "prompt")
+
+
+def test_key_ignores_line_endings_and_edge_blank_lines():
+    assert _key(CHUNK) == _key(["\n", "第1章 开始  \r\n", "他说了一些话。\r\n", "\n"])
+    assert _key(CHUNK) != _key(CHUNK, model_name="gemini-2.5-flash")
+    assert _key(CHUNK) != _key(CHUNK[:1])
+
+
+def test_translation_persists_across_runs(tmp_path):
+    path = str(tmp_path / "cache.db")
+    cache = TranslationCache(path)
+    assert cache.get(_key(CHUNK)) is None
+    cache.put(_key(CHUNK), "Chương 1 Bắt đầu\nHắn nói vài câu.")
+    cache.close()
+
+    cache = TranslationCache(path)
+    assert cache.get(_key(CHUNK)) == "Chương 1 Bắt đầu\nHắn nói vài câu."
+    assert cache.stats()['hits'] == 1
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = TranslationCache(str(tmp_path / "cache.db"), max_entries=10)
+    for i in range(10):
+        cache.put(f"k{i}", f"bản dịch {i}")
+        time.sleep(0.001)
+    # k0 vừa được dùng lại nên không bị xóa trước
+    cache.get("k0")
+    cache.put("k10", "bản dịch 10")
+    assert cache.get("k0") is not None
+    assert cache.get("k1") is None
+    assert cache.stats()['entries'] <= 10
+    cache.close()
+
+
+def test_second_run_is_served_from_cache(engine, tmp_path):
+    import local_backend
+
+    input_file = tmp_path / "book.txt"
+    input_file.write_text("".join(f"第{i}行 他说了一些话。\n" for i in range(40)), encoding="utf-8")
+    options = dict(api_key="k1", model_name="local-echo", chunk_size_lines=10, rate_limit_tier="off", translation_cache_path=str(tmp_path / "cache.db"))
+
+    assert engine.translate_file_optimized(str(input_file), str(tmp_path / "first.out"), **options)
+    requests_before = local_backend.local_stats['requests']
+    assert engine.translate_file_optimized(str(input_file), str(tmp_path / "second.out"), **options)
+    assert local_backend.local_stats['requests'] == requests_before
+    assert engine.get_translation_metrics()['translation_cache']['hits'] == 4
+    assert (tmp_path / "first.out").read_text(encoding="utf-8") == (tmp_path / "second.out").read_text(encoding="utf-8")
@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import pytest
+
+from streaming import read_stream
+from watchdog import ChunkWatchdog, RequestTimeoutError, finish_within, run_with_stop_grace
+
+GRACE = 0.5
+
+
+class _Part:
+    def __init__(self, text):
+        self.text = text
+
+
+async def _hanging_stream():
+    """Stream gửi một phần rồi treo, kể cả khi bị đóng (kết nối không trả lời)"""
+    try:
+        yield _Part("Chương 1\n")
+        await asyncio.sleep(3600)
+    finally:
+        await asyncio.sleep(3600)
+
+
+async def _nested_await_stream():
+    """Stream gửi một phần rồi chờ một task lồng bên trong (như gRPC aio): hủy phải qua nhiều vòng event loop"""
+    yield _Part("Chương 1\n")
+    await asyncio.ensure_future(asyncio.sleep(3600))
+
+
+def test_read_timeout_propagates_with_nested_await_stream():
+    async def read():
+        with pytest.raises(RequestTimeoutError):
+            await read_stream(_nested_await_stream(), read_timeout=0.1)
+
+    asyncio.run(read())
+
+
+def test_stop_with_hanging_stream_finishes_within_grace():
+    async def translate_then_stop():
+        task = asyncio.ensure_future(read_stream(_hanging_stream(), read_timeout=120.0))
+        await asyncio.sleep(0.05)
+        # Người dùng bấm dừng: hủy task, chỉ chờ trong thời gian cho phép
+        task.cancel()
+        await asyncio.wait({task}, timeout=GRACE)
+        return task.cancelled()
+
+    started = time.monotonic()
+    assert run_with_stop_grace(translate_then_stop(), grace=GRACE)
+    assert time.monotonic() - started < GRACE * 2 + 0.5
+
+
+def test_leftover_task_ignoring_cancel_does_not_block_return():
+    async def stubborn():
+        while True:
+            try:
+                await asyncio.sleep(3600)
+            except asyncio.CancelledError:
+                continue
+
+    async def main():
+        asyncio.ensure_future(stubborn())
+        await asyncio.sleep(0)
+        return "xong"
+
+    started = time.monotonic()
+    assert run_with_stop_grace(main(), grace=GRACE) == "xong"
+    assert time.monotonic() - started < GRACE + 0.5
+
+
+def test_finish_within_gives_up_without_waiting_for_cancel():
+    async def stuck_cleanup():
+        try:
+            await asyncio.sleep(3600)
+        finally:
+            await asyncio.sleep(3600)
+
+    async def main():
+        started = time.monotonic()
+        await finish_within(stuck_cleanup(), seconds=0.1)
+        return time.monotonic() - started
+
+    assert run_with_stop_grace(main(), grace=0.1) < 0.5
+
+
+def test_sent_at_starts_when_first_request_is_sent():
+    watchdog = ChunkWatchdog()
+    # Chunk còn chờ slot/rate limiter: chưa tính thời gian chạy (không gửi request dự phòng)
+    assert watchdog.sent_at(4) is None
+    first = watchdog.request_started(4)
+    sent_at = watchdog.sent_at(4)
+    watchdog.request_finished(first)
+    # Lần thử lại và bản sao của cùng chunk không đặt lại mốc thời gian
+    watchdog.request_finished(watchdog.request_started(4))
+    assert watchdog.sent_at(4) == sent_at
+    watchdog.forget_chunk(4)
+    assert watchdog.sent_at(4) is None